@@ -0,0 +1,242 @@
+import os
+import io
+import sys
+import json
+import time
+import glob
+import shutil
+import argparse
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import datetime
+import psycopg2
+import psycopg2.extensions
+import etl
+from sql_queries import create_table_queries
+from instrumentation import CountingConnection
+
+
+ADMIN_CONN_STRING = "host=127.0.0.1 dbname=studentdb user=student password=student"
+BENCH_DB = 'sparkifydb_bench'
+MODES = ['row', 'bulk', 'parallel']
+
+# tables filled by each stage
+STAGE_TABLES = {
+    'song_data': ['songs', 'artists'],
+    'log_data': ['time', 'users', 'songplays'],
+}
+
+
+# connections opened during a case, so writer connections are counted too
+opened_connections = []
+
+
+class TrackedConnection(CountingConnection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        opened_connections.append(self)
+
+
+def scale_data(src, dst, factor):
+    """
+    Copy the sample data `factor` times. Every copy gets its own song and
+    artist ids, and shifted timestamps and session ids, so row counts grow
+    with the factor instead of hitting the same keys.
+
+    Parameters
+    ---------
+    src: sample data directory with song_data and log_data.
+    dst: output directory.
+    factor: number of copies.
+
+    Returns
+    -------
+    number of bytes written.
+    """
+    size = 0
+    for stage in STAGE_TABLES:
+        for path in glob.glob(os.path.join(src, stage, '**', '*.json'), recursive=True):
+            rel = os.path.relpath(path, src)
+            with open(path, encoding='utf8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            for copy in range(factor):
+                out = os.path.join(dst, os.path.dirname(rel), '{}-{}.json'.format(copy, os.path.basename(rel)[:-5]))
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+                with open(out, 'w', encoding='utf8') as f:
+                    for record in records:
+                        f.write(json.dumps(shift_record(record, stage, copy)) + '\n')
+                size += os.path.getsize(out)
+    return size
+
+
+def shift_record(record, stage, copy):
+    if copy == 0:
+        return record
+    record = dict(record)
+    if stage == 'song_data':
+        record['song_id'] = '{}_{}'.format(record['song_id'], copy)
+        record['artist_id'] = '{}_{}'.format(record['artist_id'], copy)
+    else:
+        record['ts'] = record['ts'] + copy
+        record['sessionId'] = record['sessionId'] + copy * 100000
+    return record
+
+
+def create_bench_database(admin_conn_string, conn_string):
+    """
+    Drop and create the throwaway benchmark database and its tables.
+    """
+    conn = psycopg2.connect(admin_conn_string)
+    conn.set_session(autocommit=True)
+    cur = conn.cursor()
+    cur.execute("DROP DATABASE IF EXISTS {}".format(BENCH_DB))
+    cur.execute("CREATE DATABASE {} WITH ENCODING 'utf8' TEMPLATE template0".format(BENCH_DB))
+    conn.close()
+
+    conn = psycopg2.connect(conn_string)
+    cur = conn.cursor()
+    for query in create_table_queries:
+        cur.execute(query)
+    conn.commit()
+    conn.close()
+
+
+def table_counts(cur, tables):
+    counts = {}
+    for table in tables:
+        cur.execute('SELECT COUNT(*) FROM {}'.format(table))
+        counts[table] = cur.fetchone()[0]
+    return counts
+
+
+def run_case(mode, data_dir, conn_string, options):
+    """
+    Load the scaled data with one loader mode and measure every stage.
+
+    Parameters
+    ---------
+    mode: 'row', 'bulk' or 'parallel'.
+    data_dir: scaled data directory.
+    conn_string: benchmark database connection string.
+    options: dict of batch_size, workers and writers.
+
+    Returns
+    -------
+    dict of stage results and peak RSS.
+    """
+    conn = psycopg2.connect(conn_string, connection_factory=TrackedConnection)
+    cur = conn.cursor()
+    stages = {}
+    for stage, func_name in [('song_data', 'song'), ('log_data', 'log')]:
+        filepath = os.path.join(data_dir, stage)
+        before = sum(c.round_trips for c in opened_connections)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if mode == 'row':
+                func = etl.process_song_file if func_name == 'song' else etl.process_log_file
+                etl.process_data(cur, conn, filepath, func)
+            elif mode == 'bulk':
+                func = etl.process_song_files if func_name == 'song' else etl.process_log_files
+                etl.process_data_bulk(cur, conn, filepath, func, batch_size=options['batch_size'])
+            else:
+                etl.process_data_parallel(filepath, func_name, options['workers'], options['writers'],
+                                          options['batch_size'], conn_string=conn_string,
+                                          connection_factory=TrackedConnection)
+        wall = time.perf_counter() - start
+        round_trips = sum(c.round_trips for c in opened_connections) - before
+
+        rows = table_counts(conn.cursor(cursor_factory=psycopg2.extensions.cursor), STAGE_TABLES[stage])
+        conn.commit()
+        stages[stage] = {
+            'files': len(etl.get_files(filepath)),
+            'wall_s': round(wall, 4),
+            'round_trips': round_trips,
+            'rows': rows,
+            'rows_per_s': {table: round(count / wall, 1) if wall else None for table, count in rows.items()},
+        }
+    conn.close()
+
+    return {
+        'stages': stages,
+        'wall_s': round(sum(stage['wall_s'] for stage in stages.values()), 4),
+        # Linux reports kilobytes
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_rss_children_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def case_process(result_queue, *args):
+    try:
+        result_queue.put(run_case(*args))
+    except Exception as e:
+        result_queue.put({'error': repr(e)})
+
+
+def run_benchmark(admin_conn_string, conn_string, scales, modes, options, data_dir='data'):
+    """
+    Run every mode at every scale factor, each in a fresh process and a
+    fresh database, so timings and peak RSS do not carry over.
+
+    Returns
+    -------
+    report dict.
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for scale in scales:
+        scaled_dir = tempfile.mkdtemp(prefix='sparkify_bench_')
+        try:
+            data_bytes = scale_data(data_dir, scaled_dir, scale)
+            for mode in modes:
+                create_bench_database(admin_conn_string, conn_string)
+                result_queue = context.Queue()
+                process = context.Process(target=case_process,
+                                          args=(result_queue, mode, scaled_dir, conn_string, options))
+                process.start()
+                result = result_queue.get()
+                process.join()
+                result.update({'mode': mode, 'scale': scale, 'data_bytes': data_bytes})
+                results.append(result)
+                print('scale {} {}: {}s'.format(scale, mode, result.get('wall_s', result.get('error'))),
+                      file=sys.stderr)
+        finally:
+            shutil.rmtree(scaled_dir)
+
+    return {
+        'started_at': datetime.utcnow().isoformat() + 'Z',
+        'options': options,
+        'results': results,
+    }
+
+
+def main():
+    """
+    Benchmark the project_1 ETL against a throwaway database and write a JSON report.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the sparkifydb ETL.')
+    parser.add_argument('--admin-dsn', default=ADMIN_CONN_STRING, help='connection used to create the benchmark database')
+    parser.add_argument('--dsn', help='benchmark database connection, default admin dsn with dbname={}'.format(BENCH_DB))
+    parser.add_argument('--scale', type=int, nargs='+', default=[1], help='sample data scale factors')
+    parser.add_argument('--mode', choices=MODES, nargs='+', default=MODES, help='loader modes to run')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--output', help='JSON report path, default stdout')
+    args = parser.parse_args()
+
+    conn_string = args.dsn or psycopg2.extensions.make_dsn(args.admin_dsn, dbname=BENCH_DB)
+    options = {'batch_size': args.batch_size, 'workers': args.workers, 'writers': args.writers}
+    report = run_benchmark(args.admin_dsn, conn_string, args.scale, args.mode, options)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
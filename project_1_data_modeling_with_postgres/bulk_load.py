@@ -0,0 +1,140 @@
+import io
+from sql_queries import *
+
+
+# staging table, target columns, and merge query for every bulk loaded table
+STAGING_TABLES = {
+    'songs': ('songs_staging', song_staging_create, song_table_merge,
+              ['song_id', 'title', 'artist_id', 'year', 'duration']),
+    'artists': ('artists_staging', artist_staging_create, artist_table_merge,
+                ['artist_id', 'name', 'location', 'latitude', 'longitude']),
+    'time': ('time_staging', time_staging_create, time_table_merge,
+             ['start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday']),
+    'users': ('users_staging', user_staging_create, user_table_merge,
+              ['row_number', 'user_id', 'first_name', 'last_name', 'gender', 'level']),
+    'songplays': ('songplays_staging', songplay_staging_create, songplay_table_merge,
+                  ['row_number', 'start_time', 'user_id', 'level', 'song', 'artist', 'length',
+                   'session_id', 'location', 'user_agent']),
+}
+
+# songplays columns written by COPY, songplay_id is generated
+SONGPLAY_COLUMNS = ['start_time', 'user_id', 'level', 'song_id', 'artist_id', 'session_id', 'location', 'user_agent']
+
+# staging columns declared as INT or BIGINT
+INTEGER_COLUMNS = {'row_number', 'year', 'start_time', 'hour', 'day', 'week', 'month', 'weekday',
+                   'user_id', 'session_id'}
+
+
+def copy_dataframe(cur, df, table, columns):
+    """
+    Stream a DataFrame into a table with a single COPY.
+    Missing values are written as the \\N marker and read back as NULL,
+    so empty strings stay empty strings.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    df: pandas DataFrame, columns in the same order as `columns`.
+    table: target table name.
+    columns: target column names.
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+    cur.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(table, ', '.join(columns)), buffer)
+
+
+def bulk_upsert(cur, df, table):
+    """
+    Load a DataFrame into `table` through its staging table.
+    - Create the session staging table (once per session).
+    - COPY the rows into it.
+    - Merge them into the target table with one set-based upsert.
+    - Clear the staging table.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    df: pandas DataFrame, columns in staging table order.
+    table: target table name, a key of `STAGING_TABLES`.
+    """
+    if df.empty:
+        return
+    staging, staging_create, merge, columns = STAGING_TABLES[table]
+    df = df.copy()
+    df.columns = columns
+    # integer columns widened to float by missing values would be written as '1.0'
+    for column in INTEGER_COLUMNS.intersection(columns):
+        if df[column].dtype.kind == 'f':
+            df[column] = df[column].astype('Int64')
+
+    cur.execute(staging_create)
+    copy_dataframe(cur, df, staging, columns)
+    cur.execute(merge)
+    cur.execute('TRUNCATE {}'.format(staging))
+
+
+def load_song_frames(cur, song_df, artist_df):
+    """
+    Bulk load song and artist records.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    song_df: song records (song_id, title, artist_id, year, duration).
+    artist_df: artist records (artist_id, name, location, latitude, longitude).
+    """
+    bulk_upsert(cur, song_df, 'songs')
+    bulk_upsert(cur, artist_df, 'artists')
+
+
+def load_log_frames(cur, time_df, user_df, songplay_df, resolved=False):
+    """
+    Bulk load time, user and songplay records.
+    Users and songplays carry a leading row number that keeps the file order,
+    so the last level of a user wins and songplay ids follow the log order.
+    Songplays with already resolved song and artist ids skip the staging
+    lookup and are copied straight into songplays.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    time_df: time records (start_time, hour, day, week, month, year, weekday).
+    user_df: user records (user_id, first_name, last_name, gender, level).
+    songplay_df: songplay records (start_time, user_id, level, song, artist, length,
+        session_id, location, user_agent), or (start_time, user_id, level, song_id,
+        artist_id, session_id, location, user_agent) when `resolved`.
+    resolved: songplay_df holds song and artist ids.
+    """
+    bulk_upsert(cur, time_df, 'time')
+    load_user_frame(cur, user_df)
+    load_songplay_frame(cur, songplay_df, resolved)
+
+
+def load_user_frame(cur, user_df):
+    """
+    Bulk upsert user records, the last row of a user sets its level.
+    Reduce them with `etl.reduce_user_data` first, so each user is sent once.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    user_df: user records (user_id, first_name, last_name, gender, level).
+    """
+    bulk_upsert(cur, user_df.reset_index(drop=True).reset_index(), 'users')
+
+
+def load_songplay_frame(cur, songplay_df, resolved=False):
+    """
+    Bulk insert songplay records in frame order.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    songplay_df: songplay records, see `load_log_frames`.
+    resolved: songplay_df holds song and artist ids.
+    """
+    if resolved:
+        copy_dataframe(cur, songplay_df, 'songplays', SONGPLAY_COLUMNS)
+    else:
+        bulk_upsert(cur, songplay_df.reset_index(drop=True).reset_index(), 'songplays')
@@ -0,0 +1,73 @@
+import time
+
+
+class CommitPolicy:
+    """
+    Decides when a load commits: every `every_files` files, every
+    `every_rows` rows or every `every_seconds` seconds, whichever comes
+    first. Thresholds left as None are not checked.
+    """
+
+    def __init__(self, every_files=None, every_rows=None, every_seconds=None):
+        self.every_files = every_files
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.reset()
+
+    def reset(self):
+        """
+        Start counting towards the next commit.
+        """
+        self.files = 0
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def add(self, files, rows=0):
+        """
+        Count loaded files and rows.
+        """
+        self.files += files
+        self.rows += rows or 0
+
+    def due(self):
+        """
+        Whether the files and rows loaded since the last commit should be committed.
+        """
+        if self.files == 0:
+            return False
+        if self.every_files is not None and self.files >= self.every_files:
+            return True
+        if self.every_rows is not None and self.rows >= self.every_rows:
+            return True
+        if self.every_seconds is not None and time.monotonic() - self.started >= self.every_seconds:
+            return True
+        return False
+
+    @property
+    def pending(self):
+        return self.files > 0
+
+
+def load_in_savepoint(cur, func, *args):
+    """
+    Run a load function under a savepoint, so a failure rolls back only
+    its own rows and leaves the rest of the transaction intact.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    func: load function.
+    args: arguments of `func`.
+
+    Returns
+    -------
+    (result of `func`, None) on success, (None, exception) on failure.
+    """
+    cur.execute('SAVEPOINT load_file')
+    try:
+        result = func(*args)
+    except Exception as e:
+        cur.execute('ROLLBACK TO SAVEPOINT load_file')
+        return None, e
+    cur.execute('RELEASE SAVEPOINT load_file')
+    return result, None
@@ -0,0 +1,37 @@
+import os
+import pytest
+import psycopg2
+import psycopg2.extensions
+from sql_queries import create_table_queries
+
+
+# connection used to create the test database, as in benchmark.py
+ADMIN_CONN_STRING = os.environ.get('SPARKIFY_TEST_ADMIN_DSN',
+                                   "host=127.0.0.1 dbname=studentdb user=student password=student")
+TEST_DB = 'sparkifydb_test'
+
+
+@pytest.fixture
+def conn():
+    """
+    Connection to a fresh sparkifydb_test database with the sparkify tables.
+    Tests using it are skipped when no Postgres is reachable through
+    SPARKIFY_TEST_ADMIN_DSN.
+    """
+    try:
+        admin = psycopg2.connect(ADMIN_CONN_STRING)
+    except psycopg2.OperationalError as e:
+        pytest.skip('no test database: {}'.format(str(e).strip()))
+    admin.set_session(autocommit=True)
+    admin.cursor().execute("DROP DATABASE IF EXISTS {}".format(TEST_DB))
+    admin.cursor().execute("CREATE DATABASE {} WITH ENCODING 'utf8' TEMPLATE template0".format(TEST_DB))
+
+    conn = psycopg2.connect(psycopg2.extensions.make_dsn(ADMIN_CONN_STRING, dbname=TEST_DB))
+    cur = conn.cursor()
+    for query in create_table_queries:
+        cur.execute(query)
+    conn.commit()
+    yield conn
+    conn.close()
+    admin.cursor().execute("DROP DATABASE IF EXISTS {}".format(TEST_DB))
+    admin.close()
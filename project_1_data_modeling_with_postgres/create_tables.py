@@ -1,5 +1,7 @@
+import argparse
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, partitioned_create_table_queries
+from partitions import maintain_partitions
 
 
 def create_database():
@@ -36,17 +38,33 @@ def drop_tables(cur, conn):
         conn.commit()
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, queries=create_table_queries):
     """
-    Creates each table using the queries in `create_table_queries` list. 
+    Creates each table using the queries in `create_table_queries` list,
+    or `partitioned_create_table_queries` for the indexed, partitioned schema.
     """
-    for query in create_table_queries:
+    for query in queries:
         cur.execute(query)
         conn.commit()
 
 
+def create_partitions(cur, conn, months_ahead=3):
+    """
+    Creates the monthly songplays partitions from the current month to
+    `months_ahead` months later, and for the months of rows held by the
+    default partition, moving those rows to their partition.
+    """
+    created = maintain_partitions(cur, months_ahead)
+    conn.commit()
+    for name in created:
+        print('created partition {}'.format(name))
+
+
 def main():
     """
+    - With --maintain-partitions, only creates the missing songplays
+    partitions of the existing database.
+
     - Drops (if exists) and Creates the sparkify database. 
     
     - Establishes connection with the sparkify database and gets
@@ -54,14 +72,33 @@ def main():
     
     - Drops all the tables.  
     
-    - Creates all tables needed. 
+    - Creates all tables needed, with --partitioned the indexed schema
+    with songplays partitioned by month.
     
     - Finally, closes the connection. 
     """
+    parser = argparse.ArgumentParser(description='Create the sparkifydb tables.')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='index the song lookups and partition songplays by month of start_time')
+    parser.add_argument('--maintain-partitions', action='store_true',
+                        help='create missing songplays partitions without recreating the database')
+    parser.add_argument('--months-ahead', type=int, default=3, help='partitions created ahead of the current month')
+    args = parser.parse_args()
+
+    if args.maintain_partitions:
+        conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+        create_partitions(conn.cursor(), conn, args.months_ahead)
+        conn.close()
+        return
+
     cur, conn = create_database()
     
     drop_tables(cur, conn)
-    create_tables(cur, conn)
+    if args.partitioned:
+        create_tables(cur, conn, partitioned_create_table_queries)
+        create_partitions(cur, conn, args.months_ahead)
+    else:
+        create_tables(cur, conn)
 
     conn.close()
 
@@ -1,132 +1,788 @@
 import os
 import glob
+import argparse
+import functools
 import psycopg2
-import pandas as pd
 from sql_queries import *
+from bulk_load import load_song_frames, load_user_frame, load_songplay_frame, bulk_upsert
+from instrumentation import Metrics, JsonLinesSink, PrometheusSink, CountingConnection, NO_METRICS
+from song_index import SongIndex
+from manifest import Manifest
+from time_dimension import TimeDimension, build_time_frame
+from readers import SONG_SCHEMA, LOG_SCHEMA, iter_json_batches, read_json_files, read_json_chunks
+from parallel import process_files_parallel
+from commit_policy import CommitPolicy, load_in_savepoint
+from partitions import is_partitioned, maintain_partitions
+from rollups import refresh_rollups
 
+CONN_STRING = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
 
-def process_song_file(cur, filepath):
+USER_COLUMNS = ['userId', 'firstName', 'lastName', 'gender', 'level']
+SONGPLAY_COLUMNS = ['ts', 'userId', 'level', 'song', 'artist', 'length', 'sessionId', 'location', 'userAgent']
+
+
+def transform_song_data(df):
+    """
+    Extract song and artist records from song data.
+
+    Parameters
+    ---------
+    df: song data DataFrame.
+
+    Returns
+    -------
+    song DataFrame and artist DataFrame.
+    """
+    song_df = df[['song_id', 'title', 'artist_id', 'year', 'duration']]
+    artist_df = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']]
+    return song_df, artist_df
+
+
+def frame_rows(df):
+    """
+    Rows of a DataFrame as lists, with missing values as None, so they are
+    stored as NULL like the \\N marker of the bulk COPY, not as NaN.
+
+    Parameters
+    ---------
+    df: DataFrame.
+
+    Returns
+    -------
+    list of row value lists.
+    """
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+def filter_log_data(df):
+    """
+    Keep NextSong events of log data.
+
+    Parameters
+    ---------
+    df: log data DataFrame.
+
+    Returns
+    -------
+    log data DataFrame of NextSong events.
+    """
+    return df[df.page == 'NextSong']
+
+
+def reduce_user_data(df):
+    """
+    Extract one user record per distinct user, with the level of its latest event.
+    Events with the same timestamp keep their order in the log.
+
+    Parameters
+    ---------
+    df: log data DataFrame of NextSong events.
+
+    Returns
+    -------
+    user DataFrame ordered by userId.
+    """
+    df = df.sort_values('ts', kind='stable').drop_duplicates('userId', keep='last')
+    return df[USER_COLUMNS].sort_values('userId')
+
+
+def transform_log_data(df):
+    """
+    Extract time, user and songplay records from log data.
+    - Filter page attribute is NextSong.
+    - Split distinct timestamps into time units.
+    - Keep the latest level of each user.
+
+    Parameters
+    ---------
+    df: log data DataFrame.
+
+    Returns
+    -------
+    time DataFrame, user DataFrame and songplay DataFrame.
+    """
+    # filter by NextSong action
+    df = filter_log_data(df)
+
+    # time data records
+    time_df = build_time_frame(df['ts'])
+
+    # user records
+    user_df = reduce_user_data(df)
+
+    # songplay records, song and artist ids are resolved on load
+    songplay_df = df[SONGPLAY_COLUMNS]
+
+    return time_df, user_df, songplay_df
+
+
+def resolve_songplays(cur, songplay_df, song_index):
+    """
+    Replace song, artist and length of songplay records with song_id and
+    artist_id resolved by the in-memory song index.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    songplay_df: songplay DataFrame from `transform_log_data`.
+    song_index: SongIndex.
+
+    Returns
+    -------
+    songplay DataFrame in songplays column order.
+    """
+    ids = song_index.resolve(cur, songplay_df)
+    df = songplay_df.join(ids)
+    return df[['ts', 'userId', 'level', 'song_id', 'artist_id', 'sessionId', 'location', 'userAgent']]
+
+
+def read_stage(chunks, metrics):
     """
-    ETL of song json file. 
+    Iterate over DataFrame chunks, timing each read as the 'read' stage.
+    """
+    while True:
+        with metrics.stage('read'):
+            df = next(chunks, None)
+        if df is None:
+            return
+        metrics.rows('read', len(df))
+        yield df
+
+
+def process_song_file(cur, filepath, song_index=None, metrics=NO_METRICS):
+    """
+    ETL of song json file.
     - Read song json file.
     - Extract song and artist meta data.
     - Insert into respective tables.
-    
+
     Parameters
     ---------
     cur: psycopg2 cursor object.
     filepath: song json file path.
+    song_index: SongIndex updated with the new songs, optional.
+    metrics: Metrics recording the stages, optional.
+
+    Returns
+    -------
+    number of song records.
     """
     # open song file
-    df = pd.read_json(filepath, lines=True)
+    with metrics.stage('read'):
+        df = read_json_files([filepath], SONG_SCHEMA)
+        song_df, artist_df = transform_song_data(df)
+    metrics.rows('read', len(df))
 
     # insert song record
-    song_data = df[['song_id', 'title', 'artist_id', 'year', 'duration']].values.tolist()[0]
-    cur.execute(song_table_insert, song_data)
-    
+    with metrics.stage('songs', cur):
+        song_data = frame_rows(song_df)[0]
+        cur.execute(song_table_insert, song_data)
+    metrics.rows('songs', 1)
+
     # insert artist record
-    artist_data = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']].values.tolist()[0]
-    cur.execute(artist_table_insert, artist_data)
+    with metrics.stage('artists', cur):
+        artist_data = frame_rows(artist_df)[0]
+        cur.execute(artist_table_insert, artist_data)
+    metrics.rows('artists', 1)
 
+    if song_index is not None:
+        with metrics.stage('song index'):
+            song_index.add(song_df, artist_df)
 
-def process_log_file(cur, filepath):
+    return len(song_df)
+
+
+def process_log_file(cur, filepath, song_index=None, time_dim=None, metrics=NO_METRICS):
     """
-    ETL of log json file. 
+    ETL of log json file.
     - Read log json file.
     - Filter page attribute is NestSong.
     - Extract timestamp, user, and log meta data.
     - Insert into respective tables.
-    
+
     Parameters
     ---------
     cur: psycopg2 cursor object.
     filepath: log json file path.
+    song_index: SongIndex resolving song and artist ids instead of song_select, optional.
+    time_dim: TimeDimension writing only timestamps not loaded yet, in bulk, optional.
+    metrics: Metrics recording the stages, optional.
+
+    Returns
+    -------
+    number of NextSong events loaded.
     """
-    # open log file
-    df = pd.read_json(filepath, lines=True)
+    rows = 0
 
-    # filter by NextSong action
-    df = df[df.page == 'NextSong']
+    # open log file in bounded chunks
+    for df in read_stage(read_json_chunks(filepath, LOG_SCHEMA), metrics):
+
+        # filter by NextSong action
+        with metrics.stage('filter'):
+            df = filter_log_data(df)
+        metrics.rows('filter', len(df))
+
+        load_log_rows(cur, df, song_index, time_dim, metrics)
+        rows += len(df)
 
-    # convert timestamp column to datetime
-    t = pd.to_datetime(df['ts'], unit='ms')
-    
+    return rows
+
+
+def load_log_rows(cur, df, song_index=None, time_dim=None, metrics=NO_METRICS):
+    """
+    Insert time and songplay records one row at a time, and upsert the
+    users with one bulk statement.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    df: log data DataFrame of NextSong events.
+    song_index: SongIndex resolving song and artist ids instead of song_select, optional.
+    time_dim: TimeDimension writing only timestamps not loaded yet, in bulk, optional.
+    metrics: Metrics recording the stages, optional.
+    """
     # insert time data records
-    time_data = (df['ts'], t.dt.hour, t.dt.day, t.dt.isocalendar().week, t.dt.month, t.dt.year, t.dt.weekday)
-    column_labels = ('timestamp', 'hour', 'day', 'week', 'month', 'year', 'weekday')
-    time_df = pd.DataFrame(dict(zip(column_labels, time_data)))
+    with metrics.stage('time', cur):
+        time_df = build_time_frame(df['ts'])
+        if time_dim is not None:
+            rows = time_dim.load(cur, time_df)
+        else:
+            for i, row in time_df.iterrows():
+                cur.execute(time_table_insert, list(row))
+            rows = len(time_df)
+    metrics.rows('time', rows)
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
+    # insert user records, one per distinct user
+    with metrics.stage('users', cur):
+        user_df = reduce_user_data(df)
+        load_user_frame(cur, user_df)
+    metrics.rows('users', len(user_df))
 
-    # load user table
-    user_df = df[['userId', 'firstName', 'lastName', 'gender', 'level']]
+    songplay_df = df[SONGPLAY_COLUMNS]
 
-    # insert user records
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
+    # get songid and artistid from the song index, or from song and artist tables
+    with metrics.stage('song lookup', cur):
+        if song_index is not None:
+            ids = song_index.resolve(cur, songplay_df)
+            matches = list(zip(ids['song_id'], ids['artist_id']))
+        else:
+            matches = []
+            for index, row in songplay_df.iterrows():
+                cur.execute(song_select, (row.song, row.artist, row.length))
+                results = cur.fetchone()
+                matches.append(results if results else (None, None))
+    metrics.rows('song lookup', len(songplay_df))
 
     # insert songplay records
-    for index, row in df.iterrows():
-        
-        # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
-        
-        if results:
-            songid, artistid = results
-        else:
-            songid, artistid = None, None
+    with metrics.stage('songplays', cur):
+        for (index, row), (songid, artistid) in zip(songplay_df.iterrows(), matches):
+            songplay_data = (row.ts, row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
+            cur.execute(songplay_table_insert, songplay_data)
+    metrics.rows('songplays', len(songplay_df))
 
-        # insert songplay record
-        songplay_data = (row.ts, row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
-        cur.execute(songplay_table_insert, songplay_data)
 
+def parse_song_files(filepaths):
+    """
+    Read song json files and extract song and artist records.
 
-def process_data(cur, conn, filepath, func):
+    Parameters
+    ---------
+    filepaths: song json file paths.
+
+    Returns
+    -------
+    song DataFrame and artist DataFrame.
+    """
+    df = read_json_files(filepaths, SONG_SCHEMA)
+    return transform_song_data(df)
+
+
+def parse_log_files(filepaths):
+    """
+    Read log json files and extract time, user and songplay records.
+
+    Parameters
+    ---------
+    filepaths: log json file paths.
+
+    Returns
+    -------
+    time DataFrame, user DataFrame and songplay DataFrame.
+    """
+    df = read_json_files(filepaths, LOG_SCHEMA)
+    return transform_log_data(df)
+
+
+def process_song_files(cur, filepaths, song_index=None, metrics=NO_METRICS):
+    """
+    Bulk ETL of song json files.
+    - Read all song json files into one typed DataFrame.
+    - Extract song and artist meta data.
+    - COPY into staging tables and upsert into respective tables.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    filepaths: song json file paths.
+    song_index: SongIndex updated with the new songs, optional.
+    metrics: Metrics recording the stages, optional.
+
+    Returns
+    -------
+    number of song records.
+    """
+    with metrics.stage('read'):
+        song_df, artist_df = parse_song_files(filepaths)
+    metrics.rows('read', len(song_df))
+
+    with metrics.stage('songs', cur):
+        bulk_upsert(cur, song_df, 'songs')
+    metrics.rows('songs', len(song_df))
+
+    with metrics.stage('artists', cur):
+        bulk_upsert(cur, artist_df, 'artists')
+    metrics.rows('artists', len(artist_df))
+
+    if song_index is not None:
+        with metrics.stage('song index'):
+            song_index.add(song_df, artist_df)
+
+    return len(song_df)
+
+
+def process_log_files(cur, filepaths, song_index=None, time_dim=None, chunk_rows=100000, metrics=NO_METRICS):
+    """
+    Bulk ETL of log json files.
+    - Stream log json files in chunks of at most `chunk_rows` events.
+    - Extract timestamp, user, and log meta data.
+    - COPY into staging tables and upsert into respective tables.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    filepaths: log json file paths.
+    song_index: SongIndex resolving song and artist ids instead of a SQL lookup, optional.
+    time_dim: TimeDimension writing only timestamps not loaded yet, optional.
+    chunk_rows: maximum events held in memory.
+    metrics: Metrics recording the stages, optional.
+
+    Returns
+    -------
+    number of NextSong events loaded.
+    """
+    rows = 0
+    for df in read_stage(iter_json_batches(filepaths, LOG_SCHEMA, batch_rows=chunk_rows), metrics):
+        with metrics.stage('filter'):
+            df = filter_log_data(df)
+        metrics.rows('filter', len(df))
+
+        with metrics.stage('time', cur):
+            time_df = build_time_frame(df['ts'])
+            if time_dim is not None:
+                time_df = time_dim.new_rows(cur, time_df)
+            bulk_upsert(cur, time_df, 'time')
+        metrics.rows('time', len(time_df))
+
+        with metrics.stage('users', cur):
+            user_df = reduce_user_data(df)
+            load_user_frame(cur, user_df)
+        metrics.rows('users', len(user_df))
+
+        songplay_df = df[SONGPLAY_COLUMNS]
+        if song_index is not None:
+            with metrics.stage('song lookup', cur):
+                songplay_df = resolve_songplays(cur, songplay_df, song_index)
+            metrics.rows('song lookup', len(songplay_df))
+
+        # without a song index, song ids are looked up by the songplays merge
+        with metrics.stage('songplays', cur):
+            load_songplay_frame(cur, songplay_df, resolved=song_index is not None)
+        metrics.rows('songplays', len(songplay_df))
+        rows += len(songplay_df)
+
+    return rows
+
+
+def get_files(filepath):
+    """
+    Get all json file paths under a directory.
+
+    Parameters
+    ---------
+    filepath: data directory.
+
+    Returns
+    -------
+    list of absolute json file paths, sorted so log files load in date order.
+    """
+    all_files = []
+    for root, dirs, files in os.walk(filepath):
+        files = glob.glob(os.path.join(root,'*.json'))
+        for f in files :
+            all_files.append(os.path.abspath(f))
+    return sorted(all_files)
+
+
+def select_files(cur, conn, filepath, manifest=None):
+    """
+    Get the json files to load, only new ones with a manifest.
+    Files changed since they were loaded are reported and skipped.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    conn: psycopg2 connect object.
+    filepath: data directory.
+    manifest: Manifest of ingested files, optional.
+
+    Returns
+    -------
+    list of absolute json file paths.
+    """
+    all_files = get_files(filepath)
+    if manifest is None:
+        return all_files
+
+    files = manifest.pending(cur, all_files)
+    conn.commit()
+    print('{} of {} files in {} already loaded'.format(len(all_files) - len(files), len(all_files), filepath))
+    for datafile in manifest.changed:
+        print('skipped {}: changed since it was loaded'.format(datafile))
+    return files
+
+
+def report_failure(datafile, error, caches):
+    """
+    Report a file that failed to load and reset caches that may hold its rows.
+    """
+    print('failed to load {}: {!r}'.format(datafile, error))
+    for cache in caches:
+        cache.reset()
+
+
+def process_data(cur, conn, filepath, func, manifest=None, metrics=NO_METRICS, commit_policy=None, caches=()):
     """
     ETL of Sparkify data.
     - Read files.
     - Extract meta data.
     - Insert into respective tables.
-    
+
     Parameters
     ---------
     cur: psycopg2 cursor object.
     conn: psycopg2 connect object.
     filepath: json file path.
     func: ETL function.
+    manifest: Manifest, skip loaded files and record each file in its own transaction, optional.
+    metrics: Metrics recording each file, pass the same one to `func` for its stages, optional.
+    commit_policy: CommitPolicy, commit every few files instead of after each one. Each file
+        then runs under a savepoint, and a failing file is rolled back and reported alone.
+    caches: objects with a `reset` method, such as TimeDimension, reset when a file rolls back.
+
+    Returns
+    -------
+    list of (file path, exception) of files that failed to load.
     """
     # get all files matching extension from directory
-    all_files = []
-    for root, dirs, files in os.walk(filepath):
-        files = glob.glob(os.path.join(root,'*.json'))
-        for f in files :
-            all_files.append(os.path.abspath(f))
+    all_files = select_files(cur, conn, filepath, manifest)
 
     # get total number of files found
     num_files = len(all_files)
     print('{} files found in {}'.format(num_files, filepath))
 
     # iterate over files and process
+    failed = []
     for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
-        conn.commit()
+        with metrics.file(datafile):
+            if commit_policy is None:
+                func(cur, datafile)
+                with metrics.stage('commit', cur):
+                    if manifest is not None:
+                        manifest.record(cur, datafile)
+                    conn.commit()
+            else:
+                rows, error = load_in_savepoint(cur, func, cur, datafile)
+                if error is not None:
+                    report_failure(datafile, error, caches)
+                    failed.append((datafile, error))
+                else:
+                    if manifest is not None:
+                        manifest.record(cur, datafile)
+                    commit_policy.add(1, rows)
+                if commit_policy.due():
+                    with metrics.stage('commit', cur):
+                        conn.commit()
+                    commit_policy.reset()
         print('{}/{} files processed.'.format(i, num_files))
 
+    if commit_policy is not None:
+        conn.commit()
+        commit_policy.reset()
+    return failed
+
+
+def process_data_bulk(cur, conn, filepath, func, batch_size=100, manifest=None, metrics=NO_METRICS,
+                      commit_policy=None, caches=()):
+    """
+    Bulk ETL of Sparkify data.
+    - Read files in groups of `batch_size`.
+    - Load every group with a few COPY and upsert statements per table.
+    - Commit once per group.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    conn: psycopg2 connect object.
+    filepath: json file path.
+    func: bulk ETL function taking a list of file paths.
+    batch_size: number of files loaded per transaction.
+    manifest: Manifest, skip loaded files and record each batch in its own transaction, optional.
+    metrics: Metrics recording each batch, pass the same one to `func` for its stages, optional.
+    commit_policy: CommitPolicy, commit every few batches instead of after each one. Each batch
+        then runs under a savepoint; when it fails its files are retried one by one, each under
+        its own savepoint, so only the failing files are rolled back and reported.
+    caches: objects with a `reset` method, such as TimeDimension, reset when a load rolls back.
+
+    Returns
+    -------
+    list of (file path, exception) of files that failed to load.
+    """
+    all_files = select_files(cur, conn, filepath, manifest)
+
+    num_files = len(all_files)
+    print('{} files found in {}'.format(num_files, filepath))
+
+    failed = []
+    for start in range(0, num_files, batch_size):
+        batch = all_files[start:start + batch_size]
+        with metrics.file(batch):
+            if commit_policy is None:
+                func(cur, batch)
+                with metrics.stage('commit', cur):
+                    if manifest is not None:
+                        for datafile in batch:
+                            manifest.record(cur, datafile)
+                    conn.commit()
+            else:
+                rows, error = load_in_savepoint(cur, func, cur, batch)
+                if error is None:
+                    loaded = [(batch, rows)]
+                else:
+                    for cache in caches:
+                        cache.reset()
+                    # isolate the failing files
+                    loaded = []
+                    for datafile in batch:
+                        rows, error = load_in_savepoint(cur, func, cur, [datafile])
+                        if error is not None:
+                            report_failure(datafile, error, caches)
+                            failed.append((datafile, error))
+                        else:
+                            loaded.append(([datafile], rows))
+
+                for files, rows in loaded:
+                    if manifest is not None:
+                        for datafile in files:
+                            manifest.record(cur, datafile)
+                    commit_policy.add(len(files), rows)
+                if commit_policy.due():
+                    with metrics.stage('commit', cur):
+                        conn.commit()
+                    commit_policy.reset()
+        print('{}/{} files processed.'.format(start + len(batch), num_files))
+
+    if commit_policy is not None:
+        conn.commit()
+        commit_policy.reset()
+    return failed
+
+
+def load_log_users(cur, frames):
+    """
+    Bulk load the user records of parsed log files.
+    """
+    time_df, user_df, songplay_df = frames
+    load_user_frame(cur, user_df)
+
+
+def load_log_events(cur, frames, time_dim=None):
+    """
+    Bulk load the time and songplay records of parsed log files.
+    With a TimeDimension only timestamps not loaded yet are written.
+    """
+    time_df, user_df, songplay_df = frames
+    if time_dim is not None:
+        time_df = time_dim.new_rows(cur, time_df)
+    bulk_upsert(cur, time_df, 'time')
+    load_songplay_frame(cur, songplay_df)
+
+
+def process_data_parallel(filepath, kind, workers=4, writers=2, batch_size=50, queue_size=8,
+                          conn_string=CONN_STRING, manifest=None, time_dim=None, connection_factory=None):
+    """
+    Parallel ETL of Sparkify data.
+    - Parse files in `workers` processes.
+    - Load them through `writers` connections with COPY and upserts.
+    Loaded rows match the serial load. Songplay ids are assigned in commit
+    order, so they follow the file order only with a single writer.
+
+    Parameters
+    ---------
+    filepath: json file path.
+    kind: 'song' or 'log'.
+    workers: number of parser processes.
+    writers: number of writer connections.
+    batch_size: files per batch and writer transaction.
+    queue_size: maximum parsed batches waiting for a writer.
+    conn_string: connection string of each writer connection.
+    manifest: Manifest, skip loaded files and record each batch with its rows, optional.
+    time_dim: TimeDimension shared by the writers, optional.
+    connection_factory: psycopg2 connection class of the writers, optional.
+    """
+    connect = functools.partial(psycopg2.connect, conn_string, connection_factory=connection_factory)
+
+    conn = connect()
+    all_files = select_files(conn.cursor(), conn, filepath, manifest)
+    conn.close()
+    print('{} files found in {}'.format(len(all_files), filepath))
+
+    record = None
+    if manifest is not None:
+        def record(cur, batch):
+            for datafile in batch:
+                manifest.record(cur, datafile)
+
+    if kind == 'song':
+        process_files_parallel(connect, all_files, parse_song_files, lambda cur, frames: load_song_frames(cur, *frames),
+                               record=record, workers=workers, writers=writers, batch_size=batch_size,
+                               queue_size=queue_size)
+    else:
+        # users are upserted in file order so the last level wins as in the serial load
+        write = functools.partial(load_log_events, time_dim=time_dim)
+        process_files_parallel(connect, all_files, parse_log_files, write, ordered_write=load_log_users,
+                               record=record, workers=workers, writers=writers, batch_size=batch_size,
+                               queue_size=queue_size)
+
+
+def maintain_songplay_partitions(cur, conn):
+    """
+    Move songplays of months without a partition out of the default
+    partition, when songplays uses the partitioned schema.
+    """
+    if is_partitioned(cur):
+        for name in maintain_partitions(cur):
+            print('created partition {}'.format(name))
+    conn.commit()
+
+
+def refresh_analytics(cur, conn):
+    """
+    Add the songplays of this run to the rollup tables.
+    """
+    added = refresh_rollups(cur)
+    conn.commit()
+    if added is not None:
+        print('rollups refreshed with songplays {}-{}'.format(*added))
+
 
 def main():
     """
     Connect database and process ETL process.
     """
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    parser = argparse.ArgumentParser(description='Load song and log data into sparkifydb.')
+    parser.add_argument('--bulk', action='store_true', help='load files with COPY and set-based upserts')
+    parser.add_argument('--batch-size', type=int, default=100, help='files per bulk transaction')
+    parser.add_argument('--song-index', action='store_true', help='resolve songplays with an in-memory song index')
+    parser.add_argument('--song-index-size', type=int, help='maximum keys held by the song index, default all')
+    parser.add_argument('--workers', type=int, default=0, help='parse files in this many processes (parallel mode)')
+    parser.add_argument('--writers', type=int, default=2, help='writer connections in parallel mode')
+    parser.add_argument('--incremental', action='store_true', help='load only files not in the ingestion manifest')
+    parser.add_argument('--time-cache', action='store_true', help='write only timestamps not loaded yet, in bulk')
+    parser.add_argument('--metrics-jsonl', help='append per-file stage metrics to this JSON-lines file')
+    parser.add_argument('--metrics-prom', help='write run totals in Prometheus text format to this file')
+    parser.add_argument('--slow-file-seconds', type=float, help='log files taking longer than this')
+    parser.add_argument('--commit-every-files', type=int, help='commit every N files (or batches of files)')
+    parser.add_argument('--commit-every-rows', type=int, help='commit every N rows')
+    parser.add_argument('--commit-every-seconds', type=float, help='commit every T seconds')
+    args = parser.parse_args()
+    if args.workers:
+        # parallel writers commit one transaction per batch and resolve songplays in SQL
+        serial_only = [('--song-index', args.song_index), ('--song-index-size', args.song_index_size),
+                       ('--metrics-jsonl', args.metrics_jsonl), ('--metrics-prom', args.metrics_prom),
+                       ('--slow-file-seconds', args.slow_file_seconds),
+                       ('--commit-every-files', args.commit_every_files),
+                       ('--commit-every-rows', args.commit_every_rows),
+                       ('--commit-every-seconds', args.commit_every_seconds)]
+        given = [flag for flag, value in serial_only if value]
+        if given:
+            parser.error('--workers cannot be combined with {}'.format(', '.join(given)))
+
+    metrics = NO_METRICS
+    if args.metrics_jsonl or args.metrics_prom or args.slow_file_seconds:
+        metrics = Metrics(slow_file_seconds=args.slow_file_seconds)
+        if args.metrics_jsonl:
+            metrics.add_sink(JsonLinesSink(args.metrics_jsonl))
+        if args.metrics_prom:
+            metrics.add_sink(PrometheusSink(args.metrics_prom))
+
+    # statement counts need a counting connection
+    conn = psycopg2.connect(CONN_STRING, connection_factory=CountingConnection)
     cur = conn.cursor()
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    manifest = None
+    if args.incremental:
+        manifest = Manifest.load(cur)
+        conn.commit()
+
+    time_dim = TimeDimension() if args.time_cache else None
+
+    commit_policy = None
+    if args.commit_every_files or args.commit_every_rows or args.commit_every_seconds:
+        commit_policy = CommitPolicy(args.commit_every_files, args.commit_every_rows, args.commit_every_seconds)
+    caches = [time_dim] if time_dim is not None else []
+
+    if args.workers:
+        process_data_parallel('data/song_data', 'song', args.workers, args.writers, args.batch_size, manifest=manifest)
+        process_data_parallel('data/log_data', 'log', args.workers, args.writers, args.batch_size, manifest=manifest,
+                              time_dim=time_dim)
+        maintain_songplay_partitions(cur, conn)
+        refresh_analytics(cur, conn)
+        conn.close()
+        return
 
+    if args.bulk:
+        song_func, log_func = process_song_files, process_log_files
+        load = functools.partial(process_data_bulk, batch_size=args.batch_size, manifest=manifest, metrics=metrics,
+                                 commit_policy=commit_policy, caches=caches)
+    else:
+        song_func, log_func = process_song_file, process_log_file
+        load = functools.partial(process_data, manifest=manifest, metrics=metrics,
+                                 commit_policy=commit_policy, caches=caches)
+    song_func = functools.partial(song_func, metrics=metrics)
+    log_func = functools.partial(log_func, metrics=metrics)
+
+    failed = load(cur, conn, filepath='data/song_data', func=song_func)
+
+    if args.song_index:
+        # built once after the song pass, every song file is loaded by then
+        song_index = SongIndex.build(cur, max_entries=args.song_index_size)
+        log_func = functools.partial(log_func, song_index=song_index)
+
+    if time_dim is not None:
+        log_func = functools.partial(log_func, time_dim=time_dim)
+
+    failed += load(cur, conn, filepath='data/log_data', func=log_func)
+
+    maintain_songplay_partitions(cur, conn)
+    refresh_analytics(cur, conn)
     conn.close()
+    metrics.close()
+
+    if failed:
+        print('{} files failed to load:'.format(len(failed)))
+        for datafile, error in failed:
+            print('  {}: {!r}'.format(datafile, error))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
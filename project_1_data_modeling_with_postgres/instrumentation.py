@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+import psycopg2.extensions
+
+
+logger = logging.getLogger('etl')
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """
+    Connection counting its round trips to the server: statements,
+    COPY operations and commits.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.round_trips = 0
+        self.cursor_factory = CountingCursor
+
+    def commit(self):
+        self.round_trips += 1
+        super().commit()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+
+    def execute(self, query, vars=None):
+        self.connection.round_trips += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        self.connection.round_trips += len(vars_list)
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.connection.round_trips += 1
+        return super().copy_expert(sql, file, size)
+
+
+def round_trips(cur):
+    """
+    Round trips made so far on the cursor's connection, None when the
+    connection is not a CountingConnection.
+    """
+    if cur is None:
+        return None
+    return getattr(cur.connection, 'round_trips', None)
+
+
+class JsonLinesSink:
+    """
+    Writes one JSON line per file record.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf8')
+        self.lock = threading.Lock()
+
+    def emit(self, record, metrics):
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def close(self, metrics):
+        self.file.close()
+
+
+class PrometheusSink:
+    """
+    Dumps the run totals in Prometheus text exposition format on close.
+    """
+
+    def __init__(self, path, prefix='sparkify_etl'):
+        self.path = path
+        self.prefix = prefix
+
+    def emit(self, record, metrics):
+        pass
+
+    def close(self, metrics):
+        lines = []
+
+        def metric(name, help_text, samples):
+            name = '{}_{}'.format(self.prefix, name)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} counter'.format(name))
+            for labels, value in samples:
+                label_text = ','.join('{}="{}"'.format(k, v) for k, v in labels.items())
+                lines.append('{}{} {}'.format(name, '{' + label_text + '}' if label_text else '', value))
+
+        stages = sorted(metrics.totals.items())
+        metric('files_total', 'Files processed.', [({}, metrics.files)])
+        metric('bytes_read_total', 'Bytes of input files processed.', [({}, metrics.bytes_read)])
+        metric('slow_files_total', 'Files slower than the slow file threshold.', [({}, metrics.slow_files)])
+        metric('stage_seconds_total', 'Wall time spent per stage.',
+               [({'stage': stage}, round(total['seconds'], 6)) for stage, total in stages])
+        metric('stage_rows_total', 'Rows handled per stage.',
+               [({'stage': stage}, total['rows']) for stage, total in stages])
+        metric('stage_statements_total', 'SQL round trips per stage.',
+               [({'stage': stage}, total['statements']) for stage, total in stages])
+
+        with open(self.path, 'w', encoding='utf8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+class Metrics:
+    """
+    Per-file and per-stage ETL instrumentation.
+    - `file` wraps the processing of one file (or batch of files).
+    - `stage` times a stage and counts its SQL round trips when the
+      connection is a CountingConnection.
+    - `rows` counts rows handled by a stage.
+    Every finished file record goes to the sinks; files slower than
+    `slow_file_seconds` are logged.
+    """
+
+    def __init__(self, sinks=(), slow_file_seconds=None):
+        self.sinks = list(sinks)
+        self.slow_file_seconds = slow_file_seconds
+        self.totals = {}
+        self.files = 0
+        self.bytes_read = 0
+        self.slow_files = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    @contextlib.contextmanager
+    def file(self, filepaths):
+        """
+        Record the processing of a file or a list of files.
+
+        Parameters
+        ---------
+        filepaths: file path or list of file paths.
+        """
+        if isinstance(filepaths, str):
+            filepaths = [filepaths]
+        record = {
+            'file': filepaths[0] if len(filepaths) == 1 else filepaths,
+            'bytes': sum(os.path.getsize(path) for path in filepaths),
+            'stages': {},
+        }
+        self.local.record = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            self.local.record = None
+            self.finish(record, len(filepaths))
+
+    @contextlib.contextmanager
+    def stage(self, name, cur=None):
+        """
+        Time a stage of the current file.
+
+        Parameters
+        ---------
+        name: stage name.
+        cur: psycopg2 cursor whose round trips are counted, optional.
+        """
+        trips = round_trips(cur)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.current_stage(name)
+            stage['seconds'] += time.perf_counter() - start
+            if trips is not None:
+                stage['statements'] += round_trips(cur) - trips
+
+    def rows(self, name, count):
+        """
+        Count rows handled by a stage of the current file.
+        """
+        self.current_stage(name)['rows'] += int(count)
+
+    def current_stage(self, name):
+        record = getattr(self.local, 'record', None)
+        if record is None:
+            # outside of a file, e.g. building the song index
+            record = self.local.record = {'file': None, 'bytes': 0, 'stages': {}}
+        return record['stages'].setdefault(name, {'seconds': 0.0, 'rows': 0, 'statements': 0})
+
+    def finish(self, record, num_files):
+        with self.lock:
+            self.files += num_files
+            self.bytes_read += record['bytes']
+            for name, stage in record['stages'].items():
+                total = self.totals.setdefault(name, {'seconds': 0.0, 'rows': 0, 'statements': 0})
+                for key in total:
+                    total[key] += stage[key]
+            slow = self.slow_file_seconds is not None and record['seconds'] > self.slow_file_seconds
+            if slow:
+                self.slow_files += 1
+        for stage in record['stages'].values():
+            stage['seconds'] = round(stage['seconds'], 6)
+        if slow:
+            slowest = max(record['stages'].items(), key=lambda item: item[1]['seconds'], default=(None, None))[0]
+            logger.warning('slow file %s: %.3fs, slowest stage %s', record['file'], record['seconds'], slowest)
+        for sink in self.sinks:
+            sink.emit(record, self)
+
+    def close(self):
+        """
+        Flush and close all sinks.
+        """
+        for sink in self.sinks:
+            sink.close(self)
+
+
+# default when no instrumentation is configured
+NO_METRICS = Metrics()
@@ -0,0 +1,112 @@
+import os
+import hashlib
+from collections import namedtuple
+from sql_queries import manifest_table_create, manifest_select, manifest_insert
+
+
+FileEntry = namedtuple('FileEntry', ['path', 'size', 'mtime', 'sha256'])
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    SHA-256 of a file, read in chunks.
+
+    Parameters
+    ---------
+    path: file path.
+    chunk_size: bytes read at a time.
+
+    Returns
+    -------
+    hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Record of ingested files kept in the ingested_files table.
+    A file is pending when it is new. A loaded file whose content hash
+    changed is refused, as loading it again would duplicate its songplays.
+    Files with unchanged size and mtime are not hashed again.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+        # hashes computed by `pending`, reused by `record`
+        self.hashes = {}
+        # loaded files whose content changed, found by the last `pending`
+        self.changed = []
+
+    @classmethod
+    def load(cls, cur):
+        """
+        Read the manifest, creating its table when missing.
+
+        Parameters
+        ---------
+        cur: psycopg2 cursor object.
+
+        Returns
+        -------
+        Manifest.
+        """
+        cur.execute(manifest_table_create)
+        cur.execute(manifest_select)
+        return cls({row[0]: FileEntry(*row) for row in cur.fetchall()})
+
+    def pending(self, cur, all_files):
+        """
+        Select the files that need loading.
+        Files whose content is unchanged but size or mtime differ are
+        re-recorded without being loaded. Files whose content changed are
+        not loaded and are listed in `changed`; reload them into a new
+        database.
+
+        Parameters
+        ---------
+        cur: psycopg2 cursor object.
+        all_files: json file paths.
+
+        Returns
+        -------
+        list of file paths to load.
+        """
+        files = []
+        self.changed = []
+        for path in all_files:
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            if entry is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+                continue
+            sha256 = file_hash(path)
+            if entry is not None:
+                if entry.sha256 == sha256:
+                    self.record(cur, path, sha256)
+                else:
+                    self.changed.append(path)
+                continue
+            self.hashes[path] = sha256
+            files.append(path)
+        return files
+
+    def record(self, cur, path, sha256=None):
+        """
+        Record a loaded file. Run it in the transaction that loads the file's
+        rows, so both are committed or rolled back together.
+
+        Parameters
+        ---------
+        cur: psycopg2 cursor object.
+        path: file path.
+        sha256: content hash, computed when not given.
+        """
+        stat = os.stat(path)
+        sha256 = sha256 or self.hashes.pop(path, None) or file_hash(path)
+        entry = FileEntry(path, stat.st_size, stat.st_mtime, sha256)
+        cur.execute(manifest_insert, tuple(entry))
+        self.entries[path] = entry
@@ -0,0 +1,182 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+class Sequencer:
+    """
+    Lets writer threads run a step strictly in batch order.
+    """
+
+    def __init__(self):
+        self.next_seq = 0
+        self.condition = threading.Condition()
+
+    def wait(self, seq):
+        with self.condition:
+            self.condition.wait_for(lambda: self.next_seq == seq)
+
+    def done(self, seq):
+        with self.condition:
+            self.next_seq = seq + 1
+            self.condition.notify_all()
+
+
+def parse_batches(batches, parse, workers, out_queue, stop):
+    """
+    Parse file batches in worker processes and queue the results in
+    submission order. At most `2 * workers` batches are in flight, and the
+    bounded queue blocks parsing when writers fall behind.
+
+    Parameters
+    ---------
+    batches: list of file path lists.
+    parse: picklable function taking a list of file paths, returning frames.
+    workers: number of parser processes.
+    out_queue: bounded queue of (seq, batch, frames).
+    stop: threading.Event set when a writer failed.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for seq, batch in enumerate(batches):
+            pending.append((seq, batch, executor.submit(parse, batch)))
+            if len(pending) >= 2 * workers:
+                seq, batch, future = pending.popleft()
+                if not put(out_queue, (seq, batch, future.result()), stop):
+                    return
+        while pending:
+            seq, batch, future = pending.popleft()
+            if not put(out_queue, (seq, batch, future.result()), stop):
+                return
+
+
+def put(out_queue, item, stop):
+    """
+    Put an item on a bounded queue unless the pipeline was stopped.
+    """
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def write_batches(connect, in_queue, write, ordered_write, record, sequencer, stop, errors, progress):
+    """
+    Writer thread: load queued frames on its own connection, one
+    transaction per batch. A writer that cannot connect stops the pipeline
+    but keeps taking batches off the queue, so no thread waits on it.
+
+    Parameters
+    ---------
+    connect: function returning a new psycopg2 connection.
+    in_queue: queue of (seq, batch, frames), None ends the thread.
+    write: function(cur, frames) loading a batch.
+    ordered_write: function(cur, frames) run in batch order before `write`,
+        in the same transaction, or None.
+    record: function(cur, batch) run in the transaction of `write`, or None.
+    sequencer: Sequencer shared by all writers.
+    stop: threading.Event set on the first failure.
+    errors: list collecting exceptions.
+    progress: function(batch) called after each commit.
+    """
+    conn = None
+    try:
+        conn = connect()
+        cur = conn.cursor()
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    try:
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            seq, batch, frames = item
+            try:
+                if ordered_write is not None:
+                    sequencer.wait(seq)
+                    try:
+                        if not stop.is_set():
+                            # rows locked here make later batches wait for this commit
+                            ordered_write(cur, frames)
+                    finally:
+                        sequencer.done(seq)
+                if stop.is_set():
+                    if conn is not None:
+                        conn.rollback()
+                    continue
+                write(cur, frames)
+                if record is not None:
+                    record(cur, batch)
+                conn.commit()
+                progress(batch)
+            except Exception as e:
+                conn.rollback()
+                errors.append(e)
+                stop.set()
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def process_files_parallel(connect, all_files, parse, write, ordered_write=None, record=None,
+                           workers=4, writers=2, batch_size=50, queue_size=8):
+    """
+    Parallel ETL of data files.
+    - Parse and transform batches of files in a pool of worker processes.
+    - Feed the frames through a bounded queue to writer connections.
+    - Run `ordered_write` of every batch in file order, so upserts that
+      depend on order (last user level wins) match the serial load. It is
+      committed with the rest of its batch.
+
+    Parameters
+    ---------
+    connect: function returning a new psycopg2 connection.
+    all_files: json file paths.
+    parse: picklable function taking a list of file paths, returning frames.
+    write: function(cur, frames) loading a batch.
+    ordered_write: function(cur, frames) that must run in batch order, optional.
+    record: function(cur, batch) committed together with `write`, optional.
+    workers: number of parser processes.
+    writers: number of writer connections.
+    batch_size: files per parsed batch and writer transaction.
+    queue_size: maximum parsed batches waiting for a writer.
+    """
+    batches = [all_files[i:i + batch_size] for i in range(0, len(all_files), batch_size)]
+    num_files = len(all_files)
+
+    frames_queue = queue.Queue(maxsize=queue_size)
+    sequencer = Sequencer()
+    stop = threading.Event()
+    errors = []
+    lock = threading.Lock()
+    processed = [0]
+
+    def progress(batch):
+        with lock:
+            processed[0] += len(batch)
+            print('{}/{} files processed.'.format(processed[0], num_files))
+
+    threads = [threading.Thread(target=write_batches,
+                                args=(connect, frames_queue, write, ordered_write, record, sequencer, stop, errors, progress))
+               for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        parse_batches(batches, parse, workers, frames_queue, stop)
+    except Exception:
+        stop.set()
+        raise
+    finally:
+        for _ in threads:
+            frames_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,118 @@
+from datetime import datetime, timezone
+from sql_queries import songplay_partitioned_select, songplay_partition_select, songplay_partition_create, \
+    songplay_default_range, songplay_default_count, songplay_default_detach, songplay_default_attach, \
+    songplay_default_move
+
+
+def month_start(year, month):
+    """
+    Epoch milliseconds of the first instant of a month, in UTC.
+    """
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def month_of(ms):
+    """
+    (year, month) of epoch milliseconds, in UTC.
+    """
+    t = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    return t.year, t.month
+
+
+def next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def month_partition(year, month):
+    """
+    Partition name and [start, end) bounds in epoch milliseconds of a month.
+    """
+    name = 'songplays_y{:04d}m{:02d}'.format(year, month)
+    return name, month_start(year, month), month_start(*next_month(year, month))
+
+
+def months_between(start_ms, end_ms):
+    """
+    (year, month) of every month from the one holding `start_ms` to the one holding `end_ms`.
+    """
+    month, last = month_of(start_ms), month_of(end_ms)
+    months = []
+    while month <= last:
+        months.append(month)
+        month = next_month(*month)
+    return months
+
+
+def is_partitioned(cur):
+    """
+    Whether songplays was created with the partitioned schema.
+    """
+    cur.execute(songplay_partitioned_select)
+    return cur.fetchone()[0] > 0
+
+
+def ensure_partitions(cur, start_ms, end_ms):
+    """
+    Create the monthly songplays partitions covering [start_ms, end_ms].
+    Rows of a new month already held by songplays_default are moved to its partition.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    start_ms: first epoch millisecond to cover.
+    end_ms: last epoch millisecond to cover.
+
+    Returns
+    -------
+    names of the created partitions.
+    """
+    cur.execute(songplay_partition_select)
+    existing = {row[0] for row in cur.fetchall()}
+
+    created = []
+    for year, month in months_between(start_ms, end_ms):
+        name, start, end = month_partition(year, month)
+        if name in existing:
+            continue
+
+        cur.execute(songplay_default_count, (start, end))
+        if cur.fetchone()[0]:
+            # a new partition may not overlap rows of the default partition
+            cur.execute(songplay_default_detach)
+            cur.execute(songplay_partition_create.format(name), (start, end))
+            cur.execute(songplay_default_move.format(name), (start, end))
+            cur.execute(songplay_default_attach)
+        else:
+            cur.execute(songplay_partition_create.format(name), (start, end))
+        created.append(name)
+    return created
+
+
+def maintain_partitions(cur, months_ahead=3, now=None):
+    """
+    Create the partitions of every month held by songplays_default, and of
+    the current month and the next `months_ahead` months.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    months_ahead: months after the current one to create in advance.
+    now: epoch milliseconds of the current time, optional.
+
+    Returns
+    -------
+    names of the created partitions.
+    """
+    if now is None:
+        now = int(datetime.now(timezone.utc).timestamp() * 1000)
+    year, month = month_of(now)
+    for i in range(months_ahead):
+        year, month = next_month(year, month)
+
+    created = ensure_partitions(cur, now, month_start(year, month))
+
+    cur.execute(songplay_default_range)
+    first, last = cur.fetchone()
+    if first is not None:
+        created += ensure_partitions(cur, first, last)
+    return created
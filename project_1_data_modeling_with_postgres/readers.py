@@ -0,0 +1,133 @@
+import json
+import pandas as pd
+
+
+# column types of song json files
+SONG_SCHEMA = {
+    'num_songs': 'Int64',
+    'artist_id': 'object',
+    'artist_latitude': 'float64',
+    'artist_longitude': 'float64',
+    'artist_location': 'object',
+    'artist_name': 'object',
+    'song_id': 'object',
+    'title': 'object',
+    'duration': 'float64',
+    'year': 'Int64',
+}
+
+# column types of log json files, userId is an empty string for logged out users
+LOG_SCHEMA = {
+    'artist': 'object',
+    'auth': 'object',
+    'firstName': 'object',
+    'gender': 'object',
+    'itemInSession': 'Int64',
+    'lastName': 'object',
+    'length': 'float64',
+    'level': 'object',
+    'location': 'object',
+    'method': 'object',
+    'page': 'object',
+    'registration': 'float64',
+    'sessionId': 'Int64',
+    'song': 'object',
+    'status': 'Int64',
+    'ts': 'Int64',
+    'userAgent': 'object',
+    'userId': 'Int64',
+}
+
+
+def to_frame(columns, schema):
+    """
+    Build a typed DataFrame from column value lists.
+    Numeric values that cannot be parsed become missing values.
+
+    Parameters
+    ---------
+    columns: dict of column name to list of values.
+    schema: dict of column name to pandas dtype.
+
+    Returns
+    -------
+    DataFrame with the schema's columns and dtypes.
+    """
+    data = {}
+    for name, dtype in schema.items():
+        values = pd.Series(columns[name], dtype='object')
+        if dtype != 'object':
+            values = pd.to_numeric(values, errors='coerce').astype(dtype)
+        data[name] = values
+    return pd.DataFrame(data)
+
+
+def iter_json_batches(filepaths, schema, batch_rows=100000):
+    """
+    Stream JSON-lines files into typed DataFrames of at most `batch_rows` rows.
+    Records of many small files are concatenated into one batch, and large
+    files are split over several batches, so memory stays bounded.
+
+    Parameters
+    ---------
+    filepaths: JSON-lines file paths, read in order.
+    schema: dict of column name to pandas dtype, other fields are dropped.
+    batch_rows: maximum rows per DataFrame.
+
+    Returns
+    -------
+    iterator of DataFrames.
+    """
+    columns = {name: [] for name in schema}
+    rows = 0
+    for filepath in filepaths:
+        with open(filepath, encoding='utf8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                for name, values in columns.items():
+                    values.append(record.get(name))
+                rows += 1
+                if rows == batch_rows:
+                    yield to_frame(columns, schema)
+                    columns = {name: [] for name in schema}
+                    rows = 0
+    if rows:
+        yield to_frame(columns, schema)
+
+
+def read_json_files(filepaths, schema):
+    """
+    Read JSON-lines files into one typed DataFrame.
+
+    Parameters
+    ---------
+    filepaths: JSON-lines file paths.
+    schema: dict of column name to pandas dtype.
+
+    Returns
+    -------
+    DataFrame.
+    """
+    batches = list(iter_json_batches(filepaths, schema, batch_rows=None))
+    if not batches:
+        return to_frame({name: [] for name in schema}, schema)
+    return batches[0]
+
+
+def read_json_chunks(filepath, schema, chunk_rows=100000):
+    """
+    Read a large JSON-lines file in typed chunks of at most `chunk_rows` rows.
+
+    Parameters
+    ---------
+    filepath: JSON-lines file path.
+    schema: dict of column name to pandas dtype.
+    chunk_rows: maximum rows per DataFrame.
+
+    Returns
+    -------
+    iterator of DataFrames.
+    """
+    return iter_json_batches([filepath], schema, batch_rows=chunk_rows)
@@ -0,0 +1,95 @@
+from sql_queries import rollup_table_queries, rollup_watermark_init, rollup_watermark_select, \
+    rollup_watermark_update, songplay_max_id_select, hourly_plays_refresh, daily_song_plays_refresh, \
+    hourly_plays_select, level_plays_select, top_songs_select
+
+
+# rollups refreshed from the songplays added since the last refresh
+REFRESH_QUERIES = [hourly_plays_refresh, daily_song_plays_refresh]
+
+
+def refresh_rollups(cur):
+    """
+    Add the songplays loaded since the last refresh to the rollup tables.
+    Songplays are selected by songplay_id above the stored watermark, so a
+    refresh scans only new rows. Run it after the loads have committed:
+    songplay ids of a load still in progress are below the new watermark
+    once it commits and would be skipped.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object, committed by the caller.
+
+    Returns
+    -------
+    (first, last) songplay ids added to the rollups, None when there are no new songplays.
+    """
+    for query in rollup_table_queries:
+        cur.execute(query)
+    cur.execute(rollup_watermark_init)
+
+    cur.execute(rollup_watermark_select)
+    low = cur.fetchone()[0]
+    cur.execute(songplay_max_id_select)
+    high = cur.fetchone()[0]
+    if high is None or high <= low:
+        return None
+
+    for query in REFRESH_QUERIES:
+        cur.execute(query, (low, high))
+    cur.execute(rollup_watermark_update, (high,))
+    return low + 1, high
+
+
+def hourly_plays(cur, start_ms, end_ms):
+    """
+    Plays per hour and level.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    start_ms: first hour, epoch milliseconds.
+    end_ms: end of the range, epoch milliseconds, exclusive.
+
+    Returns
+    -------
+    list of (hour start in epoch milliseconds, level, plays).
+    """
+    cur.execute(hourly_plays_select, (start_ms, end_ms))
+    return cur.fetchall()
+
+
+def plays_by_level(cur, start_ms, end_ms):
+    """
+    Plays of free and paid users.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    start_ms: first hour, epoch milliseconds.
+    end_ms: end of the range, epoch milliseconds, exclusive.
+
+    Returns
+    -------
+    dict of level to plays.
+    """
+    cur.execute(level_plays_select, (start_ms, end_ms))
+    return dict(cur.fetchall())
+
+
+def top_songs(cur, start_ms, end_ms, limit=10):
+    """
+    Most played songs. Only songplays matched to a song are counted.
+
+    Parameters
+    ---------
+    cur: psycopg2 cursor object.
+    start_ms: first day, epoch milliseconds.
+    end_ms: end of the range, epoch milliseconds, exclusive.
+    limit: number of songs.
+
+    Returns
+    -------
+    list of (song_id, title, artist_id, artist name, plays), most played first.
+    """
+    cur.execute(top_songs_select, (start_ms, end_ms, limit))
+    return cur.fetchall()
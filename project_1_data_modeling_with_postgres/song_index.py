@@ -0,0 +1,160 @@
+from collections import OrderedDict
+import pandas as pd
+from psycopg2.extras import execute_values
+from sql_queries import song_index_select, song_index_lookup
+
+
+DURATION_DECIMALS = 5
+# whitespace trimmed from titles and names, the set song_index_lookup trims
+# in the database; str.strip() with no argument trims any unicode space
+MATCH_WHITESPACE = ' \t\n\r\f\v'
+
+
+def normalize_keys(title, name, duration):
+    """
+    Normalize song match columns into index keys.
+    Titles and artist names are trimmed of MATCH_WHITESPACE and lower-cased,
+    durations rounded, as song_index_lookup does in the database.
+
+    Parameters
+    ---------
+    title: Series of song titles.
+    name: Series of artist names.
+    duration: Series of song durations.
+
+    Returns
+    -------
+    list of (title, name, duration) tuples.
+    """
+    title = title.astype(str).str.strip(MATCH_WHITESPACE).str.lower()
+    name = name.astype(str).str.strip(MATCH_WHITESPACE).str.lower()
+    duration = pd.to_numeric(duration, errors='coerce').astype(float).round(DURATION_DECIMALS)
+    return list(zip(title, name, duration))
+
+
+class SongIndex:
+    """
+    In-memory (title, artist name, duration) -> (song_id, artist_id) index.
+    - Unbounded: holds the whole catalog, a miss means no match.
+    - Bounded (`max_entries`): least recently used keys are evicted and
+      misses are looked up in the database with one query per batch.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    @classmethod
+    def build(cls, cur, max_entries=None):
+        """
+        Build an index from the songs and artists tables.
+
+        Parameters
+        ---------
+        cur: psycopg2 cursor object.
+        max_entries: maximum number of keys held, None for the whole catalog.
+
+        Returns
+        -------
+        SongIndex.
+        """
+        index = cls(max_entries)
+        cur.execute(song_index_select)
+        columns = ['title', 'name', 'duration', 'song_id', 'artist_id']
+        while True:
+            rows = cur.fetchmany(10000)
+            if not rows:
+                break
+            index.update(pd.DataFrame(rows, columns=columns))
+            if index.bounded and len(index.entries) >= index.max_entries:
+                break
+        return index
+
+    @property
+    def bounded(self):
+        return self.max_entries is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, df):
+        """
+        Add catalog rows to the index.
+
+        Parameters
+        ---------
+        df: DataFrame with title, name, duration, song_id and artist_id columns.
+        """
+        keys = normalize_keys(df['title'], df['name'], df['duration'])
+        for key, value in zip(keys, zip(df['song_id'], df['artist_id'])):
+            # keep the first match, like song_select, but replace cached misses
+            if self.entries.get(key) is None:
+                self.entries[key] = value
+            self._touch(key)
+        self._evict()
+
+    def add(self, song_df, artist_df):
+        """
+        Add newly loaded songs, as returned by `transform_song_data`.
+
+        Parameters
+        ---------
+        song_df: song records (song_id, title, artist_id, year, duration).
+        artist_df: artist records (artist_id, artist_name, ...).
+        """
+        names = artist_df[['artist_id', 'artist_name']].drop_duplicates('artist_id')
+        df = song_df.merge(names, on='artist_id').rename(columns={'artist_name': 'name'})
+        self.update(df)
+
+    def resolve(self, cur, df, title='song', name='artist', duration='length'):
+        """
+        Resolve song_id and artist_id for every row of a log DataFrame.
+        Distinct keys are looked up once and mapped back to the rows.
+
+        Parameters
+        ---------
+        cur: psycopg2 cursor object, used for misses of a bounded index.
+        df: log DataFrame.
+        title, name, duration: match column names in `df`.
+
+        Returns
+        -------
+        DataFrame with song_id and artist_id columns, aligned with `df`.
+        """
+        keys = normalize_keys(df[title], df[name], df[duration])
+        unique_keys = set(keys)
+
+        if self.bounded:
+            misses = [key for key in unique_keys if key not in self.entries and key[2] == key[2]]
+            if misses:
+                self._lookup(cur, misses)
+
+        matches = {}
+        for key in unique_keys:
+            match = self.entries.get(key)
+            if match is not None:
+                matches[key] = match
+                self._touch(key)
+        self._evict()
+
+        ids = [matches.get(key, (None, None)) for key in keys]
+        return pd.DataFrame(ids, columns=['song_id', 'artist_id'], index=df.index)
+
+    def _lookup(self, cur, keys):
+        """
+        Look up index misses in the database and cache the results.
+        Keys without a match are cached as None so they are not queried again.
+        """
+        rows = execute_values(cur, song_index_lookup, keys, fetch=True)
+        found = {(t, n, float(d)): (song_id, artist_id) for t, n, d, song_id, artist_id in rows}
+        for key in keys:
+            self.entries[key] = found.get(key)
+
+    def _touch(self, key):
+        if self.bounded:
+            self.entries.move_to_end(key)
+
+    def _evict(self):
+        if self.bounded:
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
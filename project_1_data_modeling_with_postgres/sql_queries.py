@@ -5,6 +5,10 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+manifest_table_drop = "DROP TABLE IF EXISTS ingested_files"
+hourly_plays_table_drop = "DROP TABLE IF EXISTS hourly_plays"
+daily_song_plays_table_drop = "DROP TABLE IF EXISTS daily_song_plays"
+rollup_watermark_table_drop = "DROP TABLE IF EXISTS rollup_watermark"
 
 # CREATE TABLES
 
@@ -59,6 +63,41 @@ time_table_create = ("""
         PRIMARY KEY (start_time))
 """)
 
+manifest_table_create = ("""
+    CREATE TABLE IF NOT EXISTS ingested_files (path VARCHAR, \
+        size BIGINT, \
+        mtime DOUBLE PRECISION, \
+        sha256 CHAR(64), \
+        loaded_at TIMESTAMP DEFAULT NOW(), \
+        PRIMARY KEY (path))
+""")
+
+# ROLLUP TABLES
+# Aggregates of songplays, refreshed incrementally from the songplay_id
+# watermark. Hours and days are epoch milliseconds of their first instant, UTC.
+
+hourly_plays_table_create = ("""
+    CREATE TABLE IF NOT EXISTS hourly_plays (hour_start BIGINT, \
+        level VARCHAR, \
+        plays BIGINT NOT NULL, \
+        PRIMARY KEY (hour_start, level))
+""")
+
+daily_song_plays_table_create = ("""
+    CREATE TABLE IF NOT EXISTS daily_song_plays (day_start BIGINT, \
+        song_id VARCHAR, \
+        artist_id VARCHAR, \
+        plays BIGINT NOT NULL, \
+        PRIMARY KEY (day_start, song_id, artist_id))
+""")
+
+rollup_watermark_table_create = ("""
+    CREATE TABLE IF NOT EXISTS rollup_watermark (name VARCHAR, \
+        songplay_id BIGINT NOT NULL, \
+        refreshed_at TIMESTAMP DEFAULT NOW(), \
+        PRIMARY KEY (name))
+""")
+
 # INSERT RECORDS
 
 songplay_table_insert = ("""
@@ -96,6 +135,17 @@ time_table_insert = ("""
     DO NOTHING
 """)
 
+manifest_insert = ("""
+    INSERT INTO ingested_files(path, size, mtime, sha256) \
+    VALUES(%s, %s, %s, %s) \
+    ON CONFLICT(path) \
+    DO UPDATE \
+        SET size = EXCLUDED.size, \
+            mtime = EXCLUDED.mtime, \
+            sha256 = EXCLUDED.sha256, \
+            loaded_at = NOW()
+""")
+
 # FIND SONGS
 
 song_select = ("""
@@ -109,7 +159,348 @@ song_select = ("""
         duration = %s
 """)
 
+# song/artist rows used to build the in-memory song index
+song_index_select = ("""
+    SELECT title, name, duration, song_id, songs.artist_id \
+    FROM songs \
+    JOIN artists \
+    ON songs.artist_id = artists.artist_id
+""")
+
+# lookup of index misses, one statement for a whole batch of keys; titles and
+# names are trimmed of the song_index.MATCH_WHITESPACE characters
+song_index_lookup = ("""
+    SELECT keys.title, keys.name, keys.duration, match.song_id, match.artist_id \
+    FROM (VALUES %s) AS keys(title, name, duration) \
+    JOIN LATERAL ( \
+        SELECT song_id, songs.artist_id \
+        FROM songs \
+        JOIN artists \
+        ON songs.artist_id = artists.artist_id \
+        WHERE \
+            LOWER(BTRIM(title, E' \\t\\n\\r\\f\\x0b')) = keys.title AND \
+            LOWER(BTRIM(name, E' \\t\\n\\r\\f\\x0b')) = keys.name AND \
+            ROUND(duration, 5) = keys.duration \
+        LIMIT 1) match ON TRUE
+""")
+
+# TIME KEYS
+
+time_select_keys = ("""
+    SELECT start_time \
+    FROM time
+""")
+
+# INGESTION MANIFEST
+
+manifest_select = ("""
+    SELECT path, size, mtime, sha256 \
+    FROM ingested_files
+""")
+
+# BULK LOAD STAGING
+# Session-local staging tables that receive COPY data before one set-based
+# upsert into the target table. Rows are cleared after every merge.
+
+song_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS songs_staging (song_id VARCHAR, \
+        title VARCHAR, \
+        artist_id VARCHAR, \
+        year INT, \
+        duration NUMERIC) \
+    ON COMMIT DELETE ROWS
+""")
+
+artist_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS artists_staging (artist_id VARCHAR, \
+        name VARCHAR, \
+        location VARCHAR, \
+        latitude NUMERIC, \
+        longitude NUMERIC) \
+    ON COMMIT DELETE ROWS
+""")
+
+time_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS time_staging (start_time BIGINT, \
+        hour INT, \
+        day INT, \
+        week INT, \
+        month INT, \
+        year INT, \
+        weekday INT) \
+    ON COMMIT DELETE ROWS
+""")
+
+user_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS users_staging (row_number BIGINT, \
+        user_id INT, \
+        first_name VARCHAR, \
+        last_name VARCHAR, \
+        gender VARCHAR, \
+        level VARCHAR) \
+    ON COMMIT DELETE ROWS
+""")
+
+songplay_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS songplays_staging (row_number BIGINT, \
+        start_time BIGINT, \
+        user_id INT, \
+        level VARCHAR, \
+        song VARCHAR, \
+        artist VARCHAR, \
+        length NUMERIC, \
+        session_id INT, \
+        location VARCHAR, \
+        user_agent VARCHAR) \
+    ON COMMIT DELETE ROWS
+""")
+
+# MERGE STAGING
+# Same conflict handling as the row inserts above. Users keep the level of the
+# last staged row, and songplays resolve song_id/artist_id like song_select.
+# Rows are inserted in key order so concurrent loads lock keys in one order.
+
+song_table_merge = ("""
+    INSERT INTO songs(song_id, title, artist_id, year, duration) \
+    SELECT song_id, title, artist_id, year, duration \
+    FROM songs_staging \
+    ORDER BY song_id \
+    ON CONFLICT(song_id) \
+    DO NOTHING
+""")
+
+artist_table_merge = ("""
+    INSERT INTO artists(artist_id, name, location, latitude, longitude) \
+    SELECT artist_id, name, location, latitude, longitude \
+    FROM artists_staging \
+    ORDER BY artist_id \
+    ON CONFLICT(artist_id) \
+    DO NOTHING
+""")
+
+time_table_merge = ("""
+    INSERT INTO time(start_time, hour, day, week, month, year, weekday) \
+    SELECT start_time, hour, day, week, month, year, weekday \
+    FROM time_staging \
+    ORDER BY start_time \
+    ON CONFLICT(start_time) \
+    DO NOTHING
+""")
+
+user_table_merge = ("""
+    INSERT INTO users(user_id, first_name, last_name, gender, level) \
+    SELECT DISTINCT ON (user_id) user_id, first_name, last_name, gender, level \
+    FROM users_staging \
+    ORDER BY user_id, row_number DESC \
+    ON CONFLICT(user_id) \
+    DO UPDATE \
+        SET level = EXCLUDED.level
+""")
+
+songplay_table_merge = ("""
+    INSERT INTO songplays(start_time, user_id, level, song_id, artist_id, session_id, location, user_agent) \
+    SELECT sp.start_time, sp.user_id, sp.level, match.song_id, match.artist_id, sp.session_id, sp.location, sp.user_agent \
+    FROM songplays_staging sp \
+    LEFT JOIN LATERAL ( \
+        SELECT song_id, songs.artist_id \
+        FROM songs \
+        JOIN artists \
+        ON songs.artist_id = artists.artist_id \
+        WHERE \
+            title = sp.song AND \
+            name = sp.artist AND \
+            duration = sp.length \
+        LIMIT 1) match ON TRUE \
+    ORDER BY sp.row_number
+""")
+
+# ROLLUP REFRESH
+
+rollup_watermark_init = ("""
+    INSERT INTO rollup_watermark(name, songplay_id) \
+    VALUES('songplays', 0) \
+    ON CONFLICT(name) \
+    DO NOTHING
+""")
+
+# locks the watermark so concurrent refreshes run one after the other
+rollup_watermark_select = ("""
+    SELECT songplay_id \
+    FROM rollup_watermark \
+    WHERE name = 'songplays' \
+    FOR UPDATE
+""")
+
+rollup_watermark_update = ("""
+    UPDATE rollup_watermark \
+    SET songplay_id = %s, \
+        refreshed_at = NOW() \
+    WHERE name = 'songplays'
+""")
+
+songplay_max_id_select = ("""
+    SELECT MAX(songplay_id) \
+    FROM songplays
+""")
+
+hourly_plays_refresh = ("""
+    INSERT INTO hourly_plays(hour_start, level, plays) \
+    SELECT start_time - start_time %% 3600000, COALESCE(level, ''), COUNT(*) \
+    FROM songplays \
+    WHERE songplay_id > %s AND songplay_id <= %s \
+    GROUP BY 1, 2 \
+    ORDER BY 1, 2 \
+    ON CONFLICT(hour_start, level) \
+    DO UPDATE \
+        SET plays = hourly_plays.plays + EXCLUDED.plays
+""")
+
+daily_song_plays_refresh = ("""
+    INSERT INTO daily_song_plays(day_start, song_id, artist_id, plays) \
+    SELECT start_time - start_time %% 86400000, song_id, artist_id, COUNT(*) \
+    FROM songplays \
+    WHERE songplay_id > %s AND songplay_id <= %s AND song_id IS NOT NULL AND artist_id IS NOT NULL \
+    GROUP BY 1, 2, 3 \
+    ORDER BY 1, 2, 3 \
+    ON CONFLICT(day_start, song_id, artist_id) \
+    DO UPDATE \
+        SET plays = daily_song_plays.plays + EXCLUDED.plays
+""")
+
+# ROLLUP QUERIES
+
+hourly_plays_select = ("""
+    SELECT hour_start, level, plays \
+    FROM hourly_plays \
+    WHERE hour_start >= %s AND hour_start < %s \
+    ORDER BY hour_start, level
+""")
+
+level_plays_select = ("""
+    SELECT level, SUM(plays)::BIGINT \
+    FROM hourly_plays \
+    WHERE hour_start >= %s AND hour_start < %s \
+    GROUP BY level \
+    ORDER BY level
+""")
+
+top_songs_select = ("""
+    SELECT top.song_id, songs.title, top.artist_id, artists.name, top.plays \
+    FROM ( \
+        SELECT song_id, artist_id, SUM(plays)::BIGINT AS plays \
+        FROM daily_song_plays \
+        WHERE day_start >= %s AND day_start < %s \
+        GROUP BY song_id, artist_id \
+        ORDER BY plays DESC, song_id \
+        LIMIT %s) top \
+    LEFT JOIN songs \
+    ON songs.song_id = top.song_id \
+    LEFT JOIN artists \
+    ON artists.artist_id = top.artist_id \
+    ORDER BY top.plays DESC, top.song_id
+""")
+
+# INDEXED, PARTITIONED SCHEMA
+# songplays partitioned by month of start_time (epoch milliseconds). Rows of
+# months without a partition land in songplays_default until
+# `partitions.maintain_partitions` moves them to their own partition.
+
+songplay_table_create_partitioned = ("""
+    CREATE TABLE IF NOT EXISTS songplays (songplay_id SERIAL, \
+        start_time BIGINT NOT NULL, \
+        user_id INT, \
+        level VARCHAR, \
+        song_id VARCHAR, \
+        artist_id VARCHAR, \
+        session_id INT, \
+        location VARCHAR,\
+        user_agent VARCHAR, \
+        PRIMARY KEY (songplay_id, start_time)) \
+    PARTITION BY RANGE (start_time)
+""")
+
+songplay_default_partition_create = ("""
+    CREATE TABLE IF NOT EXISTS songplays_default PARTITION OF songplays DEFAULT
+""")
+
+# indexes created on the parent are created on every partition
+songplay_start_time_index = ("""
+    CREATE INDEX IF NOT EXISTS songplays_start_time_brin ON songplays USING BRIN (start_time)
+""")
+
+songplay_user_id_index = ("""
+    CREATE INDEX IF NOT EXISTS songplays_user_id_idx ON songplays (user_id)
+""")
+
+# song lookups of song_select and the songplays merge
+song_title_index = ("""
+    CREATE INDEX IF NOT EXISTS songs_title_duration_idx ON songs (title, duration)
+""")
+
+artist_name_index = ("""
+    CREATE INDEX IF NOT EXISTS artists_name_idx ON artists (name)
+""")
+
+# song lookups of song_index_lookup
+song_title_key_index = ("""
+    CREATE INDEX IF NOT EXISTS songs_title_key_idx ON songs (LOWER(TRIM(title)), ROUND(duration, 5))
+""")
+
+artist_name_key_index = ("""
+    CREATE INDEX IF NOT EXISTS artists_name_key_idx ON artists (LOWER(TRIM(name)))
+""")
+
+songplay_partitioned_select = ("""
+    SELECT COUNT(*) \
+    FROM pg_partitioned_table \
+    WHERE partrelid = to_regclass('songplays')
+""")
+
+songplay_partition_select = ("""
+    SELECT c.relname \
+    FROM pg_inherits i \
+    JOIN pg_class c \
+    ON c.oid = i.inhrelid \
+    WHERE i.inhparent = to_regclass('songplays')
+""")
+
+songplay_partition_create = ("""
+    CREATE TABLE IF NOT EXISTS {} PARTITION OF songplays \
+    FOR VALUES FROM (%s) TO (%s)
+""")
+
+songplay_default_range = ("""
+    SELECT MIN(start_time), MAX(start_time) \
+    FROM songplays_default
+""")
+
+songplay_default_count = ("""
+    SELECT COUNT(*) \
+    FROM songplays_default \
+    WHERE start_time >= %s AND start_time < %s
+""")
+
+songplay_default_detach = "ALTER TABLE songplays DETACH PARTITION songplays_default"
+songplay_default_attach = "ALTER TABLE songplays ATTACH PARTITION songplays_default DEFAULT"
+
+songplay_default_move = ("""
+    WITH moved AS ( \
+        DELETE FROM songplays_default \
+        WHERE start_time >= %s AND start_time < %s \
+        RETURNING *) \
+    INSERT INTO {} \
+    SELECT * FROM moved
+""")
+
 # QUERY LISTS
 
-create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
\ No newline at end of file
+create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, manifest_table_create,
+                        hourly_plays_table_create, daily_song_plays_table_create, rollup_watermark_table_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, manifest_table_drop,
+                      hourly_plays_table_drop, daily_song_plays_table_drop, rollup_watermark_table_drop]
+rollup_table_queries = [hourly_plays_table_create, daily_song_plays_table_create, rollup_watermark_table_create]
+index_queries = [song_title_index, artist_name_index, song_title_key_index, artist_name_key_index]
+partitioned_create_table_queries = [songplay_table_create_partitioned, songplay_default_partition_create,
+                                    songplay_start_time_index, songplay_user_id_index,
+                                    user_table_create, song_table_create, artist_table_create, time_table_create,
+                                    manifest_table_create] + rollup_table_queries + index_queries
@@ -0,0 +1,124 @@
+import os
+import json
+import etl
+import commit_policy
+from commit_policy import CommitPolicy
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.path.join(HERE, 'data/log_data/2018/11')
+
+
+class RecordingConnection:
+    """
+    Connection stand-in keeping the position of each commit among the
+    statements run on its cursor.
+    """
+
+    connection = None
+
+    def __init__(self):
+        self.statements = []
+        self.commits = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, args=None):
+        self.statements.append(query)
+
+    def commit(self):
+        self.commits.append(len(self.statements))
+
+
+def write_files(directory, count):
+    os.makedirs(directory)
+    for i in range(count):
+        open(os.path.join(directory, '{:02d}.json'.format(i)), 'w').close()
+
+
+def commit_points(tmp_path, policy, rows=10, fail=()):
+    """
+    Files after which process_data committed, loading `rows` rows per file
+    and failing the files numbered in `fail`.
+    """
+    directory = str(tmp_path / 'data')
+    write_files(directory, 6)
+    conn = RecordingConnection()
+    loaded = []
+
+    def load(cur, datafile):
+        number = int(os.path.basename(datafile)[:2])
+        if number in fail:
+            raise ValueError(datafile)
+        loaded.append(number)
+        cur.execute('file {}'.format(number))
+        return rows
+
+    failed = etl.process_data(conn, conn, directory, load, commit_policy=policy)
+    assert len(failed) == len(fail)
+    # statements run before each commit, named after their file
+    return [[s for s in conn.statements[:end] if s.startswith('file')][-1] for end in conn.commits]
+
+
+def test_commit_every_files(tmp_path):
+    assert commit_points(tmp_path, CommitPolicy(every_files=2)) == ['file 1', 'file 3', 'file 5', 'file 5']
+
+
+def test_failed_files_are_not_counted(tmp_path):
+    assert commit_points(tmp_path, CommitPolicy(every_files=2), fail={1}) == ['file 2', 'file 4', 'file 5']
+
+
+def test_commit_every_rows(tmp_path):
+    assert commit_points(tmp_path, CommitPolicy(every_rows=25), rows=10) == ['file 2', 'file 5', 'file 5']
+
+
+def test_commit_every_seconds(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(commit_policy.time, 'monotonic', lambda: clock[0])
+    policy = CommitPolicy(every_seconds=5)
+    clock[0] += 10
+    # nothing loaded, nothing to commit
+    assert not policy.due()
+    policy.add(1, 10)
+    assert policy.due()
+    policy.reset()
+    policy.add(1, 10)
+    clock[0] += 4
+    assert not policy.due()
+    clock[0] += 1
+    assert policy.due()
+
+
+def count(cur, query):
+    cur.execute(query)
+    return cur.fetchone()[0]
+
+
+def test_bad_file_rolls_back_alone(conn, tmp_path):
+    directory = str(tmp_path / 'log_data')
+    os.makedirs(directory)
+    good = ['2018-11-01-events.json', '2018-11-02-events.json', '2018-11-03-events.json']
+    events = []
+    for name in good:
+        with open(os.path.join(LOG_DIR, name)) as f, open(os.path.join(directory, name), 'w') as out:
+            data = f.read()
+            out.write(data)
+        events += [json.loads(line) for line in data.splitlines()]
+    # a NextSong event without a user fails the users upsert
+    with open(os.path.join(LOG_DIR, '2018-11-04-events.json')) as f:
+        bad_events = [json.loads(line) for line in f]
+    next(event for event in bad_events if event['page'] == 'NextSong')['userId'] = None
+    bad_file = os.path.join(directory, '2018-11-02-bad.json')
+    with open(bad_file, 'w') as out:
+        out.write('\n'.join(json.dumps(event) for event in bad_events))
+
+    cur = conn.cursor()
+    failed = etl.process_data(cur, conn, directory, etl.process_log_file, commit_policy=CommitPolicy(every_files=2))
+
+    assert [datafile for datafile, error in failed] == [bad_file]
+    plays = [event for event in events if event['page'] == 'NextSong']
+    assert count(cur, 'SELECT COUNT(*) FROM songplays') == len(plays)
+    assert count(cur, 'SELECT COUNT(*) FROM time') == len({event['ts'] for event in plays})
+    assert count(cur, 'SELECT COUNT(*) FROM songplays WHERE start_time >= %s' % min(
+        event['ts'] for event in bad_events)) == 0
@@ -0,0 +1,51 @@
+import os
+import math
+import pandas as pd
+import etl
+from bulk_load import copy_dataframe
+from sql_queries import artist_table_insert
+
+
+# song file with no artist coordinates
+SONG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/song_data/A/B/B/TRABBNP128F932546F.json')
+
+
+class RecordingCursor:
+    """
+    Cursor stand-in keeping the statements and COPY text it is given.
+    """
+
+    connection = None
+
+    def __init__(self):
+        self.executed = []
+        self.copied = []
+
+    def execute(self, query, args=None):
+        self.executed.append((query, args))
+
+    def copy_expert(self, query, f):
+        self.copied.append((query, f.read()))
+
+
+def test_row_path_stores_missing_coordinates_as_null():
+    cur = RecordingCursor()
+    etl.process_song_file(cur, SONG_FILE)
+
+    artist_data = [args for query, args in cur.executed if query == artist_table_insert][0]
+    assert artist_data[3] is None and artist_data[4] is None
+
+
+def test_bulk_path_stores_missing_coordinates_as_null():
+    song_df, artist_df = etl.parse_song_files([SONG_FILE])
+    cur = RecordingCursor()
+    copy_dataframe(cur, artist_df, 'artists_staging', ['artist_id', 'name', 'location', 'latitude', 'longitude'])
+
+    query, text = cur.copied[0]
+    assert "NULL '\\N'" in query
+    assert text.rstrip('\n').split(',')[-2:] == ['\\N', '\\N']
+
+
+def test_frame_rows():
+    df = pd.DataFrame({'a': [1.5, math.nan], 'b': pd.array([1, None], dtype='Int64'), 'c': ['x', None]})
+    assert etl.frame_rows(df) == [[1.5, 1, 'x'], [None, None, None]]
@@ -0,0 +1,67 @@
+import os
+import glob
+import shutil
+import etl
+from manifest import Manifest
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def copy_song_files(directory, count=3):
+    os.makedirs(directory)
+    for path in sorted(glob.glob(os.path.join(HERE, 'data/song_data/A/A/A/*.json')))[:count]:
+        shutil.copy(path, directory)
+    return etl.get_files(directory)
+
+
+def load(conn, directory):
+    cur = conn.cursor()
+    manifest = Manifest.load(cur)
+    failed = etl.process_data(cur, conn, directory, etl.process_song_file, manifest=manifest)
+    assert failed == []
+    return manifest
+
+
+def count(conn, table):
+    cur = conn.cursor()
+    cur.execute('SELECT COUNT(*) FROM {}'.format(table))
+    return cur.fetchone()[0]
+
+
+def test_rerun_loads_only_new_files(conn, tmp_path):
+    directory = str(tmp_path / 'song_data')
+    files = copy_song_files(directory)
+    load(conn, directory)
+    assert count(conn, 'songs') == 3 and count(conn, 'ingested_files') == 3
+
+    manifest = Manifest.load(conn.cursor())
+    assert manifest.pending(conn.cursor(), files) == []
+
+    # a new mtime with the same content is recorded again, not loaded
+    os.utime(files[0], (0, 0))
+    assert manifest.pending(conn.cursor(), files) == []
+    assert manifest.entries[files[0]].mtime == 0
+
+    new_file = os.path.join(directory, 'TRNEW.json')
+    with open(new_file, 'w') as f:
+        f.write('{"num_songs": 1, "artist_id": "ARNEW", "artist_latitude": null, "artist_longitude": null, '
+                '"artist_location": "", "artist_name": "New", "song_id": "SONEW", "title": "New", '
+                '"duration": 100.0, "year": 0}')
+    load(conn, directory)
+    assert count(conn, 'songs') == 4 and count(conn, 'ingested_files') == 4
+
+
+def test_changed_file_is_not_reloaded(conn, tmp_path):
+    directory = str(tmp_path / 'song_data')
+    files = copy_song_files(directory, 2)
+    load(conn, directory)
+
+    with open(files[1], 'a') as f:
+        f.write('\n')
+    manifest = Manifest.load(conn.cursor())
+    assert manifest.pending(conn.cursor(), files) == []
+    assert manifest.changed == [files[1]]
+
+    load(conn, directory)
+    assert count(conn, 'songs') == 2 and count(conn, 'ingested_files') == 2
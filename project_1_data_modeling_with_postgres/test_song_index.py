@@ -0,0 +1,41 @@
+import pandas as pd
+from song_index import SongIndex
+from sql_queries import song_table_insert, artist_table_insert
+
+
+def catalog(*songs):
+    return pd.DataFrame([(title, 'artist', 100.0, song_id, 'AR1') for title, song_id in songs],
+                        columns=['title', 'name', 'duration', 'song_id', 'artist_id'])
+
+
+def plays(*titles, name='artist', length=100.0):
+    return pd.DataFrame({'song': list(titles), 'artist': name, 'length': length})
+
+
+def test_bounded_index_evicts_least_recently_used_keys():
+    index = SongIndex(max_entries=2)
+    index.update(catalog(('a', 'SO1'), ('b', 'SO2'), ('c', 'SO3')))
+    assert len(index) == 2
+    assert [key[0] for key in index.entries] == ['b', 'c']
+
+    # a hit makes b the most recently used, so c goes first
+    assert list(index.resolve(None, plays('b'))['song_id']) == ['SO2']
+    index.update(catalog(('d', 'SO4')))
+    assert [key[0] for key in index.entries] == ['b', 'd']
+
+
+def test_index_and_database_lookup_match_the_same_rows(conn):
+    cur = conn.cursor()
+    cur.execute(artist_table_insert, ('AR1', ' The Artist\t', None, None, None))
+    cur.execute(song_table_insert, ('SO1', '\tA Song\n', 'AR1', 2000, 212.1234567))
+    cur.execute(song_table_insert, ('SO2', 'Other Song', 'AR1', 2000, 100.0))
+    conn.commit()
+    df = plays('a song', ' A SONG \n', 'A Song\t', 'Other Song', 'Missing', name='the artist\n', length=212.12346)
+    df.loc[3, 'length'] = 100.0
+
+    memory = SongIndex.build(cur).resolve(cur, df)
+    # an empty bounded index looks every key up in the database
+    database = SongIndex(max_entries=10).resolve(cur, df)
+
+    assert list(memory['song_id']) == ['SO1', 'SO1', 'SO1', 'SO2', None]
+    assert memory.equals(database)
@@ -0,0 +1,81 @@
+import threading
+import pandas as pd
+from bulk_load import bulk_upsert
+from sql_queries import time_select_keys
+
+
+def build_time_frame(ts):
+    """
+    Build time records for distinct timestamps.
+
+    Parameters
+    ---------
+    ts: Series of epoch milliseconds.
+
+    Returns
+    -------
+    DataFrame (timestamp, hour, day, week, month, year, weekday), one row per distinct timestamp.
+    """
+    ts = ts.dropna().drop_duplicates()
+    t = pd.to_datetime(ts, unit='ms')
+    time_data = (ts, t.dt.hour, t.dt.day, t.dt.isocalendar().week, t.dt.month, t.dt.year, t.dt.weekday)
+    column_labels = ('timestamp', 'hour', 'day', 'week', 'month', 'year', 'weekday')
+    return pd.DataFrame(dict(zip(column_labels, time_data)))
+
+
+class TimeDimension:
+    """
+    Cache of timestamps already written to the time table.
+    Only timestamps missing from the cache are sent to the database, so
+    time writes scale with distinct timestamps rather than with events.
+    The cache is primed from the time table on first use; call `reset`
+    after a rollback so it is primed again. Safe to share between writer threads.
+    """
+
+    def __init__(self):
+        self.keys = None
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.keys = None
+
+    def new_rows(self, cur, time_df):
+        """
+        Select the time records whose timestamp is not loaded yet and add
+        them to the cache.
+
+        Parameters
+        ---------
+        cur: psycopg2 cursor object.
+        time_df: time records from `build_time_frame`.
+
+        Returns
+        -------
+        time records to write.
+        """
+        time_df = time_df.drop_duplicates('timestamp')
+        with self.lock:
+            if self.keys is None:
+                cur.execute(time_select_keys)
+                self.keys = {row[0] for row in cur.fetchall()}
+            time_df = time_df[~time_df['timestamp'].isin(self.keys)]
+            self.keys.update(time_df['timestamp'].tolist())
+        return time_df
+
+    def load(self, cur, time_df):
+        """
+        Write the new time records in bulk.
+
+        Parameters
+        ---------
+        cur: psycopg2 cursor object.
+        time_df: time records from `build_time_frame`.
+
+        Returns
+        -------
+        number of time records written.
+        """
+        time_df = self.new_rows(cur, time_df)
+        bulk_upsert(cur, time_df, 'time')
+        return len(time_df)
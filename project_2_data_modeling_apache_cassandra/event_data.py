@@ -0,0 +1,263 @@
+import io
+import os
+import csv
+import glob
+import argparse
+import itertools
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # only needed for the Parquet and Arrow IPC intermediate
+    pa = pq = None
+
+
+# columns of event_datafile_new.csv and their index in the event_data files
+EVENT_COLUMNS = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+                 'level', 'location', 'sessionId', 'song', 'userId']
+SOURCE_INDEXES = (0, 2, 3, 4, 5, 6, 7, 8, 12, 13, 16)
+
+# arrow types of EVENT_COLUMNS in the typed columnar intermediate
+EVENT_TYPES = ['string', 'string', 'string', 'int32', 'string', 'float64', 'string', 'string', 'int32', 'string', 'int32']
+COLUMNAR_EXTENSIONS = ('.parquet', '.arrow', '.feather')
+
+csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def get_event_files(filepath):
+    """
+    Get all csv file paths under a directory, sorted so the output order does not depend on the file system.
+    """
+    return sorted(glob.glob(os.path.join(filepath, '**', '*.csv'), recursive=True))
+
+
+def iter_event_rows(filepath):
+    """
+    Stream the rows of one event_data file, projected to EVENT_COLUMNS.
+    Rows with an empty artist are skipped.
+
+    Parameters
+    ---------
+    filepath: event_data csv file path.
+
+    Returns
+    -------
+    iterator of row tuples.
+    """
+    with open(filepath, 'r', encoding='utf8', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None)
+        for line in csvreader:
+            if line[0] == '':
+                continue
+            yield tuple(line[i] for i in SOURCE_INDEXES)
+
+
+def iter_chunks(rows, chunk_rows):
+    """
+    Group an iterator of rows into lists of at most `chunk_rows` rows.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            return
+        yield chunk
+
+
+def format_event_file(filepath):
+    """
+    Project one event_data file and format it as myDialect csv text, in a worker process.
+
+    Returns
+    -------
+    csv text and number of rows.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, dialect='myDialect')
+    rows = 0
+    for chunk in iter_chunks(iter_event_rows(filepath), 10000):
+        writer.writerows(chunk)
+        rows += len(chunk)
+    return out.getvalue(), rows
+
+
+def is_columnar(filepath):
+    """
+    Whether a path names a Parquet (.parquet) or Arrow IPC (.arrow, .feather) file.
+    """
+    return filepath.endswith(COLUMNAR_EXTENSIONS)
+
+
+def event_schema():
+    if pa is None:
+        raise ImportError('pyarrow is required for Parquet and Arrow IPC event data')
+    return pa.schema([(name, pa.type_for_alias(alias)) for name, alias in zip(EVENT_COLUMNS, EVENT_TYPES)])
+
+
+def to_record_batch(rows):
+    """
+    Type projected rows into an arrow RecordBatch of EVENT_COLUMNS.
+
+    Parameters
+    ---------
+    rows: list of row tuples from `iter_event_rows`.
+
+    Returns
+    -------
+    RecordBatch.
+    """
+    schema = event_schema()
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    arrays = [pa.array(values, pa.string()).cast(field.type) for values, field in zip(columns, schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def columnar_event_file(filepath):
+    """
+    Project one event_data file into a RecordBatch, in a worker process.
+
+    Returns
+    -------
+    RecordBatch and number of rows.
+    """
+    batch = to_record_batch(list(iter_event_rows(filepath)))
+    return batch, batch.num_rows
+
+
+class ColumnarWriter:
+    """
+    Writes RecordBatches of EVENT_COLUMNS to a Parquet or Arrow IPC file.
+    """
+
+    def __init__(self, filepath):
+        schema = event_schema()
+        if filepath.endswith('.parquet'):
+            self.writer = pq.ParquetWriter(filepath, schema, compression='zstd')
+        else:
+            self.writer = pa.ipc.new_file(filepath, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    def write(self, batch):
+        if batch.num_rows:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+def iter_columnar_batches(filepath):
+    """
+    Read the RecordBatches of a Parquet or Arrow IPC event data file.
+    Arrow IPC files are memory mapped; their zstd compressed buffers are
+    decompressed one record batch at a time.
+    """
+    if pa is None:
+        raise ImportError('pyarrow is required for Parquet and Arrow IPC event data')
+    if filepath.endswith('.parquet'):
+        yield from pq.ParquetFile(filepath).iter_batches()
+    else:
+        with pa.memory_map(filepath) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+
+def ordered_map(func, items, workers, window=None):
+    """
+    Map `func` over `items` in worker processes, yielding results in input order.
+    At most `window` results are pending at once, so memory stays bounded
+    however many items there are.
+    """
+    window = window or 2 * workers
+    pending = collections.deque()
+    with ProcessPoolExecutor(workers) as executor:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_event_data(file_path_list, out_path='event_datafile_new.csv', workers=4, chunk_rows=10000):
+    """
+    Merge event_data files into event_datafile_new.csv without holding all rows.
+    A .parquet, .arrow or .feather `out_path` writes the typed columnar
+    intermediate instead, with the same columns.
+    - With workers, files are projected in parallel processes and written in
+      input order; memory is bounded by a few files at a time.
+    - Without workers, rows stream from each file and are written in chunks
+      of `chunk_rows` rows.
+
+    Parameters
+    ---------
+    file_path_list: event_data csv file paths, written in this order.
+    out_path: output csv path.
+    workers: worker processes, 0 to stream in this process.
+    chunk_rows: rows per write when streaming.
+
+    Returns
+    -------
+    number of rows written.
+    """
+    if is_columnar(out_path):
+        return write_columnar_event_data(file_path_list, out_path, workers, chunk_rows)
+
+    rows = 0
+    with open(out_path, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f, dialect='myDialect')
+        writer.writerow(EVENT_COLUMNS)
+        if workers:
+            for text, count in ordered_map(format_event_file, file_path_list, workers):
+                f.write(text)
+                rows += count
+        else:
+            for filepath in file_path_list:
+                for chunk in iter_chunks(iter_event_rows(filepath), chunk_rows):
+                    writer.writerows(chunk)
+                    rows += len(chunk)
+    return rows
+
+
+def write_columnar_event_data(file_path_list, out_path, workers=4, chunk_rows=10000):
+    """
+    Merge event_data files into a typed Parquet or Arrow IPC file, one record batch per file or chunk.
+    See `write_event_data`.
+    """
+    rows = 0
+    writer = ColumnarWriter(out_path)
+    try:
+        if workers:
+            for batch, count in ordered_map(columnar_event_file, file_path_list, workers):
+                writer.write(batch)
+                rows += count
+        else:
+            for filepath in file_path_list:
+                for chunk in iter_chunks(iter_event_rows(filepath), chunk_rows):
+                    writer.write(to_record_batch(chunk))
+                    rows += len(chunk)
+    finally:
+        writer.close()
+    return rows
+
+
+def main():
+    """
+    Build event_datafile_new.csv from the event_data directory.
+    """
+    parser = argparse.ArgumentParser(description='Merge event_data csv files into event_datafile_new.csv.')
+    parser.add_argument('--input', default='event_data', help='event_data directory')
+    parser.add_argument('--output', default='event_datafile_new.csv',
+                        help='csv, or .parquet/.arrow for the typed columnar intermediate')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes, 0 to stream in this process')
+    args = parser.parse_args()
+
+    rows = write_event_data(get_event_files(args.input), args.output, args.workers)
+    print('{} rows written to {}'.format(rows, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import csv
+import time
+import argparse
+import collections
+from cassandra.cluster import Cluster
+from cassandra.query import BatchStatement, BatchType
+from tables import query_tables, select_tables, create_tables, parse_event, Event
+from event_data import EVENT_COLUMNS, is_columnar, iter_columnar_batches
+
+
+def unlogged_batch():
+    """
+    Batch of rows of one partition, written atomically by its replicas without a batch log.
+    """
+    return BatchStatement(batch_type=BatchType.UNLOGGED)
+
+
+class Loader:
+    """
+    Writes rows of query tables through one session.
+    - The INSERT of each table is prepared once.
+    - Rows are grouped by partition key into unlogged batches of at most
+      `batch_size` rows; a batch never spans two partitions.
+    - At most `max_in_flight` requests run at once with `execute_async`.
+    - A failed request is retried `retries` times, waiting `backoff`,
+      2 * `backoff`, ... seconds, before its error is raised.
+    - At most `buffer_rows` rows wait for their batch to fill.
+    - `on_write(table name, partition key values)` is called once a write
+      succeeds, e.g. `QueryCache.invalidate`.
+    The session only needs `prepare` and `execute_async` returning a future
+    with `result`; pass `batch_factory` when it is not a cassandra session.
+    Use it as a context manager, or call `flush` when done.
+    """
+
+    def __init__(self, session, max_in_flight=64, batch_size=20, retries=3, backoff=0.1, buffer_rows=5000,
+                 batch_factory=unlogged_batch, on_write=None):
+        self.session = session
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.buffer_rows = buffer_rows
+        self.batch_factory = batch_factory
+        self.on_write = on_write
+        self.prepared = {}
+        self.groups = {}
+        self.buffered = 0
+        self.in_flight = collections.deque()
+        self.rows_written = 0
+        self.requests = 0
+        self.retried = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def prepare(self, table):
+        if table.name not in self.prepared:
+            self.prepared[table.name] = self.session.prepare(table.insert)
+        return self.prepared[table.name]
+
+    def add(self, table, values):
+        """
+        Queue the insert of one row.
+
+        Parameters
+        ---------
+        table: QueryTable.
+        values: insert values, partition key first.
+        """
+        self.prepare(table)
+        key = (table.name, tuple(values[:table.partition_key]))
+        group = self.groups.setdefault(key, [])
+        group.append(values)
+        self.buffered += 1
+        if len(group) >= self.batch_size:
+            self.send(key)
+        elif self.buffered >= self.buffer_rows:
+            self.send_all()
+
+    def send(self, key):
+        """
+        Send the queued rows of one partition.
+        """
+        rows = self.groups.pop(key)
+        self.buffered -= len(rows)
+        prepared = self.prepared[key[0]]
+        if len(rows) == 1:
+            self.submit(key, prepared, rows[0], 1)
+        else:
+            batch = self.batch_factory()
+            for values in rows:
+                batch.add(prepared, values)
+            self.submit(key, batch, None, len(rows))
+
+    def send_all(self):
+        for key in list(self.groups):
+            self.send(key)
+
+    def submit(self, key, statement, params, rows):
+        while len(self.in_flight) >= self.max_in_flight:
+            self.wait()
+        self.in_flight.append((self.session.execute_async(statement, params), key, statement, params, rows))
+        self.requests += 1
+
+    def wait(self):
+        """
+        Wait for the oldest request in flight, retrying it on failure.
+        """
+        future, key, statement, params, rows = self.in_flight.popleft()
+        attempt = 0
+        while True:
+            try:
+                future.result()
+                break
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+                self.retried += 1
+                future = self.session.execute_async(statement, params)
+        self.rows_written += rows
+        if self.on_write is not None:
+            self.on_write(*key)
+
+    def flush(self):
+        """
+        Send every queued row and wait for all requests.
+        """
+        self.send_all()
+        while self.in_flight:
+            self.wait()
+
+
+def read_events(filepath):
+    """
+    Read and type the lines of event_datafile_new.csv, without its header.
+    Parquet and Arrow IPC event data is already typed and read by column.
+    """
+    if is_columnar(filepath):
+        yield from read_columnar_events(filepath)
+        return
+
+    with open(filepath, encoding='utf8') as f:
+        csvreader = csv.reader(f)
+        next(csvreader)
+        for line in csvreader:
+            yield parse_event(line)
+
+
+def event_columns(batch):
+    """
+    Function returning the values of an Event field in a RecordBatch of
+    event data, as a list. Each arrow column is converted once, when first asked for.
+    """
+    names = dict(zip(Event._fields, EVENT_COLUMNS))
+    converted = {}
+
+    def column(field):
+        if field not in converted:
+            converted[field] = batch.column(names[field]).to_pylist()
+        return converted[field]
+    return column
+
+
+def read_columnar_events(filepath):
+    """
+    Read the events of a Parquet or Arrow IPC event data file, one record batch at a time.
+    `load_columnar_events` loads them without building an Event per row.
+    """
+    for batch in iter_columnar_batches(filepath):
+        column = event_columns(batch)
+        for values in zip(*(column(field) for field in Event._fields)):
+            yield Event(*values)
+
+
+def load_events(loader, events, tables=query_tables):
+    """
+    Route every event to every query table in one pass, through one loader.
+
+    Parameters
+    ---------
+    loader: Loader.
+    events: iterator of Event.
+    tables: QueryTables, default all registered tables.
+
+    Returns
+    -------
+    number of events.
+    """
+    count = 0
+    for event in events:
+        for table in tables:
+            loader.add(table, table.values(event))
+        count += 1
+    loader.flush()
+    return count
+
+
+def load_columnar_events(loader, filepath, tables=query_tables):
+    """
+    Load a Parquet or Arrow IPC event data file into every query table in one
+    pass, one record batch at a time. Each table takes its insert values from
+    the batch's columns, and only the columns some table uses are converted.
+
+    Parameters
+    ---------
+    loader: Loader.
+    filepath: Parquet or Arrow IPC event data file.
+    tables: QueryTables, default all registered tables.
+
+    Returns
+    -------
+    number of events.
+    """
+    count = 0
+    for batch in iter_columnar_batches(filepath):
+        column = event_columns(batch)
+        for table in tables:
+            for values in zip(*table.columns(column)):
+                loader.add(table, values)
+        count += batch.num_rows
+    loader.flush()
+    return count
+
+
+def main():
+    """
+    Create the query tables and load event_datafile_new.csv into all of them in one pass.
+    """
+    parser = argparse.ArgumentParser(description='Load event data into the Cassandra query tables.')
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'])
+    parser.add_argument('--file', default='event_datafile_new.csv', help='csv, .parquet or .arrow event data')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='concurrent requests')
+    parser.add_argument('--batch-size', type=int, default=20, help='rows per single-partition batch')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--song-buckets', type=int, help='load user_by_song_bucketed with this many buckets per song')
+    args = parser.parse_args()
+
+    cluster = Cluster(args.hosts)
+    session = cluster.connect()
+    tables = select_tables(args.song_buckets)
+    create_tables(session, tables)
+
+    loader = Loader(session, max_in_flight=args.max_in_flight, batch_size=args.batch_size, retries=args.retries)
+    if is_columnar(args.file):
+        events = load_columnar_events(loader, args.file, tables)
+    else:
+        events = load_events(loader, read_events(args.file), tables)
+    print('{} events, {} rows written to {} tables'.format(events, loader.rows_written, len(tables)))
+
+    session.shutdown()
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import heapq
+from tables import song_in_session_select, song_in_user_and_session_select, user_by_song_select, \
+    user_by_song_bucketed_select
+
+
+class Queries:
+    """
+    Read helpers for the questions of the notebook, on prepared statements.
+    With `song_buckets`, listeners of a song are read from
+    user_by_song_bucketed: all buckets are queried concurrently and merged
+    in user_id order, as one user_by_song partition would return them.
+    With a QueryCache, repeated reads are answered from memory until they
+    expire or a write to their partition invalidates them.
+    """
+
+    def __init__(self, session, song_buckets=None, cache=None):
+        self.session = session
+        self.song_buckets = song_buckets
+        self.cache = cache
+        self.prepared = {}
+
+    def prepare(self, query):
+        if query not in self.prepared:
+            self.prepared[query] = self.session.prepare(query)
+        return self.prepared[query]
+
+    def execute(self, query, params):
+        return list(self.session.execute(self.prepare(query), params))
+
+    def cached(self, table, params, partitions, read):
+        """
+        Read through the cache.
+
+        Parameters
+        ---------
+        table: table name.
+        params: primary key values of the read.
+        partitions: partition key values the read covers.
+        read: function returning the rows on a cache miss.
+        """
+        if self.cache is None:
+            return read()
+        key = (table, params)
+        rows = self.cache.get(key)
+        if rows is None:
+            partitions = [(table, tuple(partition)) for partition in partitions]
+            # a write landing during the read must keep its rows out of the cache
+            version = self.cache.version(partitions)
+            rows = read()
+            self.cache.put(key, rows, partitions, version)
+        return rows
+
+    def song_in_session(self, session_id, item_in_session):
+        """
+        Artist, song title and length of an item in a session.
+        """
+        params = (session_id, item_in_session)
+        return self.cached('song_in_session', params, [(session_id,)],
+                           lambda: self.execute(song_in_session_select, params))
+
+    def songs_in_user_session(self, user_id, session_id):
+        """
+        Artist, song and user name of every item of a user's session, in item order.
+        """
+        params = (user_id, session_id)
+        return self.cached('song_in_user_and_session', params, [params],
+                           lambda: self.execute(song_in_user_and_session_select, params))
+
+    def users_by_song(self, song):
+        """
+        Song, user_id and name of every user who listened to a song, in user_id order.
+        """
+        if not self.song_buckets:
+            return self.cached('user_by_song', (song,), [(song,)],
+                               lambda: self.execute(user_by_song_select, (song,)))
+
+        buckets = range(self.song_buckets)
+        return self.cached('user_by_song_bucketed', (song,), [(song, bucket) for bucket in buckets],
+                           lambda: self.read_buckets(song, buckets))
+
+    def read_buckets(self, song, buckets):
+        prepared = self.prepare(user_by_song_bucketed_select)
+        futures = [self.session.execute_async(prepared, (song, bucket)) for bucket in buckets]
+        rows = [list(future.result()) for future in futures]
+        return list(heapq.merge(*rows, key=lambda row: row[1]))
@@ -0,0 +1,122 @@
+import time
+import threading
+import collections
+
+
+class QueryCache:
+    """
+    LRU result cache with a time to live, keyed by table and primary key values.
+    - Entries older than `ttl` seconds are misses; the least recently used
+      entry is evicted beyond `max_entries`.
+    - Each entry records the partitions it was read from; `invalidate` drops
+      every entry of a partition, so pass it as the loader's `on_write`.
+    - `invalidate` also counts the writes of each partition. Take `version`
+      before a read and give it to `put`, so rows read while their partition
+      was written are not cached.
+    - `hits`, `misses` and `hit_rate` measure its use.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.partitions = {}
+        # invalidations per partition, for `version`
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key):
+        """
+        Cached rows of a read, or None.
+
+        Parameters
+        ---------
+        key: (table name, primary key values).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or self.clock() - entry[0] > self.ttl:
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def version(self, partitions):
+        """
+        Invalidation counts of partitions, taken before reading them.
+
+        Parameters
+        ---------
+        partitions: (table name, partition key values) about to be read.
+        """
+        with self.lock:
+            return [self.versions.get(partition, 0) for partition in partitions]
+
+    def put(self, key, rows, partitions, version=None):
+        """
+        Cache the rows of a read, unless one of its partitions was
+        invalidated since `version` was taken.
+
+        Parameters
+        ---------
+        key: (table name, primary key values).
+        rows: list of result rows.
+        partitions: (table name, partition key values) the rows were read from.
+        version: `version` of `partitions` taken before the read, optional.
+        """
+        with self.lock:
+            if version is not None and version != [self.versions.get(partition, 0) for partition in partitions]:
+                return
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (self.clock(), list(rows), partitions)
+            for partition in partitions:
+                self.partitions.setdefault(partition, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, table, partition):
+        """
+        Drop the cached reads of a partition that was written.
+
+        Parameters
+        ---------
+        table: table name.
+        partition: partition key values.
+        """
+        partition = (table, tuple(partition))
+        with self.lock:
+            self.versions[partition] = self.versions.get(partition, 0) + 1
+            for key in list(self.partitions.get(partition, ())):
+                self.remove(key)
+                self.invalidations += 1
+
+    def remove(self, key):
+        # caller holds the lock
+        timestamp, rows, partitions = self.entries.pop(key)
+        for partition in partitions:
+            keys = self.partitions.get(partition)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.partitions[partition]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.partitions.clear()
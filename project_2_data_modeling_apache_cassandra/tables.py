@@ -0,0 +1,215 @@
+from collections import namedtuple
+
+
+# KEYSPACE
+
+keyspace_create = ("""
+    CREATE KEYSPACE IF NOT EXISTS udacity
+    WITH REPLICATION =
+    { 'class' : 'SimpleStrategy', 'replication_factor' : 1}
+""")
+
+# 1. artist, song title and song's length heard during sessionId = 338, and itemInSession = 4
+
+song_in_session_table_drop = "DROP TABLE IF EXISTS song_in_session"
+
+song_in_session_table_create = ("""
+    CREATE TABLE IF NOT EXISTS song_in_session
+    (session_id int,
+    item_in_session int,
+    artist text,
+    song text,
+    length double,
+    PRIMARY KEY(session_id, item_in_session))
+""")
+
+song_in_session_insert = ("""
+    INSERT INTO song_in_session (session_id, item_in_session, artist, song, length)
+    VALUES (?, ?, ?, ?, ?)
+""")
+
+# 2. artist, song (sorted by itemInSession) and user name for userid = 10, sessionid = 182
+
+song_in_user_and_session_table_drop = "DROP TABLE IF EXISTS song_in_user_and_session"
+
+song_in_user_and_session_table_create = ("""
+    CREATE TABLE IF NOT EXISTS song_in_user_and_session
+    (user_id int,
+    session_id int,
+    item_in_session int,
+    artist text,
+    song text,
+    first_name text,
+    last_name text,
+    PRIMARY KEY((user_id, session_id), item_in_session))
+""")
+
+song_in_user_and_session_insert = ("""
+    INSERT INTO song_in_user_and_session (user_id, session_id, item_in_session, artist, song, first_name, last_name)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+""")
+
+# 3. every user name who listened to the song 'All Hands Against His Own'
+
+user_by_song_table_drop = "DROP TABLE IF EXISTS user_by_song"
+
+user_by_song_table_create = ("""
+    CREATE TABLE IF NOT EXISTS user_by_song
+    (song text,
+    user_id int,
+    first_name text,
+    last_name text,
+    PRIMARY KEY(song, user_id))
+""")
+
+user_by_song_insert = ("""
+    INSERT INTO user_by_song (song, user_id, first_name, last_name)
+    VALUES (?, ?, ?, ?)
+""")
+
+# 3b. same question, each song split over buckets of users so a hit song
+#     is not one unbounded partition
+
+user_by_song_bucketed_table_drop = "DROP TABLE IF EXISTS user_by_song_bucketed"
+
+user_by_song_bucketed_table_create = ("""
+    CREATE TABLE IF NOT EXISTS user_by_song_bucketed
+    (song text,
+    bucket int,
+    user_id int,
+    first_name text,
+    last_name text,
+    PRIMARY KEY((song, bucket), user_id))
+""")
+
+user_by_song_bucketed_insert = ("""
+    INSERT INTO user_by_song_bucketed (song, bucket, user_id, first_name, last_name)
+    VALUES (?, ?, ?, ?, ?)
+""")
+
+# SELECTS
+
+song_in_session_select = ("""
+    SELECT artist, song, length FROM song_in_session WHERE session_id = ? AND item_in_session = ?
+""")
+
+song_in_user_and_session_select = ("""
+    SELECT artist, song, first_name, last_name FROM song_in_user_and_session WHERE user_id = ? AND session_id = ?
+""")
+
+user_by_song_select = ("""
+    SELECT song, user_id, first_name, last_name FROM user_by_song WHERE song = ?
+""")
+
+user_by_song_bucketed_select = ("""
+    SELECT song, user_id, first_name, last_name FROM user_by_song_bucketed WHERE song = ? AND bucket = ?
+""")
+
+
+# EVENTS
+# One line of event_datafile_new.csv, parsed and typed once for every table.
+Event = namedtuple('Event', ['artist', 'first_name', 'gender', 'item_in_session', 'last_name', 'length',
+                             'level', 'location', 'session_id', 'song', 'user_id'])
+
+
+def parse_event(line):
+    """
+    Type an event_datafile_new.csv line.
+
+    Parameters
+    ---------
+    line: list of 11 strings in `event_data.EVENT_COLUMNS` order.
+
+    Returns
+    -------
+    Event.
+    """
+    return Event(line[0], line[1], line[2], int(line[3]), line[4], float(line[5]),
+                 line[6], line[7], int(line[8]), line[9], int(line[10]))
+
+
+# QUERY TABLES
+# - insert: prepared once by the loader, partition key columns first.
+# - partition_key: number of leading insert values forming the partition key.
+# - values: insert values of an Event.
+# - columns: insert value columns of a batch of events, given a function
+#   returning the values of an Event field as a list (columnar event data).
+# Registered tables are all fed by one pass over the event data; a new
+# query table only needs its declaration and `register`.
+QueryTable = namedtuple('QueryTable', ['name', 'create', 'drop', 'insert', 'partition_key', 'values', 'columns'])
+
+query_tables = []
+
+
+def register(table):
+    """
+    Add a query table to the tables created and loaded by default.
+    """
+    query_tables.append(table)
+    return table
+
+
+song_in_session = register(QueryTable(
+    'song_in_session', song_in_session_table_create, song_in_session_table_drop, song_in_session_insert, 1,
+    lambda e: (e.session_id, e.item_in_session, e.artist, e.song, e.length),
+    lambda c: (c('session_id'), c('item_in_session'), c('artist'), c('song'), c('length'))))
+
+song_in_user_and_session = register(QueryTable(
+    'song_in_user_and_session', song_in_user_and_session_table_create, song_in_user_and_session_table_drop,
+    song_in_user_and_session_insert, 2,
+    lambda e: (e.user_id, e.session_id, e.item_in_session, e.artist, e.song, e.first_name, e.last_name),
+    lambda c: (c('user_id'), c('session_id'), c('item_in_session'), c('artist'), c('song'), c('first_name'),
+               c('last_name'))))
+
+user_by_song = register(QueryTable(
+    'user_by_song', user_by_song_table_create, user_by_song_table_drop, user_by_song_insert, 1,
+    lambda e: (e.song, e.user_id, e.first_name, e.last_name),
+    lambda c: (c('song'), c('user_id'), c('first_name'), c('last_name'))))
+
+
+def song_bucket(user_id, buckets):
+    """
+    Bucket of a user's row in user_by_song_bucketed.
+    """
+    return user_id % buckets
+
+
+def bucketed_user_by_song(buckets):
+    """
+    Declare user_by_song_bucketed, spreading the listeners of each song over `buckets` partitions.
+    Not registered by default; use it in place of user_by_song.
+    """
+    return QueryTable(
+        'user_by_song_bucketed', user_by_song_bucketed_table_create, user_by_song_bucketed_table_drop,
+        user_by_song_bucketed_insert, 2,
+        lambda e: (e.song, song_bucket(e.user_id, buckets), e.user_id, e.first_name, e.last_name),
+        lambda c: (c('song'), [song_bucket(user_id, buckets) for user_id in c('user_id')], c('user_id'),
+                   c('first_name'), c('last_name')))
+
+
+def select_tables(song_buckets=None):
+    """
+    Registered query tables, with user_by_song replaced by its bucketed
+    version when `song_buckets` is given.
+    """
+    if not song_buckets:
+        return list(query_tables)
+    return [bucketed_user_by_song(song_buckets) if table is user_by_song else table for table in query_tables]
+
+
+def create_tables(session, tables=query_tables):
+    """
+    Create the keyspace and each query table, and use the keyspace.
+    """
+    session.execute(keyspace_create)
+    session.set_keyspace('udacity')
+    for table in tables:
+        session.execute(table.create)
+
+
+def drop_tables(session, tables=query_tables):
+    """
+    Drop each query table.
+    """
+    for table in tables:
+        session.execute(table.drop)
@@ -0,0 +1,153 @@
+import os
+import pytest
+from loader import Loader, read_events, load_events, load_columnar_events
+from tables import query_tables, song_in_session, user_by_song, bucketed_user_by_song
+from event_data import get_event_files, write_columnar_event_data
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EVENT_FILE = os.path.join(HERE, 'event_datafile_new.csv')
+
+
+class Prepared:
+    def __init__(self, query):
+        self.query = query
+        self.table = query.split()[2]
+
+
+class Batch(list):
+    def add(self, statement, params):
+        self.append((statement, params))
+
+
+class Future:
+    def __init__(self, session, run):
+        self.session = session
+        self.run = run
+
+    def result(self):
+        self.session.in_flight -= 1
+        return self.run()
+
+
+class FakeSession:
+    """
+    In-process stand-in for a cassandra session: rows are kept per table by
+    primary key, and writes run when their future's result is asked for.
+    """
+
+    def __init__(self, primary_keys, failures=0):
+        self.primary_keys = primary_keys
+        self.failures = failures
+        self.rows = {}
+        self.prepared = []
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def prepare(self, query):
+        self.prepared.append(query)
+        return Prepared(query)
+
+    def write(self, statement, params):
+        key = tuple(params[:self.primary_keys[statement.table]])
+        self.rows.setdefault(statement.table, {})[key] = tuple(params)
+
+    def execute_async(self, statement, params=None):
+        self.requests.append((statement, params))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        def run():
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError('write timeout')
+            if isinstance(statement, Batch):
+                for batch_statement, batch_params in statement:
+                    self.write(batch_statement, batch_params)
+            else:
+                self.write(statement, params)
+        return Future(self, run)
+
+
+PRIMARY_KEYS = {'song_in_session': 2, 'song_in_user_and_session': 3, 'user_by_song': 2, 'user_by_song_bucketed': 3}
+
+
+def test_insert_prepared_once_per_table():
+    session = FakeSession(PRIMARY_KEYS)
+    with Loader(session, batch_factory=Batch) as loader:
+        for item in range(50):
+            loader.add(song_in_session, (item % 3, item, 'artist', 'song', 1.0))
+            loader.add(user_by_song, ('song', item, 'first', 'last'))
+
+    assert sorted(session.prepared) == sorted([song_in_session.insert, user_by_song.insert])
+    assert loader.rows_written == 100
+
+
+def test_batches_hold_one_partition_and_at_most_batch_size_rows():
+    session = FakeSession(PRIMARY_KEYS)
+    with Loader(session, batch_size=4, batch_factory=Batch) as loader:
+        for item in range(30):
+            loader.add(song_in_session, (item % 3, item, 'artist', 'song', 1.0))
+
+    for statement, params in session.requests:
+        rows = statement if isinstance(statement, Batch) else [(statement, params)]
+        assert len(rows) <= 4
+        assert len({batch_params[0] for batch_statement, batch_params in rows}) == 1
+    assert len(session.requests) == 9
+    assert len(session.rows['song_in_session']) == 30
+
+
+def test_requests_in_flight_are_bounded():
+    session = FakeSession(PRIMARY_KEYS)
+    with Loader(session, max_in_flight=3, batch_size=1, batch_factory=Batch) as loader:
+        for item in range(20):
+            loader.add(user_by_song, ('song {}'.format(item), item, 'first', 'last'))
+
+    assert session.max_in_flight == 3
+    assert session.in_flight == 0
+
+
+def test_failed_writes_are_retried():
+    session = FakeSession(PRIMARY_KEYS, failures=2)
+    with Loader(session, batch_size=1, backoff=0, batch_factory=Batch) as loader:
+        loader.add(user_by_song, ('song', 1, 'first', 'last'))
+
+    assert loader.retried == 2
+    assert session.rows['user_by_song'] == {('song', 1): ('song', 1, 'first', 'last')}
+
+
+def test_write_error_raised_after_retries():
+    session = FakeSession(PRIMARY_KEYS, failures=3)
+    loader = Loader(session, batch_size=1, retries=2, backoff=0, batch_factory=Batch)
+    loader.add(user_by_song, ('song', 1, 'first', 'last'))
+    with pytest.raises(RuntimeError):
+        loader.flush()
+
+
+def test_load_events_feeds_every_table():
+    session = FakeSession(PRIMARY_KEYS)
+    events = list(read_events(EVENT_FILE))
+    loader = Loader(session, batch_factory=Batch)
+
+    assert load_events(loader, iter(events)) == len(events)
+    for table in query_tables:
+        expected = {table.values(event)[:PRIMARY_KEYS[table.name]] for event in events}
+        assert set(session.rows[table.name]) == expected
+
+
+@pytest.mark.parametrize('extension', ['.parquet', '.arrow'])
+def test_columnar_load_matches_csv_load(tmp_path, extension):
+    pytest.importorskip('pyarrow')
+    columnar_file = str(tmp_path / ('events' + extension))
+    write_columnar_event_data(get_event_files(os.path.join(HERE, 'event_data')), columnar_file, workers=0)
+    tables = query_tables + [bucketed_user_by_song(4)]
+
+    csv_session = FakeSession(PRIMARY_KEYS)
+    csv_events = load_events(Loader(csv_session, batch_factory=Batch), read_events(EVENT_FILE), tables)
+    columnar_session = FakeSession(PRIMARY_KEYS)
+    columnar_events = load_columnar_events(Loader(columnar_session, batch_factory=Batch), columnar_file, tables)
+
+    assert columnar_events == csv_events
+    assert columnar_session.rows == csv_session.rows
+    assert list(read_events(columnar_file)) == list(read_events(EVENT_FILE))
@@ -0,0 +1,103 @@
+from query_cache import QueryCache
+from queries import Queries
+from tables import song_in_session_select
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Session:
+    """
+    Session stand-in answering song_in_session reads from `rows`, with an
+    optional hook run during each read.
+    """
+
+    def __init__(self, rows, during_read=None):
+        self.rows = rows
+        self.during_read = during_read
+        self.reads = 0
+
+    def prepare(self, query):
+        return query
+
+    def execute(self, statement, params):
+        assert statement == song_in_session_select
+        self.reads += 1
+        rows = list(self.rows.get(params, []))
+        if self.during_read is not None:
+            self.during_read(params)
+        return rows
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryCache(max_entries=2)
+    cache.put(('t', (1,)), ['a'], [('t', (1,))])
+    cache.put(('t', (2,)), ['b'], [('t', (2,))])
+    assert cache.get(('t', (1,))) == ['a']
+    cache.put(('t', (3,)), ['c'], [('t', (3,))])
+
+    assert cache.get(('t', (2,))) is None
+    assert cache.get(('t', (1,))) == ['a'] and cache.get(('t', (3,))) == ['c']
+    assert cache.evictions == 1
+    assert cache.partitions == {('t', (1,)): {('t', (1,))}, ('t', (3,)): {('t', (3,))}}
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = QueryCache(ttl=10, clock=clock)
+    cache.put(('t', (1,)), ['a'], [('t', (1,))])
+    clock.now = 10
+    assert cache.get(('t', (1,))) == ['a']
+    clock.now = 10.5
+    assert cache.get(('t', (1,))) is None
+    assert (cache.hits, cache.misses, cache.hit_rate) == (1, 1, 0.5)
+    assert cache.entries == {}
+
+
+def test_write_invalidates_the_reads_of_its_partition():
+    cache = QueryCache()
+    cache.put(('song_in_session', (1, 0)), ['a'], [('song_in_session', (1,))])
+    cache.put(('song_in_session', (1, 1)), ['b'], [('song_in_session', (1,))])
+    cache.put(('song_in_session', (2, 0)), ['c'], [('song_in_session', (2,))])
+
+    cache.invalidate('song_in_session', [1])
+    assert cache.get(('song_in_session', (1, 0))) is None and cache.get(('song_in_session', (1, 1))) is None
+    assert cache.get(('song_in_session', (2, 0))) == ['c']
+    assert cache.invalidations == 2
+
+
+def test_repeated_reads_are_answered_from_the_cache():
+    session = Session({(338, 4): [('Faithless', 'Music Matters', 495.3)]})
+    queries = Queries(session, cache=QueryCache())
+    first = queries.song_in_session(338, 4)
+    assert queries.song_in_session(338, 4) == first
+    assert session.reads == 1
+
+    queries.cache.invalidate('song_in_session', (338,))
+    queries.song_in_session(338, 4)
+    assert session.reads == 2
+
+
+def test_write_during_a_read_keeps_its_rows_out_of_the_cache():
+    cache = QueryCache()
+    rows = {(338, 4): [('old',)]}
+
+    def write(params):
+        # the loader writes the partition after the read returned its rows
+        rows[params] = [('new',)]
+        cache.invalidate('song_in_session', params[:1])
+
+    session = Session(rows, during_read=write)
+    queries = Queries(session, cache=cache)
+    assert queries.song_in_session(338, 4) == [('old',)]
+
+    session.during_read = None
+    assert queries.song_in_session(338, 4) == [('new',)]
+    assert session.reads == 2
+    assert queries.song_in_session(338, 4) == [('new',)]
+    assert session.reads == 2
@@ -0,0 +1,314 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import configparser
+from datetime import datetime
+import psycopg2
+import psycopg2.extensions
+from sql_queries import create_table_queries, copy_table_queries, insert_table_queries, load_steps, \
+    staging_events_manifest_copy, staging_songs_manifest_copy, staging_plays_insert, time_calendar_build
+from local_redshift import LocalCursor
+from staging_plan import plan_staging
+from telemetry import statement_label
+
+
+ADMIN_CONN_STRING = "host=127.0.0.1 dbname=studentdb user=student password=student"
+BENCH_DB = 'dwh_bench'
+# synthetic rows per scale factor
+EVENTS_PER_SCALE = 10000
+SONGS_PER_SCALE = 1000
+
+# staging_events columns, in table order, for the jsonpaths file
+EVENT_KEYS = ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level', 'location',
+              'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts', 'userAgent', 'userId']
+PAGES = ['NextSong'] * 8 + ['Home', 'Logout']
+USER_AGENT = '"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143"'
+START_TS = 1541030400000  # 2018-11-01
+DAYS = 30
+
+
+def write_synthetic_data(out_dir, events, songs, seed=0, days=DAYS, match_rate=0.9):
+    """
+    Write song_data and log_data JSON shaped like the S3 datasets.
+    - songs by about songs / 2 artists, 1000 songs per file;
+    - events of events / 100 users over `days` days, one file per day;
+      `match_rate` of the NextSong events play a song of song_data.
+    The same arguments always give the same files.
+
+    Parameters
+    ---------
+    out_dir: output directory.
+    events: number of log events.
+    songs: number of songs.
+    seed: random seed.
+    days: days of events.
+    match_rate: share of song plays matching song_data.
+
+    Returns
+    -------
+    number of bytes written.
+    """
+    rng = random.Random(seed)
+    catalog = []
+    for i in range(songs):
+        artist = rng.randrange(max(1, songs // 2))
+        catalog.append({
+            'num_songs': 1,
+            'artist_id': 'AR{:016d}'.format(artist),
+            'artist_latitude': None if artist % 3 else round(rng.uniform(-90, 90), 5),
+            'artist_longitude': None if artist % 3 else round(rng.uniform(-180, 180), 5),
+            'artist_location': 'City {}'.format(artist % 100),
+            'artist_name': 'Artist {}'.format(artist),
+            'song_id': 'SO{:016d}'.format(i),
+            'title': 'Song {}'.format(i),
+            'duration': round(rng.uniform(60, 600), 5),
+            'year': rng.choice([0, rng.randrange(1960, 2019)]),
+        })
+
+    size = 0
+    os.makedirs(os.path.join(out_dir, 'song_data'), exist_ok=True)
+    for first in range(0, songs, 1000):
+        path = os.path.join(out_dir, 'song_data', 'songs-{:05d}.json'.format(first // 1000))
+        with open(path, 'w', encoding='utf8') as f:
+            for song in catalog[first:first + 1000]:
+                f.write(json.dumps(song) + '\n')
+        size += os.path.getsize(path)
+
+    users = [{'userId': str(i + 1), 'firstName': 'First{}'.format(i), 'lastName': 'Last{}'.format(i),
+              'gender': rng.choice('MF'), 'level': rng.choice(['free', 'paid']),
+              'location': 'Town {}'.format(i % 50), 'registration': 1540000000000.0 + i}
+             for i in range(max(10, events // 100))]
+    per_day = [events // days + (1 if day < events % days else 0) for day in range(days)]
+    session = 0
+    for day, count in enumerate(per_day):
+        day_start = START_TS + day * 86400000
+        path = os.path.join(out_dir, 'log_data', time.strftime('%Y/%m/%Y-%m-%d-events.json',
+                                                               time.gmtime(day_start / 1000)))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf8') as f:
+            for ts in sorted(day_start + rng.randrange(86400000) for _ in range(count)):
+                user = rng.choice(users)
+                page = rng.choice(PAGES)
+                song = rng.choice(catalog) if catalog and rng.random() < match_rate else None
+                session += rng.random() < 0.05
+                f.write(json.dumps({
+                    'artist': (song['artist_name'] if song else 'Unknown Artist') if page == 'NextSong' else None,
+                    'auth': 'Logged In',
+                    'firstName': user['firstName'],
+                    'gender': user['gender'],
+                    'itemInSession': rng.randrange(100),
+                    'lastName': user['lastName'],
+                    'length': (song['duration'] if song else 200.0) if page == 'NextSong' else None,
+                    'level': user['level'],
+                    'location': user['location'],
+                    'method': 'PUT' if page == 'NextSong' else 'GET',
+                    'page': page,
+                    'registration': user['registration'],
+                    'sessionId': session,
+                    'song': (song['title'] if song else 'Unknown Song') if page == 'NextSong' else None,
+                    'status': 200,
+                    'ts': ts,
+                    'userAgent': USER_AGENT,
+                    'userId': user['userId'],
+                }) + '\n')
+        size += os.path.getsize(path)
+
+    with open(os.path.join(out_dir, 'log_json_path.json'), 'w') as f:
+        json.dump({'jsonpaths': ["$['{}']".format(key) for key in EVENT_KEYS]}, f, indent=2)
+    return size
+
+
+def data_locations(config, data_dir):
+    """
+    Map the S3 urls of dwh.cfg to the synthetic data.
+    """
+    def url(name):
+        return config['S3'][name].strip("'")
+    return {
+        url('LOG_DATA'): os.path.join(data_dir, 'log_data'),
+        url('SONG_DATA'): os.path.join(data_dir, 'song_data'),
+        url('LOG_JSONPATH'): os.path.join(data_dir, 'log_json_path.json'),
+    }
+
+
+def create_bench_database(admin_conn_string):
+    """
+    Drop and create the throwaway benchmark database.
+    """
+    conn = psycopg2.connect(admin_conn_string)
+    conn.set_session(autocommit=True)
+    cur = conn.cursor()
+    cur.execute("DROP DATABASE IF EXISTS {}".format(BENCH_DB))
+    cur.execute("CREATE DATABASE {} WITH ENCODING 'utf8' TEMPLATE template0".format(BENCH_DB))
+    conn.close()
+
+
+def plan_nodes(plan):
+    """
+    Node names of an EXPLAIN plan without costs, to compare plan shapes.
+    """
+    return [re.sub(r'\s+\(cost=.*\)$', '', line).strip() for line in plan if '(cost=' in line]
+
+
+def run_statements(cur, conn, statements, explain=True):
+    """
+    Run (phase, label, query) statements in order, each committed, and
+    measure them.
+
+    Returns
+    -------
+    list of dicts of phase, label, elapsed_s, rows and the EXPLAIN plan of inserts.
+    """
+    results = []
+    for phase, label, query in statements:
+        plan = None
+        if explain and phase == 'insert':
+            cur.execute('EXPLAIN ' + query)
+            plan = [row[0] for row in cur.fetchall()]
+        start = time.perf_counter()
+        cur.execute(query)
+        # DDL reports no row count
+        rows = cur.rowcount if cur.rowcount >= 0 else None
+        conn.commit()
+        results.append({'phase': phase, 'label': label, 'elapsed_s': round(time.perf_counter() - start, 4),
+                        'rows': rows, 'plan': plan})
+    return results
+
+
+def run_case(conn_string, config, data_dir, slices=None):
+    """
+    Create the tables and the time calendar of the synthetic days, COPY the
+    synthetic data and run the inserts on a fresh benchmark database, so
+    the time insert is measured as in a nightly load. With `slices`, the data
+    is staged by staging_plan.py and copied through its manifests.
+    """
+    copies = copy_table_queries
+    if slices:
+        staged = os.path.join(data_dir, 'staged')
+        log_manifest, new = plan_staging(os.path.join(data_dir, 'log_data'), os.path.join(staged, 'log_data'),
+                                         set(), slices)
+        song_manifest, new = plan_staging(os.path.join(data_dir, 'song_data'), os.path.join(staged, 'song_data'),
+                                          set(), slices)
+        copies = [staging_events_manifest_copy.format(log_manifest), staging_plays_insert,
+                  staging_songs_manifest_copy.format(song_manifest)]
+
+    labels = {query: name for name, (query, depends) in load_steps.items()}
+    labels.update({copies[0]: 'staging_events', copies[2]: 'staging_songs'})
+    statements = [('create', statement_label(query, labels), query) for query in create_table_queries]
+    first_day = START_TS // 86400000
+    statements.append(('create', 'calendar', time_calendar_build % (first_day, first_day + DAYS - 1)))
+    statements += [('copy', statement_label(query, labels), query) for query in copies]
+    statements += [('insert', statement_label(query, labels), query) for query in insert_table_queries]
+
+    conn = psycopg2.connect(conn_string)
+    cur = LocalCursor(conn.cursor(), data_locations(config, data_dir))
+    try:
+        return run_statements(cur, conn, statements)
+    finally:
+        conn.close()
+
+
+def find_regressions(report, baseline, tolerance):
+    """
+    Statements slower than `tolerance` times their baseline time, and
+    inserts whose plan shape changed, for every scale in both reports.
+    """
+    previous = {(result['scale'], statement['label']): statement
+                for result in baseline['results'] for statement in result.get('statements', [])}
+    regressions = []
+    for result in report['results']:
+        for statement in result.get('statements', []):
+            before = previous.get((result['scale'], statement['label']))
+            if before is None:
+                continue
+            if statement['elapsed_s'] > max(before['elapsed_s'] * tolerance, 0.01):
+                regressions.append({'scale': result['scale'], 'label': statement['label'], 'kind': 'time',
+                                    'baseline_s': before['elapsed_s'], 'elapsed_s': statement['elapsed_s']})
+            if statement['plan'] and before.get('plan') and plan_nodes(statement['plan']) != plan_nodes(before['plan']):
+                regressions.append({'scale': result['scale'], 'label': statement['label'], 'kind': 'plan',
+                                    'baseline_plan': before['plan'], 'plan': statement['plan']})
+    return regressions
+
+
+def run_benchmark(admin_conn_string, conn_string, config, scales, seed=0, slices=None):
+    """
+    Run the warehouse DDL, COPYs and inserts at every scale factor, each on a
+    fresh database with freshly generated data.
+
+    Returns
+    -------
+    report dict.
+    """
+    results = []
+    for scale in scales:
+        data_dir = tempfile.mkdtemp(prefix='dwh_bench_')
+        try:
+            events, songs = scale * EVENTS_PER_SCALE, scale * SONGS_PER_SCALE
+            data_bytes = write_synthetic_data(data_dir, events, songs, seed)
+            create_bench_database(admin_conn_string)
+            statements = run_case(conn_string, config, data_dir, slices)
+        finally:
+            shutil.rmtree(data_dir)
+        wall = round(sum(statement['elapsed_s'] for statement in statements), 4)
+        results.append({'scale': scale, 'events': events, 'songs': songs, 'data_bytes': data_bytes,
+                        'wall_s': wall, 'statements': statements})
+        print('scale {}: {}s'.format(scale, wall), file=sys.stderr)
+        for statement in statements:
+            rows = '-' if statement['rows'] is None else statement['rows']
+            print('  {:<8} {:<28} {:>9.4f}s {:>9} rows'.format(statement['phase'], statement['label'],
+                                                              statement['elapsed_s'], rows),
+                  file=sys.stderr)
+
+    return {
+        'started_at': datetime.utcnow().isoformat() + 'Z',
+        'options': {'seed': seed, 'slices': slices},
+        'results': results,
+    }
+
+
+def main():
+    """
+    Benchmark the project_3 warehouse SQL on a local Postgres and write a JSON report.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the warehouse SQL on a local Postgres stand-in.')
+    parser.add_argument('--admin-dsn', default=ADMIN_CONN_STRING, help='connection used to create the benchmark database')
+    parser.add_argument('--dsn', help='benchmark database connection, default admin dsn with dbname={}'.format(BENCH_DB))
+    parser.add_argument('--scale', type=int, nargs='+', default=[1],
+                        help='scale factors, {} events and {} songs each'.format(EVENTS_PER_SCALE, SONGS_PER_SCALE))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--slices', type=int, help='stage through staging_plan.py manifests for this many slices')
+    parser.add_argument('--baseline', help='earlier JSON report to compare timings and plans with')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='slowdown over the baseline reported as a regression')
+    parser.add_argument('--output', help='JSON report path, default stdout')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    conn_string = args.dsn or psycopg2.extensions.make_dsn(args.admin_dsn, dbname=BENCH_DB)
+    report = run_benchmark(args.admin_dsn, conn_string, config, args.scale, args.seed, args.slices)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = find_regressions(report, json.load(f), args.tolerance)
+        for regression in report['regressions']:
+            print('regression at scale {scale}: {label} ({kind})'.format(**regression), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import pytest
+import psycopg2
+import psycopg2.extensions
+
+
+# sql_queries formats its COPY statements from dwh.cfg in the working
+# directory when it is imported, so the tests run from a directory holding
+# a test dwh.cfg; LocalCursor maps its S3 urls to local files
+TEST_CONFIG = """
+[IAM_ROLE]
+ARN='arn:aws:iam::000000000000:role/dwhRole'
+
+[S3]
+LOG_DATA='s3://udacity-dend/log_data'
+LOG_JSONPATH='s3://udacity-dend/log_json_path.json'
+SONG_DATA='s3://udacity-dend/song_data'
+"""
+os.chdir(tempfile.mkdtemp(prefix='dwh_test_'))
+with open('dwh.cfg', 'w') as f:
+    f.write(TEST_CONFIG)
+
+# connection used to create the test database, as in benchmark.py
+ADMIN_CONN_STRING = os.environ.get('DWH_TEST_ADMIN_DSN',
+                                   "host=127.0.0.1 dbname=studentdb user=student password=student")
+TEST_DB = 'dwh_test'
+
+
+@pytest.fixture
+def conn():
+    """
+    Connection to a fresh dwh_test database on the local Postgres stand-in,
+    without tables. Tests using it are skipped when no Postgres is
+    reachable through DWH_TEST_ADMIN_DSN.
+    """
+    try:
+        admin = psycopg2.connect(ADMIN_CONN_STRING)
+    except psycopg2.OperationalError as e:
+        pytest.skip('no test database: {}'.format(str(e).strip()))
+    admin.set_session(autocommit=True)
+    admin.cursor().execute("DROP DATABASE IF EXISTS {}".format(TEST_DB))
+    admin.cursor().execute("CREATE DATABASE {} WITH ENCODING 'utf8' TEMPLATE template0".format(TEST_DB))
+
+    conn = psycopg2.connect(psycopg2.extensions.make_dsn(ADMIN_CONN_STRING, dbname=TEST_DB))
+    yield conn
+    conn.close()
+    admin.cursor().execute("DROP DATABASE IF EXISTS {}".format(TEST_DB))
+    admin.close()
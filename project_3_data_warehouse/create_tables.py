@@ -1,6 +1,9 @@
+import argparse
+import datetime
 import configparser
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, time_calendar_build
+from telemetry import RunReport
 
 
 def drop_tables(cur, conn):
@@ -15,18 +18,49 @@ def create_tables(cur, conn):
         conn.commit()
 
 
+def build_calendar(cur, conn, first_date, last_date):
+    """
+    Fill time with every hour of the days from `first_date` to `last_date`,
+    both included. Days already in time, or outside [CALENDAR] of dwh.cfg,
+    are skipped.
+    """
+    epoch = datetime.date(1970, 1, 1)
+    cur.execute(time_calendar_build, ((first_date - epoch).days, (last_date - epoch).days))
+    conn.commit()
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Create the sparkify warehouse tables.')
+    parser.add_argument('--calendar-start', type=parse_date, help='first day of the time calendar, YYYY-MM-DD')
+    parser.add_argument('--calendar-end', type=parse_date, help='last day of the time calendar, YYYY-MM-DD')
+    parser.add_argument('--report', default='create_tables_report.json', help='JSON run report path')
+    args = parser.parse_args()
+    if (args.calendar_start is None) != (args.calendar_end is None):
+        parser.error('--calendar-start and --calendar-end go together')
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
+    report = RunReport('create_tables', args.report)
+    try:
+        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+        cur = report.cursor(conn.cursor())
 
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
+        drop_tables(cur, conn)
+        create_tables(cur, conn)
+        if args.calendar_start:
+            build_calendar(cur, conn, args.calendar_start, args.calendar_end)
 
-    conn.close()
+        conn.close()
+    except Exception as e:
+        report.write('failed', str(e).strip())
+        raise
+    report.write()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,12 +1,25 @@
+import time
+import argparse
 import configparser
 import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+import psycopg2.pool
+import psycopg2.extras
+from sql_queries import copy_table_queries, insert_table_queries, truncate_staging_queries, delta_table_queries, \
+    load_steps, staged_objects_table_create, staged_objects_select, staged_objects_insert, slice_count_select, \
+    staging_events_manifest_copy, staging_songs_manifest_copy, staging_plays_insert
+from scheduler import run_graph, run_step
+from staging_plan import plan_staging
+from telemetry import RunReport, rollback
 
 
 def load_staging_tables(cur, conn):
-    for query in copy_table_queries:
-        cur.execute(query)
-        conn.commit()
+    try:
+        for query in copy_table_queries:
+            cur.execute(query)
+            conn.commit()
+    except Exception:
+        rollback(conn, cur)
+        raise
 
 
 def insert_tables(cur, conn):
@@ -15,17 +28,140 @@ def insert_tables(cur, conn):
         conn.commit()
 
 
+def load_delta(cur, conn, queries=delta_table_queries, staged_urls=()):
+    """
+    Load the staged events newer than the watermark, and merge the staged
+    users, songs and artists, in one transaction.
+    `staged_urls` are recorded in staged_objects in the same transaction,
+    so source objects are marked staged only once they are loaded.
+    """
+    try:
+        for query in queries:
+            cur.execute(query)
+        psycopg2.extras.execute_values(cur, staged_objects_insert, [(url,) for url in staged_urls], page_size=1000)
+    except Exception:
+        rollback(conn, cur)
+        raise
+    conn.commit()
+
+
+def load_incremental(cur, conn):
+    """
+    Replace the staging tables with a new COPY, then load the delta.
+    """
+    for query in truncate_staging_queries:
+        cur.execute(query)
+        conn.commit()
+    load_staging_tables(cur, conn)
+    load_delta(cur, conn)
+
+
+def plan_staging_copies(cur, conn, config, client=None):
+    """
+    Stage the log and song objects not staged yet as manifests of parts,
+    as many as a multiple of the slice count.
+
+    Parameters
+    ---------
+    cur: cursor.
+    conn: connection.
+    config: dwh.cfg ConfigParser, with the STAGING prefix in [S3].
+    client: boto3 S3 client, optional.
+
+    Returns
+    -------
+    manifest COPY and staging_plays queries, and new source urls.
+    """
+    cur.execute(staged_objects_table_create)
+    conn.commit()
+    cur.execute(staged_objects_select)
+    staged_keys = {row[0] for row in cur.fetchall()}
+    cur.execute(slice_count_select)
+    slices = cur.fetchone()[0]
+
+    # one prefix per run, so parts of an earlier run are never overwritten
+    output = '{}/{{}}/{}'.format(config['S3']['STAGING'].strip("'").rstrip('/'), time.strftime('%Y%m%dT%H%M%S'))
+    queries = []
+    staged_urls = []
+    for name, copy, keyed in [('LOG_DATA', staging_events_manifest_copy, [staging_plays_insert]),
+                              ('SONG_DATA', staging_songs_manifest_copy, [])]:
+        manifest, new = plan_staging(config['S3'][name], output.format(name.lower()), staged_keys, slices, client)
+        if manifest is not None:
+            queries += [copy.format(manifest)] + keyed
+            staged_urls += new
+    return queries, staged_urls
+
+
+def load_planned(cur, conn, config, client=None):
+    """
+    Replace the staging tables with only the source objects not staged yet,
+    then load the delta. Does nothing when there is no new object.
+    """
+    queries, staged_urls = plan_staging_copies(cur, conn, config, client)
+    if not queries:
+        print('no new objects to stage')
+        return
+    try:
+        for query in truncate_staging_queries + queries:
+            cur.execute(query)
+            conn.commit()
+    except Exception:
+        rollback(conn, cur)
+        raise
+    load_delta(cur, conn, staged_urls=staged_urls)
+    print('{} new objects staged'.format(len(staged_urls)))
+
+
+def load_graph(dsn, parallelism=4, report=None):
+    """
+    Run the COPY and insert steps of `load_steps` on a pool of connections,
+    each as soon as the steps it depends on have committed. Steps are
+    recorded in `report` under their names.
+    """
+    pool = psycopg2.pool.ThreadedConnectionPool(1, parallelism, dsn)
+    try:
+        timings = run_graph(pool, load_steps, parallelism,
+                            run=lambda pool, name, query: run_step(pool, name, query, report))
+    finally:
+        pool.closeall()
+    for name, (start, end) in sorted(timings.items(), key=lambda item: item[1]):
+        print('{:<16} {:8.2f}s - {:8.2f}s'.format(name, start, end))
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Load the sparkify warehouse from S3.')
+    parser.add_argument('--parallelism', type=int, default=4, help='statements running at once, 0 to run serially')
+    parser.add_argument('--incremental', action='store_true',
+                        help='load only events after the watermark and merge dimensions, in one transaction')
+    parser.add_argument('--plan-staging', action='store_true',
+                        help='incremental load staging only source objects not staged yet, through a COPY manifest')
+    parser.add_argument('--report', default='etl_report.json', help='JSON run report path')
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
-    
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
-
-    conn.close()
+    dsn = "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
+    report = RunReport('etl', args.report)
+    try:
+        if args.parallelism and not (args.plan_staging or args.incremental):
+            load_graph(dsn, args.parallelism, report)
+        else:
+            conn = psycopg2.connect(dsn)
+            cur = report.cursor(conn.cursor())
+            if args.plan_staging:
+                load_planned(cur, conn, config)
+            elif args.incremental:
+                load_incremental(cur, conn)
+            else:
+                load_staging_tables(cur, conn)
+                insert_tables(cur, conn)
+            conn.close()
+    except Exception as e:
+        report.write('failed', str(e).strip())
+        raise
+    summary = report.write()
+    print('{:.2f}s, slowest: {}; report in {}'.format(summary['wall_s'], ', '.join(summary['slowest']), args.report))
 
 
 if __name__ == "__main__":
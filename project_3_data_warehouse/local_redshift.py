@@ -0,0 +1,239 @@
+import os
+import re
+import json
+
+
+# Redshift physical design clauses with no Postgres counterpart
+PHYSICAL_CLAUSES = [
+    r'\s*DISTSTYLE\s+\w+',
+    r'\s*(COMPOUND\s+|INTERLEAVED\s+)?SORTKEY\s*\([\w\s,]*\)',
+    r'\s*DISTKEY\s*\(\s*\w+\s*\)',
+    # column attributes, e.g. "match_key VARCHAR(32) DISTKEY SORTKEY"
+    r'\s+(DISTKEY|SORTKEY)\b',
+    r'\s+ENCODE\s+\w+',
+    # Redshift does not enforce primary keys
+    r',\s*PRIMARY KEY\s*\([\w\s,]*\)',
+]
+
+EPOCH_ALIAS = re.compile(r"(TIMESTAMP 'epoch' \+ [\w.]+ / 1000 \* INTERVAL '1 second') as (\w+)", re.IGNORECASE)
+COPY_STATEMENT = re.compile(r"^\s*COPY\s+(\w+)\s*(?:\(([^)]*)\))?\s+FROM\s+'([^']+)'(.*?);?\s*$",
+                            re.IGNORECASE | re.DOTALL)
+JSON_FORMAT = re.compile(r"FORMAT\s+AS\s+json\s+'([^']+)'", re.IGNORECASE)
+JSONPATH_KEY = re.compile(r"^\$(?:\['([^']+)'\]|\.(\w+))$")
+
+
+def translate(query):
+    """
+    Rewrite a Redshift statement for Postgres.
+    - IDENTITY (seed, step) becomes a Postgres identity column.
+    - DISTSTYLE, DISTKEY, SORTKEY and ENCODE are dropped, and so are
+      PRIMARY KEY constraints, which Redshift does not enforce.
+    - GETDATE() becomes LOCALTIMESTAMP(0); EXTRACT(WEEKDAY ...) and
+      EXTRACT(WEEKS ...) become DOW and WEEK.
+    - SET query_group becomes SET application_name.
+    - A select list reusing the alias of the epoch idiom
+      `TIMESTAMP 'epoch' + ts / 1000 * INTERVAL '1 second' as start_time`
+      in later columns, which Redshift allows and Postgres does not, gets
+      the expression inlined in those columns.
+    COPY is not translated; LocalCursor runs it.
+    """
+    query = re.sub(r'IDENTITY\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)',
+                   r'GENERATED BY DEFAULT AS IDENTITY (START WITH \1 INCREMENT BY \2)', query, flags=re.IGNORECASE)
+    for clause in PHYSICAL_CLAUSES:
+        query = re.sub(clause, '', query, flags=re.IGNORECASE)
+    query = re.sub(r'GETDATE\(\)', 'LOCALTIMESTAMP(0)', query, flags=re.IGNORECASE)
+    query = re.sub(r'EXTRACT\(\s*WEEKDAY\b', 'EXTRACT(DOW', query, flags=re.IGNORECASE)
+    query = re.sub(r'EXTRACT\(\s*WEEKS\b', 'EXTRACT(WEEK', query, flags=re.IGNORECASE)
+    query = re.sub(r'^(\s*(?:SET|RESET)\s+)query_group\b', r'\1application_name', query, flags=re.IGNORECASE)
+
+    for match in reversed(list(EPOCH_ALIAS.finditer(query))):
+        expression, alias = match.groups()
+        # the rest of the select list ends at its FROM clause
+        end = re.compile(r'^FROM\b', re.IGNORECASE | re.MULTILINE).search(query, match.end())
+        end = end.start() if end else len(query)
+        columns = re.sub(r'\bFROM {}\)'.format(alias), 'FROM ({}))'.format(expression),
+                         query[match.end():end], flags=re.IGNORECASE)
+        query = query[:match.end()] + columns + query[end:]
+    return query
+
+
+def iter_json_records(data):
+    """
+    JSON objects of a file holding one or more documents, one per line or
+    concatenated, as Redshift COPY reads them.
+    """
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        while position < len(data) and data[position].isspace():
+            position += 1
+        if position == len(data):
+            return
+        record, position = decoder.raw_decode(data, position)
+        yield record
+
+
+def copy_value(value, data_type):
+    """
+    Postgres COPY text of a JSON value for a column of `data_type`.
+    Empty strings load as NULL outside of text columns, as in a Redshift
+    JSON COPY; nested values load as JSON text.
+    """
+    if value is None or (value == '' and data_type not in ('character varying', 'character', 'text')):
+        return '\\N'
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class LocalCursor:
+    """
+    Postgres cursor running Redshift statements: every statement goes through
+    `translate`, and COPY ... FROM 's3://...' FORMAT AS json reads local
+    files instead of S3.
+    - `locations` maps url prefixes (s3 urls of dwh.cfg) to local paths;
+      other urls are local paths already.
+    - JSON is matched to columns with 'auto', 'auto ignorecase' or a
+      jsonpaths file of `$['key']` / `$.key` paths.
+    - MANIFEST reads the entries of a staging_plan.py manifest.
+    - The loaded table is analyzed, as Redshift COPY updates statistics.
+    Other attributes are those of the wrapped cursor.
+    """
+
+    def __init__(self, cursor, locations=None):
+        self.cursor = cursor
+        self.locations = dict(locations or {})
+        self.copied_rows = None
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    @property
+    def rowcount(self):
+        if self.copied_rows is not None:
+            return self.copied_rows
+        return self.cursor.rowcount
+
+    def execute(self, query, args=None):
+        self.copied_rows = None
+        if isinstance(query, str):
+            match = COPY_STATEMENT.match(query)
+            if match:
+                return self.copy(*match.groups())
+            query = translate(query)
+        return self.cursor.execute(query, args)
+
+    def resolve(self, url):
+        """
+        Local path of a url, through the longest matching prefix of `locations`.
+        """
+        for prefix in sorted(self.locations, key=len, reverse=True):
+            if url.startswith(prefix):
+                return self.locations[prefix] + url[len(prefix):]
+        return url
+
+    def source_files(self, url, manifest):
+        if manifest:
+            with open(self.resolve(url)) as f:
+                return [self.resolve(entry['url']) for entry in json.load(f)['entries']]
+        path = self.resolve(url)
+        if os.path.isfile(path):
+            return [path]
+        # an S3 prefix matches every key starting with it
+        directory, start = os.path.split(path)
+        files = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                if os.path.relpath(file_path, directory).startswith(start):
+                    files.append(file_path)
+        return sorted(files)
+
+    def columns(self, table, names=None):
+        """
+        (name, data type) of the columns COPY loads: `names` in their order,
+        or every column but identity columns.
+        """
+        self.cursor.execute("""
+            SELECT column_name, data_type, column_default, is_identity
+            FROM information_schema.columns
+            WHERE table_name = %s AND table_schema = current_schema()
+            ORDER BY ordinal_position
+        """, (table,))
+        rows = self.cursor.fetchall()
+        if names:
+            types = {name: data_type for name, data_type, default, identity in rows}
+            return [(name, types[name]) for name in (name.strip().lower() for name in names.split(','))]
+        # COPY skips identity columns, as in Redshift
+        return [(name, data_type) for name, data_type, default, identity in rows
+                if identity != 'YES' and not (default or '').startswith('nextval(')]
+
+    def extractor(self, json_format, columns):
+        """
+        Function of a JSON record returning its values in column order.
+        """
+        if json_format.lower() in ('auto', 'auto ignorecase'):
+            ignorecase = json_format.lower() == 'auto ignorecase'
+
+            def extract(record):
+                if ignorecase:
+                    record = {key.lower(): value for key, value in record.items()}
+                return [record.get(name) for name, data_type in columns]
+            return extract
+
+        with open(self.resolve(json_format)) as f:
+            paths = json.load(f)['jsonpaths']
+        if len(paths) != len(columns):
+            raise ValueError('{} jsonpaths for {} columns'.format(len(paths), len(columns)))
+        keys = []
+        for path in paths:
+            match = JSONPATH_KEY.match(path)
+            if match is None:
+                raise ValueError('unsupported jsonpath {}'.format(path))
+            keys.append(match.group(1) or match.group(2))
+        return lambda record: [record.get(key) for key in keys]
+
+    def copy(self, table, names, url, options):
+        json_format = JSON_FORMAT.search(options)
+        if json_format is None:
+            raise ValueError('only FORMAT AS json COPY is supported: {}'.format(options.strip()))
+        manifest = re.search(r'\bMANIFEST\b', options, re.IGNORECASE) is not None
+        columns = self.columns(table, names)
+        extract = self.extractor(json_format.group(1), columns)
+
+        def lines():
+            for path in self.source_files(url, manifest):
+                with open(path, encoding='utf8') as f:
+                    for record in iter_json_records(f.read()):
+                        values = extract(record)
+                        yield '\t'.join(copy_value(value, data_type)
+                                        for value, (name, data_type) in zip(values, columns))
+
+        reader = LineReader(lines())
+        self.cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(table, ', '.join(name for name, t in columns)),
+                                reader)
+        self.cursor.execute('ANALYZE {}'.format(table))
+        self.copied_rows = reader.lines_read
+
+
+class LineReader:
+    """
+    File-like object streaming COPY text lines to copy_expert.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.lines_read = 0
+
+    def read(self, size=-1):
+        chunk = []
+        length = 0
+        for line in self.lines:
+            chunk.append(line + '\n')
+            length += len(line) + 1
+            self.lines_read += 1
+            if 0 < size <= length:
+                break
+        return ''.join(chunk)
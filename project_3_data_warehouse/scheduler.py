@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def check_graph(steps):
+    """
+    Check that every dependency is a declared step and that there is no cycle.
+
+    Parameters
+    ---------
+    steps: dict of step name to (query, names of the steps it depends on).
+
+    Returns
+    -------
+    step names in a dependency order.
+    """
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if name not in steps:
+            raise ValueError('{} depends on unknown step {}'.format(path[-1], name))
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('dependency cycle: {}'.format(' -> '.join(path + [name])))
+        state[name] = 'visiting'
+        for dependency in steps[name][1]:
+            visit(dependency, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in steps:
+        visit(name, [])
+    return order
+
+
+def run_step(pool, name, query, report=None):
+    """
+    Run one statement on a pooled connection and commit it, recorded under
+    the step name when a telemetry.RunReport is given.
+
+    Returns
+    -------
+    (start, end) in seconds of time.perf_counter.
+    """
+    conn = pool.getconn()
+    try:
+        start = time.perf_counter()
+        cur = conn.cursor()
+        if report is not None:
+            cur = report.cursor(cur, name)
+        try:
+            cur.execute(query)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if report is not None:
+                # stl_load_errors of a failed COPY, read after the rollback
+                cur.record_load_errors()
+            raise
+        return start, time.perf_counter()
+    finally:
+        pool.putconn(conn)
+
+
+def run_graph(pool, steps, parallelism=4, run=run_step):
+    """
+    Run statements on a pool of connections as soon as the steps they depend
+    on have committed, with at most `parallelism` running at once. Ready
+    steps start in declaration order. When a step fails, no new step starts;
+    running steps finish and the error is raised.
+
+    Parameters
+    ---------
+    pool: psycopg2 connection pool with at least `parallelism` connections.
+    steps: dict of step name to (query, names of the steps it depends on).
+    parallelism: maximum statements running at once.
+    run: function(pool, name, query) running one step, returning (start, end).
+
+    Returns
+    -------
+    dict of step name to (start, end) in seconds, relative to the start of the graph.
+    """
+    check_graph(steps)
+    remaining = dict(steps)
+    done = {}
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        running = {}
+        error = None
+        while remaining or running:
+            if error is None:
+                ready = [name for name, (query, depends) in remaining.items()
+                         if all(dependency in done for dependency in depends)]
+                # steps wait here rather than in the executor's queue, so none starts after a failure
+                for name in ready[:parallelism - len(running)]:
+                    query = remaining.pop(name)[0]
+                    running[executor.submit(run, pool, name, query)] = name
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    start, end = future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+                    continue
+                done[name] = (start - started, end - started)
+        if error is not None:
+            raise error
+
+    return done
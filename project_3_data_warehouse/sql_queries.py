@@ -1,3 +1,4 @@
+import datetime
 import configparser
 
 
@@ -14,6 +15,10 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+load_watermark_table_drop = "DROP TABLE IF EXISTS load_watermark"
+staged_objects_table_drop = "DROP TABLE IF EXISTS staged_objects"
+staging_plays_table_drop = "DROP TABLE IF EXISTS staging_plays"
+song_keys_table_drop = "DROP TABLE IF EXISTS song_keys"
 
 # CREATE TABLES
 
@@ -38,7 +43,8 @@ CREATE TABLE IF NOT EXISTS staging_events
     ts BIGINT,
     userAgent VARCHAR,
     userId INTEGER
-)    
+)
+DISTSTYLE EVEN;
 """)
 
 staging_songs_table_create = ("""
@@ -55,6 +61,7 @@ CREATE TABLE IF NOT EXISTS staging_songs
     duration FLOAT,
     year INTEGER
 )
+DISTSTYLE EVEN;
 """)
 
 songplay_table_create = ("""
@@ -130,7 +137,55 @@ DISTKEY (start_time)
 SORTKEY (start_time);
 """)
 
+load_watermark_table_create = ("""
+CREATE TABLE IF NOT EXISTS load_watermark
+(
+    name VARCHAR(64),
+    ts BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT GETDATE(),
+    PRIMARY KEY (name)
+);
+""")
+
+staged_objects_table_create = ("""
+CREATE TABLE IF NOT EXISTS staged_objects
+(
+    url VARCHAR(1024),
+    staged_at TIMESTAMP DEFAULT GETDATE(),
+    PRIMARY KEY (url)
+);
+""")
+
+# NextSong events of staging_events with their song match key
+staging_plays_table_create = ("""
+CREATE TABLE IF NOT EXISTS staging_plays
+(
+    match_key VARCHAR(32),
+    ts BIGINT,
+    userId INTEGER,
+    level VARCHAR,
+    sessionId INTEGER,
+    location VARCHAR,
+    userAgent VARCHAR
+)
+DISTKEY (match_key)
+SORTKEY (match_key);
+""")
+
+# match key of every loaded song, kept in step with songs
+song_keys_table_create = ("""
+CREATE TABLE IF NOT EXISTS song_keys
+(
+    match_key VARCHAR(32),
+    song_id VARCHAR,
+    artist_id VARCHAR
+)
+DISTKEY (match_key)
+SORTKEY (match_key);
+""")
+
 # STAGING TABLES
+# The staging tables are DISTSTYLE EVEN, so every slice loads its share of a COPY.
 
 staging_events_copy = ("""
 COPY staging_events
@@ -146,23 +201,77 @@ iam_role {}
 FORMAT AS json 'auto';
 """).format(config['S3']['SONG_DATA'], config['IAM_ROLE']['ARN'])
 
+# MATCH KEYS
+# A song play matches a song on case-folded title and artist and the duration
+# rounded to seconds. The hash of these is computed once, while copying the
+# NextSong events into staging_plays and the songs into song_keys. Both are
+# distributed and sorted on it, so songplays are built with a co-located
+# single-column join.
+
+staging_plays_insert = ("""
+INSERT INTO staging_plays
+SELECT
+    MD5(LOWER(song) || '|' || LOWER(artist) || '|' || CAST(ROUND(length) AS BIGINT)),
+    ts,
+    userId,
+    level,
+    sessionId,
+    location,
+    userAgent
+FROM staging_events
+WHERE page = 'NextSong';
+""")
+
+song_keys_insert = ("""
+INSERT INTO song_keys
+SELECT DISTINCT
+    MD5(LOWER(title) || '|' || LOWER(artist_name) || '|' || CAST(ROUND(duration) AS BIGINT)),
+    song_id,
+    artist_id
+FROM staging_songs
+WHERE song_id IS NOT NULL;
+""")
+
+# PLANNED STAGING
+# staging_plan.py writes the new source objects as parts listed in a
+# manifest; the manifest url fills the remaining {}.
+
+staged_objects_select = "SELECT url FROM staged_objects;"
+staged_objects_insert = "INSERT INTO staged_objects (url) VALUES %s;"
+slice_count_select = "SELECT COUNT(*) FROM stv_slices;"
+
+staging_events_manifest_copy = ("""
+COPY staging_events
+FROM '{{}}'
+iam_role {}
+FORMAT AS json {}
+MANIFEST;
+""").format(config['IAM_ROLE']['ARN'], config['S3']['LOG_JSONPATH'])
+
+staging_songs_manifest_copy = ("""
+COPY staging_songs
+FROM '{{}}'
+iam_role {}
+FORMAT AS json 'auto'
+MANIFEST;
+""").format(config['IAM_ROLE']['ARN'])
+
 # FINAL TABLES
 # https://stackoverflow.com/questions/39815425/how-to-convert-epoch-to-datetime-redshift
 songplay_table_insert = ("""
 INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
 SELECT DISTINCT
-    TIMESTAMP 'epoch' + se.ts / 1000 * INTERVAL '1 second' as start_time,
-    se.userId,
-    se.level,
-    ss.song_id,
-    ss.artist_id,
-    se.sessionId,
-    se.location,
-    se.userAgent
-FROM staging_songs ss
-INNER JOIN staging_events se
-ON (ss.title = se.song AND ss.artist_name = se.artist)
-AND se.page = 'NextSong';
+    TIMESTAMP 'epoch' + sp.ts / 1000 * INTERVAL '1 second' as start_time,
+    sp.userId,
+    sp.level,
+    sk.song_id,
+    sk.artist_id,
+    sp.sessionId,
+    sp.location,
+    sp.userAgent
+FROM song_keys sk
+INNER JOIN staging_plays sp
+ON sk.match_key = sp.match_key;
 """)
 
 user_table_insert = ("""
@@ -202,22 +311,218 @@ FROM staging_songs
 WHERE artist_id IS NOT NULL;
 """)
 
-time_table_insert = ("""
+# CALENDAR
+# time is a calendar holding every hour of a range of whole days; start_time
+# is the start of the hour, so songplays join it on
+# DATE_TRUNC('hour', songplays.start_time). Days are numbered from 1970-01-01.
+# A bounds query gives the first_day and last_day wanted; the range is
+# extended to cover them, within the days allowed by [CALENDAR] in dwh.cfg,
+# and days already in the range are not generated again, so the calendar
+# stays contiguous. Bounds of NULL, as of no staged event, add nothing.
+
+def calendar_day(name, default):
+    """
+    Day number of a [CALENDAR] date of dwh.cfg, YYYY-MM-DD.
+    """
+    value = config.get('CALENDAR', name, fallback=default)
+    return (datetime.date.fromisoformat(value.strip("'")) - datetime.date(1970, 1, 1)).days
+
+
+calendar_first_day = calendar_day('FIRST_DAY', '2000-01-01')
+calendar_last_day = calendar_day('LAST_DAY', '2099-12-31')
+
+time_calendar_insert = ("""
 INSERT INTO time
+WITH digits AS (
+    SELECT 0 AS n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+    UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9
+),
+numbers AS (
+    SELECT d0.n + 10 * d1.n + 100 * d2.n + 1000 * d3.n + 10000 * d4.n AS n
+    FROM digits d0, digits d1, digits d2, digits d3, digits d4
+),
+built AS (
+    SELECT
+        CAST(EXTRACT(EPOCH FROM MIN(start_time)) AS BIGINT) / 86400 AS first_day,
+        CAST(EXTRACT(EPOCH FROM MAX(start_time)) AS BIGINT) / 86400 AS last_day
+    FROM time
+),
+extended AS (
+    SELECT
+        GREATEST(LEAST(wanted.first_day, COALESCE(built.first_day, wanted.first_day)), {first_day}) AS first_day,
+        LEAST(GREATEST(wanted.last_day, COALESCE(built.last_day, wanted.last_day)), {last_day}) AS last_day
+    FROM ({{}}) wanted
+    CROSS JOIN built
+    WHERE wanted.first_day IS NOT NULL
+),
+new_days AS (
+    SELECT extended.first_day + numbers.n AS day
+    FROM extended
+    CROSS JOIN numbers
+    CROSS JOIN built
+    WHERE extended.first_day + numbers.n <= extended.last_day
+    AND (built.first_day IS NULL OR extended.first_day + numbers.n NOT BETWEEN built.first_day AND built.last_day)
+)
+SELECT
+    calendar.start_time,
+    EXTRACT(HOUR FROM calendar.start_time) AS hour,
+    EXTRACT(DAY FROM calendar.start_time) AS day,
+    EXTRACT(WEEKS FROM calendar.start_time) AS week,
+    EXTRACT(MONTH FROM calendar.start_time) AS month,
+    EXTRACT(YEAR FROM calendar.start_time) AS year,
+    EXTRACT(WEEKDAY FROM calendar.start_time) AS weekday
+FROM (
+    SELECT TIMESTAMP 'epoch' + (new_days.day * 24 + numbers.n) * INTERVAL '1 hour' AS start_time
+    FROM new_days
+    CROSS JOIN numbers
+    WHERE numbers.n < 24
+) calendar;
+""").format(first_day=calendar_first_day, last_day=calendar_last_day)
+
+# builds the calendar for a range of day numbers, first and last included
+time_calendar_build = time_calendar_insert.format(
+    "SELECT CAST(%s AS BIGINT) AS first_day, CAST(%s AS BIGINT) AS last_day")
+
+# extends the calendar to the days of the staged events; only ts is read,
+# without a DISTINCT over the events. Events outside the allowed days, such
+# as a ts of 0, are left out, so they cannot stretch the calendar.
+time_table_insert = time_calendar_insert.format("""
+    SELECT MIN(ts) / 86400000 AS first_day, MAX(ts) / 86400000 AS last_day
+    FROM staging_events
+    WHERE ts >= {} AND ts < {}""".format(calendar_first_day * 86400000, (calendar_last_day + 1) * 86400000))
+
+# INCREMENTAL LOAD
+# Only events after the staging_events.ts high-watermark are loaded. users,
+# songs and artists are merged by deleting the rows being replaced and
+# inserting the staged ones. Run all delta queries in one transaction.
+
+staging_events_truncate = "TRUNCATE staging_events;"
+staging_songs_truncate = "TRUNCATE staging_songs;"
+staging_plays_truncate = "TRUNCATE staging_plays;"
+
+# starts after the last second of songplays, so a warehouse loaded in full is
+# not loaded twice; time is a calendar of whole days, not a record of events
+load_watermark_init = ("""
+INSERT INTO load_watermark (name, ts)
+SELECT 'staging_events', last_time.ts
+FROM (
+    SELECT COALESCE(CAST(EXTRACT(EPOCH FROM MAX(start_time)) AS BIGINT) * 1000 + 999, 0) AS ts
+    FROM songplays
+) last_time
+WHERE NOT EXISTS (SELECT 1 FROM load_watermark WHERE name = 'staging_events');
+""")
+
+songplay_table_delta = ("""
+INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
 SELECT DISTINCT
-    TIMESTAMP 'epoch' + ts / 1000 * INTERVAL '1 second' as start_time,
-    EXTRACT(HOUR FROM start_time) AS hour,
-    EXTRACT(DAY FROM start_time) AS day,
-    EXTRACT(WEEKS FROM start_time) AS week,
-    EXTRACT(MONTH FROM start_time) AS month,
-    EXTRACT(YEAR FROM start_time) AS year,
-    EXTRACT(WEEKDAY FROM start_time) AS weekday
-FROM staging_events;
+    TIMESTAMP 'epoch' + sp.ts / 1000 * INTERVAL '1 second' as start_time,
+    sp.userId,
+    sp.level,
+    sk.song_id,
+    sk.artist_id,
+    sp.sessionId,
+    sp.location,
+    sp.userAgent
+FROM song_keys sk
+INNER JOIN staging_plays sp
+ON sk.match_key = sp.match_key
+WHERE sp.ts > (SELECT ts FROM load_watermark WHERE name = 'staging_events');
+""")
+
+# users keep the level of their latest new event
+user_table_delta_delete = ("""
+DELETE FROM users
+USING staging_events se
+WHERE users.user_id = se.userId
+AND se.page = 'NextSong'
+AND se.ts > (SELECT ts FROM load_watermark WHERE name = 'staging_events');
+""")
+
+user_table_delta_insert = ("""
+INSERT INTO users
+SELECT userId, firstName, lastName, gender, level
+FROM (
+    SELECT userId, firstName, lastName, gender, level,
+        ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) AS event_rank
+    FROM staging_events
+    WHERE userId IS NOT NULL
+    AND page = 'NextSong'
+    AND ts > (SELECT ts FROM load_watermark WHERE name = 'staging_events')
+) latest
+WHERE event_rank = 1;
+""")
+
+song_table_delta_delete = ("""
+DELETE FROM songs
+USING staging_songs ss
+WHERE songs.song_id = ss.song_id;
+""")
+
+artist_table_delta_delete = ("""
+DELETE FROM artists
+USING staging_songs ss
+WHERE artists.artist_id = ss.artist_id;
+""")
+
+song_keys_delta_delete = ("""
+DELETE FROM song_keys
+USING staging_songs ss
+WHERE song_keys.song_id = ss.song_id;
+""")
+
+# songs, artists and song_keys are re-inserted with song_table_insert,
+# artist_table_insert and song_keys_insert
+
+load_watermark_update = ("""
+UPDATE load_watermark
+SET ts = GREATEST(ts, COALESCE((SELECT MAX(ts) FROM staging_events), 0)),
+    updated_at = GETDATE()
+WHERE name = 'staging_events';
+""")
+
+# LOAD DIAGNOSTICS
+# statements are tagged with a query_group label, which STL_QUERY records
+
+query_group_set = "SET query_group TO %s;"
+last_copy_count_select = "SELECT pg_last_copy_count();"
+
+load_errors_select = ("""
+SELECT query, TRIM(filename), line_number, TRIM(colname), TRIM(type), TRIM(raw_field_value), err_code, TRIM(err_reason)
+FROM stl_load_errors
+WHERE query = pg_last_copy_id()
+ORDER BY line_number
+LIMIT %s;
 """)
 
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
-copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, load_watermark_table_create, staged_objects_table_create, staging_plays_table_create, song_keys_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, load_watermark_table_drop, staged_objects_table_drop, staging_plays_table_drop, song_keys_table_drop]
+copy_table_queries = [staging_events_copy, staging_plays_insert, staging_songs_copy]
+insert_table_queries = [song_keys_insert, songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+truncate_staging_queries = [staging_events_truncate, staging_songs_truncate, staging_plays_truncate]
+# song_keys is merged before songplays are matched against it; with planned
+# staging, staging_songs holds only the new songs, so songplays match the
+# merged song_keys rather than the staged songs. The watermark is read by
+# every delta query, so it moves last.
+delta_table_queries = [load_watermark_table_create, load_watermark_init,
+                       song_keys_delta_delete, song_keys_insert,
+                       songplay_table_delta, time_table_insert,
+                       user_table_delta_delete, user_table_delta_insert,
+                       song_table_delta_delete, song_table_insert,
+                       artist_table_delta_delete, artist_table_insert,
+                       load_watermark_update]
+
+# LOAD GRAPH
+# step name: (query, steps that must commit before it starts)
+load_steps = {
+    'staging_events': (staging_events_copy, []),
+    'staging_songs': (staging_songs_copy, []),
+    'staging_plays': (staging_plays_insert, ['staging_events']),
+    'song_keys': (song_keys_insert, ['staging_songs']),
+    'users': (user_table_insert, ['staging_events']),
+    'time': (time_table_insert, ['staging_events']),
+    'songs': (song_table_insert, ['staging_songs']),
+    'artists': (artist_table_insert, ['staging_songs']),
+    'songplays': (songplay_table_insert, ['staging_plays', 'song_keys']),
+}
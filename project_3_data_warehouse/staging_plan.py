@@ -0,0 +1,182 @@
+import os
+import json
+import argparse
+
+
+class LocalStore:
+    """
+    Local directory standing in for an S3 bucket; keys are paths relative to `root`.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def list(self, prefix):
+        """
+        (key, size) of every object under a prefix, sorted by key.
+        """
+        objects = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.root, prefix)):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                objects.append((key, os.path.getsize(path)))
+        return sorted(objects)
+
+    def read(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def url(self, key):
+        return os.path.join(self.root, key)
+
+
+class S3Store:
+    """
+    S3 bucket accessed with boto3.
+    """
+
+    def __init__(self, bucket, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+        self.bucket = bucket
+        self.client = client
+
+    def list(self, prefix):
+        objects = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                objects.append((item['Key'], item['Size']))
+        return sorted(objects)
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def url(self, key):
+        return 's3://{}/{}'.format(self.bucket, key)
+
+
+def open_location(location, client=None):
+    """
+    Store and key prefix of an 's3://bucket/prefix' url or a local directory.
+    """
+    location = location.strip("'")
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3Store(bucket, client), prefix
+    return LocalStore(location), ''
+
+
+def iter_records(data):
+    """
+    JSON records of an object: each line of a JSON-lines object, or the
+    whole object, compacted to one line, when it is a single JSON document.
+    """
+    lines = [line for line in data.splitlines() if line.strip()]
+    if not lines:
+        return
+    try:
+        json.loads(lines[0])
+    except ValueError:
+        yield json.dumps(json.loads(data)).encode('utf8')
+        return
+    yield from lines
+
+
+def part_count(total_bytes, slices, max_part_bytes):
+    """
+    Smallest multiple of `slices` keeping parts under `max_part_bytes`.
+    """
+    return slices * max(1, -(-total_bytes // (slices * max_part_bytes)))
+
+
+def plan_staging(source, output, staged_keys, slices, client=None, max_part_bytes=64 * 1024 * 1024):
+    """
+    Stage only the source objects that are not staged yet.
+    - List the source and drop keys in `staged_keys`.
+    - Split the records of the new JSON objects into parts of similar size,
+      as many as a multiple of the slice count, so every slice loads the same
+      share of the COPY. There are fewer parts only when there are fewer records.
+    - Write a COPY manifest listing the parts.
+    One part is held in memory at a time.
+
+    Parameters
+    ---------
+    source: 's3://bucket/prefix' or local directory of JSON files.
+    output: 's3://bucket/prefix' or local directory receiving parts and manifest.
+    staged_keys: set of source urls already staged.
+    slices: slice count of the cluster.
+    client: boto3 S3 client, optional.
+    max_part_bytes: target maximum part size.
+
+    Returns
+    -------
+    (manifest url, list of new source urls), manifest url None when there is nothing new.
+    """
+    source_store, source_prefix = open_location(source, client)
+    output_store, output_prefix = open_location(output, client)
+    output_prefix = output_prefix.rstrip('/')
+
+    listing = [(key, size) for key, size in source_store.list(source_prefix) if key.endswith('.json')]
+    new = [(key, size) for key, size in listing if source_store.url(key) not in staged_keys]
+    if not new:
+        return None, []
+
+    parts = part_count(sum(size for key, size in new), slices, max_part_bytes)
+    target = sum(size for key, size in new) / parts
+    entries = []
+    part = []
+    part_bytes = 0
+
+    def flush():
+        data = b'\n'.join(part) + b'\n'
+        part_key = '/'.join(filter(None, [output_prefix, 'part-{:05d}.json'.format(len(entries))]))
+        output_store.write(part_key, data)
+        entries.append({'url': output_store.url(part_key), 'mandatory': True,
+                        'meta': {'content_length': len(data)}})
+
+    for key, size in new:
+        for record in iter_records(source_store.read(key)):
+            part.append(record)
+            part_bytes += len(record) + 1
+            if part_bytes >= target and len(entries) < parts - 1:
+                flush()
+                part, part_bytes = [], 0
+    if part:
+        flush()
+
+    manifest_key = '/'.join(filter(None, [output_prefix, 'manifest.json']))
+    output_store.write(manifest_key, json.dumps({'entries': entries}, indent=2).encode('utf8'))
+    return output_store.url(manifest_key), [source_store.url(key) for key, size in new]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a COPY manifest of the source objects not staged yet.')
+    parser.add_argument('source', help="'s3://bucket/prefix' or local directory")
+    parser.add_argument('output', help="'s3://bucket/prefix' or local directory for parts and manifest")
+    parser.add_argument('--slices', type=int, required=True, help='slice count of the cluster')
+    parser.add_argument('--staged', help='file listing staged source urls, one per line')
+    args = parser.parse_args()
+
+    staged_keys = set()
+    if args.staged and os.path.exists(args.staged):
+        with open(args.staged) as f:
+            staged_keys = {line.strip() for line in f if line.strip()}
+
+    manifest, new = plan_staging(args.source, args.output, staged_keys, args.slices)
+    print('{} new objects, manifest {}'.format(len(new), manifest))
+
+
+if __name__ == "__main__":
+    main()
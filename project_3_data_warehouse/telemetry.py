@@ -0,0 +1,185 @@
+import re
+import json
+import time
+import threading
+from datetime import datetime
+from sql_queries import query_group_set, last_copy_count_select, load_errors_select
+
+
+STATEMENT_TABLE = re.compile(r'^\s*(CREATE TABLE IF NOT EXISTS|DROP TABLE IF EXISTS|INSERT INTO|COPY|UPDATE|'
+                             r'DELETE FROM|TRUNCATE)\s+(\w+)', re.IGNORECASE)
+LOAD_ERROR_COLUMNS = ['query', 'filename', 'line_number', 'colname', 'type', 'raw_field_value', 'err_code', 'err_reason']
+
+
+def statement_label(query, labels=None):
+    """
+    Short name of a statement: its name in `labels`, else its kind and
+    table, e.g. 'copy staging_events', else its first line.
+    """
+    if labels and query in labels:
+        return labels[query]
+    match = STATEMENT_TABLE.match(query)
+    if match is None:
+        return query.strip().splitlines()[0][:64]
+    kind = match.group(1).split()[0].lower()
+    return '{} {}'.format(kind, match.group(2))
+
+
+def utc_now():
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+class RunReport:
+    """
+    Statement-level record of a run, written as a JSON run report.
+    - `cursor` wraps a cursor so every statement run on it is recorded with
+      its label, elapsed time and rows affected.
+    - With `load_errors`, a COPY that loaded while skipping rows records its
+      rows of stl_load_errors, at most `max_load_errors`. A failed COPY
+      records them once the caller has rolled back, see `rollback`.
+      Leave it off on databases without stl_load_errors.
+    - `write` adds the run totals and the share of the run each statement
+      took, so the step dominating the load window stands out.
+    Safe to share between threads.
+    """
+
+    def __init__(self, run, path=None, load_errors=True, max_load_errors=100):
+        self.run = run
+        self.path = path
+        self.load_errors = load_errors
+        self.max_load_errors = max_load_errors
+        self.started_at = utc_now()
+        self.start = time.perf_counter()
+        self.statements = []
+        self.lock = threading.Lock()
+
+    def cursor(self, cursor, label=None):
+        """
+        Cursor recording its statements in this report.
+
+        Parameters
+        ---------
+        cursor: psycopg2 cursor, or a cursor-like wrapper such as LocalCursor.
+        label: label of every statement, default `statement_label`.
+        """
+        return LabeledCursor(cursor, self, label)
+
+    def record(self, entry):
+        with self.lock:
+            self.statements.append(entry)
+
+    def summary(self, status='ok', error=None):
+        wall = time.perf_counter() - self.start
+        with self.lock:
+            statements = [dict(entry) for entry in self.statements]
+        for entry in statements:
+            entry['share'] = round(entry['elapsed_s'] / wall, 4) if wall else None
+        return {
+            'run': self.run,
+            'status': status,
+            'error': error,
+            'started_at': self.started_at,
+            'finished_at': utc_now(),
+            'wall_s': round(wall, 4),
+            'statement_s': round(sum(entry['elapsed_s'] for entry in statements), 4),
+            'slowest': [entry['label'] for entry in sorted(statements, key=lambda e: -e['elapsed_s'])[:5]],
+            'statements': statements,
+        }
+
+    def write(self, status='ok', error=None):
+        """
+        Write the JSON run report to `path`.
+
+        Returns
+        -------
+        report dict.
+        """
+        report = self.summary(status, error)
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+        return report
+
+
+class LabeledCursor:
+    """
+    Cursor wrapper tagging each statement with its label as the Redshift
+    query_group, so it can be found in STL_QUERY, and recording it in a RunReport.
+    The query_group stays set until the next statement, so results of a
+    SELECT can still be fetched. `rowcount` is the recorded rows affected.
+    Other attributes are those of the wrapped cursor.
+    """
+
+    def __init__(self, cursor, report, label=None):
+        self.cursor = cursor
+        self.report = report
+        self.label = label
+        self.rows = None
+        self.failed_copy = None
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    @property
+    def rowcount(self):
+        return -1 if self.rows is None else self.rows
+
+    def execute(self, query, args=None):
+        text = query.decode('utf8') if isinstance(query, bytes) else query
+        label = self.label or statement_label(text)
+        is_copy = text.lstrip().upper().startswith('COPY')
+        entry = {'label': label, 'started_at': utc_now(), 'status': 'ok'}
+        self.rows = None
+
+        self.cursor.execute(query_group_set, (label,))
+        start = time.perf_counter()
+        try:
+            self.cursor.execute(query, args)
+        except Exception as e:
+            entry.update({'elapsed_s': round(time.perf_counter() - start, 4), 'rows': None,
+                          'status': 'failed', 'error': str(e).strip()})
+            if is_copy and self.report.load_errors:
+                # the failed COPY aborted the caller's transaction, which is
+                # the caller's to roll back; its errors are read after that
+                self.failed_copy = entry
+            self.report.record(entry)
+            raise
+        entry['elapsed_s'] = round(time.perf_counter() - start, 4)
+        entry['rows'] = self.cursor.rowcount if self.cursor.rowcount >= 0 else None
+
+        if is_copy and self.report.load_errors:
+            self.cursor.execute(last_copy_count_select)
+            entry['rows'] = self.cursor.fetchone()[0]
+            entry['load_errors'] = self.fetch_load_errors()
+            if entry['load_errors']:
+                # loaded with MAXERROR, skipping the rows in error
+                entry['status'] = 'partial'
+        self.rows = entry['rows']
+        self.report.record(entry)
+
+    def record_load_errors(self):
+        """
+        Record the rows of stl_load_errors of the last failed COPY in its
+        report entry. Run it once the caller has rolled back the COPY's
+        transaction, on the same connection: pg_last_copy_id() is per session.
+        """
+        entry, self.failed_copy = self.failed_copy, None
+        if entry is None:
+            return
+        load_errors = self.fetch_load_errors()
+        with self.report.lock:
+            entry['load_errors'] = load_errors
+
+    def fetch_load_errors(self):
+        self.cursor.execute(load_errors_select, (self.report.max_load_errors,))
+        return [dict(zip(LOAD_ERROR_COLUMNS, row)) for row in self.cursor.fetchall()]
+
+
+def rollback(conn, cur):
+    """
+    Roll back `conn`, then, when `cur` is a LabeledCursor whose COPY failed,
+    record that COPY's rows of stl_load_errors.
+    """
+    conn.rollback()
+    if isinstance(cur, LabeledCursor):
+        cur.record_load_errors()
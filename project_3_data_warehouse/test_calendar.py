@@ -0,0 +1,41 @@
+from local_redshift import LocalCursor
+from sql_queries import create_table_queries, time_table_insert
+
+
+DAY_MS = 86400000
+FIRST_DAY = 17836  # 2018-11-01
+
+
+def stage_events(cur, *timestamps):
+    cur.execute('TRUNCATE staging_events')
+    for ts in timestamps:
+        cur.execute("INSERT INTO staging_events (ts, page) VALUES (%s, 'NextSong')", (ts,))
+
+
+def extend(cur):
+    cur.execute('SELECT COUNT(*) FROM time')
+    before = cur.fetchone()[0]
+    cur.execute(time_table_insert)
+    cur.execute('SELECT COUNT(*) FROM time')
+    return cur.fetchone()[0] - before
+
+
+def test_calendar_extends_only_to_new_days(conn):
+    cur = LocalCursor(conn.cursor())
+    for query in create_table_queries:
+        cur.execute(query)
+
+    # no staged event, or none in the [CALENDAR] days, adds nothing
+    assert extend(cur) == 0
+    stage_events(cur, 0, 5000000000000)
+    assert extend(cur) == 0
+
+    stage_events(cur, FIRST_DAY * DAY_MS + 1000, (FIRST_DAY + 1) * DAY_MS + 5000)
+    assert extend(cur) == 48
+    assert extend(cur) == 0
+
+    stage_events(cur, (FIRST_DAY + 2) * DAY_MS + 3600000 * 23)
+    assert extend(cur) == 24
+    cur.execute('SELECT MIN(start_time), MAX(start_time), COUNT(DISTINCT start_time) FROM time')
+    first, last, hours = cur.fetchone()
+    assert (str(first), str(last), hours) == ('2018-11-01 00:00:00', '2018-11-03 23:00:00', 72)
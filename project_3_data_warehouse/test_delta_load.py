@@ -0,0 +1,101 @@
+import os
+import shutil
+import configparser
+import pytest
+import etl
+from benchmark import write_synthetic_data, data_locations
+from local_redshift import LocalCursor
+from sql_queries import create_table_queries, drop_table_queries, copy_table_queries, insert_table_queries, \
+    delta_table_queries
+
+
+DAYS = 4
+TABLES = {
+    'songplays': 'start_time, user_id, level, song_id, artist_id, session_id, location, user_agent',
+    'users': '*', 'songs': '*', 'artists': '*', 'time': '*',
+}
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp('synthetic'))
+    write_synthetic_data(data_dir, 4000, 400, days=DAYS)
+    return data_dir
+
+
+def cursor(conn, data_dir):
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    return LocalCursor(conn.cursor(), data_locations(config, data_dir))
+
+
+def first_days(data_dir, days, out_dir):
+    """
+    Copy of the synthetic data holding only the first `days` days of events.
+    """
+    shutil.copytree(os.path.join(data_dir, 'song_data'), os.path.join(out_dir, 'song_data'))
+    shutil.copy(os.path.join(data_dir, 'log_json_path.json'), out_dir)
+    for root, dirs, files in os.walk(os.path.join(data_dir, 'log_data')):
+        for name in sorted(files)[:days]:
+            target = os.path.join(out_dir, os.path.relpath(root, data_dir))
+            os.makedirs(target, exist_ok=True)
+            shutil.copy(os.path.join(root, name), target)
+    return out_dir
+
+
+def run(cur, conn, queries):
+    for query in queries:
+        cur.execute(query)
+    conn.commit()
+
+
+def tables(cur):
+    rows = {}
+    for table, columns in TABLES.items():
+        cur.execute('SELECT {} FROM {}'.format(columns, table))
+        rows[table] = sorted(cur.fetchall(), key=repr)
+    return rows
+
+
+def full_load(conn, data_dir):
+    cur = cursor(conn, data_dir)
+    run(cur, conn, create_table_queries + copy_table_queries + insert_table_queries)
+    loaded = tables(cur)
+    # staging_events_table_drop names staing_events
+    run(cur, conn, drop_table_queries + ['DROP TABLE IF EXISTS staging_events'])
+    return loaded
+
+
+def test_delta_load_from_empty_matches_full_load_and_reruns_add_nothing(conn, data_dir):
+    full = full_load(conn, data_dir)
+    assert len(full['songplays']) > 0
+
+    cur = cursor(conn, data_dir)
+    run(cur, conn, create_table_queries)
+    etl.load_incremental(cur, conn)
+    assert tables(cur) == full
+
+    etl.load_incremental(cur, conn)
+    assert tables(cur) == full
+
+
+def test_watermark_moves_forward(conn, data_dir, tmp_path):
+    full = full_load(conn, data_dir)
+
+    cur = cursor(conn, first_days(data_dir, 2, str(tmp_path / 'first_days')))
+    run(cur, conn, create_table_queries)
+    etl.load_incremental(cur, conn)
+    cur.execute('SELECT ts FROM load_watermark')
+    first_watermark = cur.fetchone()[0]
+    cur.execute('SELECT MAX(ts) FROM staging_events')
+    assert first_watermark == cur.fetchone()[0]
+    assert 0 < len(tables(cur)['songplays']) < len(full['songplays'])
+
+    # every day is staged again; only the events after the watermark are new
+    cur = cursor(conn, data_dir)
+    etl.load_incremental(cur, conn)
+    cur.execute('SELECT ts FROM load_watermark')
+    watermark = cur.fetchone()[0]
+    cur.execute('SELECT MAX(ts) FROM staging_events')
+    assert watermark == cur.fetchone()[0] and watermark > first_watermark
+    assert tables(cur) == full
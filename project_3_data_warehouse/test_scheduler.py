@@ -0,0 +1,123 @@
+import time
+import threading
+import pytest
+from scheduler import check_graph, run_graph
+
+
+class Pool:
+    """
+    Connection pool stand-in: each statement sleeps `durations[query]`
+    seconds, 'fail' queries raise, and starts, commits and rollbacks are
+    logged in order.
+    """
+
+    def __init__(self, durations=None):
+        self.durations = durations or {}
+        self.lock = threading.Lock()
+        self.log = []
+        self.running = 0
+        self.max_running = 0
+
+    def getconn(self):
+        return Connection(self)
+
+    def putconn(self, conn):
+        pass
+
+    def event(self, *event):
+        with self.lock:
+            self.log.append(event)
+
+    def index(self, *event):
+        return self.log.index(event)
+
+
+class Connection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.query = None
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, args=None):
+        pool = self.pool
+        self.query = query
+        with pool.lock:
+            pool.running += 1
+            pool.max_running = max(pool.max_running, pool.running)
+            pool.log.append(('start', query))
+        time.sleep(pool.durations.get(query, 0.01))
+        with pool.lock:
+            pool.running -= 1
+        if query.startswith('fail'):
+            raise RuntimeError(query)
+
+    def commit(self):
+        self.pool.event('commit', self.query)
+
+    def rollback(self):
+        self.pool.event('rollback', self.query)
+
+
+def steps_of(depends):
+    return {name: (name, names) for name, names in depends.items()}
+
+
+GRAPH = steps_of({
+    'events': [], 'songs': [], 'plays': ['events'], 'keys': ['songs'],
+    'users': ['events'], 'artists': ['songs'], 'songplays': ['plays', 'keys'],
+})
+
+
+def test_check_graph_orders_dependencies_first():
+    order = check_graph(GRAPH)
+    assert sorted(order) == sorted(GRAPH)
+    for name, (query, depends) in GRAPH.items():
+        assert all(order.index(dependency) < order.index(name) for dependency in depends)
+
+
+def test_check_graph_rejects_unknown_dependencies_and_cycles():
+    with pytest.raises(ValueError, match='a depends on unknown step b'):
+        check_graph(steps_of({'a': ['b']}))
+    with pytest.raises(ValueError, match='dependency cycle: a -> b -> c -> a'):
+        check_graph(steps_of({'a': ['b'], 'b': ['c'], 'c': ['a']}))
+
+    pool = Pool()
+    with pytest.raises(ValueError):
+        run_graph(pool, steps_of({'a': ['a']}))
+    assert pool.log == []
+
+
+def test_steps_start_after_their_dependencies_commit():
+    pool = Pool({'events': 0.05, 'keys': 0.03})
+    timings = run_graph(pool, GRAPH, parallelism=4)
+
+    assert sorted(timings) == sorted(GRAPH)
+    for name, (query, depends) in GRAPH.items():
+        assert pool.index('commit', name) > pool.index('start', name)
+        for dependency in depends:
+            assert pool.index('start', name) > pool.index('commit', dependency)
+            assert timings[name][0] >= timings[dependency][1]
+
+
+@pytest.mark.parametrize('parallelism', [1, 2, 3])
+def test_running_steps_are_capped(parallelism):
+    pool = Pool({name: 0.03 for name in 'abcdef'})
+    run_graph(pool, steps_of({name: [] for name in 'abcdef'}), parallelism)
+    assert pool.max_running == parallelism
+    if parallelism == 1:
+        # ready steps start in declaration order
+        assert [query for event, query in pool.log if event == 'start'] == list('abcdef')
+
+
+def test_failed_step_stops_the_graph():
+    pool = Pool({'slow': 0.1})
+    steps = steps_of({'fail': [], 'slow': [], 'after_slow': ['slow'], 'after_fail': ['fail'], 'waiting': []})
+    with pytest.raises(RuntimeError, match='fail'):
+        run_graph(pool, steps, parallelism=2)
+
+    # the running step finishes, nothing starts after the failure
+    assert ('rollback', 'fail') in pool.log and ('commit', 'fail') not in pool.log
+    assert ('commit', 'slow') in pool.log
+    assert sorted(query for event, query in pool.log if event == 'start') == ['fail', 'slow']
@@ -0,0 +1,68 @@
+import os
+import json
+from staging_plan import plan_staging, part_count
+
+
+def write_log(directory, name, events):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), 'w') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def write_song(directory, name, song):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), 'w') as f:
+        json.dump(song, f, indent=2)
+
+
+def manifest_records(manifest_url):
+    with open(manifest_url) as f:
+        entries = json.load(f)['entries']
+    records = []
+    for entry in entries:
+        with open(entry['url'], 'rb') as f:
+            data = f.read()
+        assert entry['meta']['content_length'] == len(data)
+        records.append([json.loads(line) for line in data.splitlines()])
+    return records
+
+
+def test_part_count_is_a_multiple_of_slices():
+    assert part_count(10, 4, 100) == 4
+    assert part_count(400, 4, 100) == 4
+    assert part_count(401, 4, 100) == 8
+    assert part_count(3000, 6, 100) == 30
+
+
+def test_new_log_objects_split_into_a_multiple_of_slices(tmp_path):
+    source = str(tmp_path / 'log_data')
+    for day in range(1, 4):
+        write_log(os.path.join(source, '2018', '11'), '2018-11-{:02d}-events.json'.format(day),
+                  [{'ts': day * 1000 + item, 'page': 'NextSong'} for item in range(200)])
+
+    manifest, new = plan_staging(source, str(tmp_path / 'staging'), set(), slices=4, max_part_bytes=2000)
+
+    parts = manifest_records(manifest)
+    assert len(new) == 3
+    assert len(parts) % 4 == 0 and len(parts) == part_count(sum(os.path.getsize(url) for url in new), 4, 2000)
+    events = [event['ts'] for part in parts for event in part]
+    assert sorted(events) == [day * 1000 + item for day in range(1, 4) for item in range(200)]
+
+
+def test_staged_objects_are_skipped(tmp_path):
+    source = str(tmp_path / 'song_data')
+    for name in ['A', 'B']:
+        write_song(os.path.join(source, 'A'), 'TR{}.json'.format(name), {'song_id': name, 'title': name})
+
+    manifest, staged = plan_staging(source, str(tmp_path / 'staging_1'), set(), slices=2)
+    assert len(staged) == 2
+
+    manifest, new = plan_staging(source, str(tmp_path / 'staging_2'), set(staged), slices=2)
+    assert manifest is None and new == []
+
+    write_song(os.path.join(source, 'B'), 'TRC.json', {'song_id': 'C', 'title': 'C'})
+    manifest, new = plan_staging(source, str(tmp_path / 'staging_3'), set(staged), slices=2)
+    assert [os.path.basename(url) for url in new] == ['TRC.json']
+    # a single record makes a single part
+    assert manifest_records(manifest) == [[{'song_id': 'C', 'title': 'C'}]]